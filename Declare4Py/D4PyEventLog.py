@@ -7,15 +7,27 @@ from packaging import version
 import warnings
 from mlxtend.frequent_patterns import fpgrowth, apriori
 
+import numpy as np
+import pandas as pd
 import pm4py
 from pm4py.objects.log.obj import EventLog, Trace
+from scipy import sparse
 
-from typing import List, Optional, Tuple, Dict
+from typing import Any, List, Optional, Tuple, Dict
 
 from pandas import DataFrame
 from Declare4Py.Encodings.Aggregate import Aggregate
 
 
+def _popcount(bitset: int) -> int:
+    # int.bit_count is only available from Python 3.10
+    return bin(bitset).count("1")
+
+
+if hasattr(int, "bit_count"):
+    _popcount = int.bit_count
+
+
 class D4PyEventLog:
     """
     Wrapper that collects the input log, the computed binary encoding and frequent item set for the input log.
@@ -45,6 +57,11 @@ class D4PyEventLog:
             self.activity_key: Optional[str] = None
             self.timestamp_key: Optional[str] = None
         self.case_id_key: str = case_name
+        # cache of the attribute encodings, valid as long as 'log' refers to the same object
+        self._encoded_log = None
+        self._attribute_encodings: Dict[str, Tuple[List[Any], np.ndarray, np.ndarray]] = {}
+        self._occurrence_indexes: Dict[str, Tuple[List[Any], sparse.csr_matrix]] = {}
+        self._position_indexes: Dict[Tuple[str, int], Dict[Any, np.ndarray]] = {}
 
     def parse_xes_log(self, log_path: str) -> None:
         """
@@ -224,6 +241,173 @@ class D4PyEventLog:
             print(f"{e} attribute does not exist. Check the log.")
         return projection
 
+    def attribute_log_encoding(self, attribute_name: str) -> Tuple[List[Any], np.ndarray, np.ndarray]:
+        """
+        Interns the values of the input attribute and returns the log as a compact integer encoding. The events of the
+        i-th trace are the ones between positions offsets[i] and offsets[i + 1] of the codes array. Events missing the
+        attribute are encoded as -1. The encoding is cached until the log is replaced.
+
+        Args:
+            attribute_name: the name of the event attribute to encode, e.g., 'concept:name'.
+
+        Returns:
+            the list of distinct attribute values (indexed by code), the trace offsets and the event codes.
+        """
+        if self.log is None:
+            raise RuntimeError("You must load a log before.")
+        if self._encoded_log is not self.log:
+            self._encoded_log = self.log
+            self._attribute_encodings = {}
+            self._occurrence_indexes = {}
+            self._position_indexes = {}
+        if attribute_name in self._attribute_encodings:
+            return self._attribute_encodings[attribute_name]
+
+        if isinstance(self.log, DataFrame):
+            trace_ids, _ = pd.factorize(self.log[self.case_id_key], sort=False)
+            order = np.argsort(trace_ids, kind="stable")
+            offsets = np.zeros(trace_ids.max(initial=-1) + 2, dtype=np.int64)
+            np.cumsum(np.bincount(trace_ids), out=offsets[1:])
+            if attribute_name in self.log.columns:
+                codes, uniques = pd.factorize(self.log[attribute_name].to_numpy()[order], sort=False)
+                values = list(uniques)
+            else:
+                codes, values = np.full(len(order), -1, dtype=np.int64), []
+        else:
+            values_idx = {}
+            offsets = np.zeros(len(self.log) + 1, dtype=np.int64)
+            codes = []
+            for i, trace in enumerate(self.log):
+                for event in trace:
+                    value = event.get(attribute_name)
+                    codes.append(-1 if value is None else values_idx.setdefault(value, len(values_idx)))
+                offsets[i + 1] = len(codes)
+            codes = np.array(codes, dtype=np.int64)
+            values = list(values_idx.keys())
+
+        self._attribute_encodings[attribute_name] = (values, offsets, codes)
+        return values, offsets, codes
+
+    def attribute_occurrence_index(self, attribute_name: str) -> Tuple[List[Any], sparse.csr_matrix]:
+        """
+        Indexes the traces containing each value of the input attribute: the sparse co-occurrence matrix counts the
+        traces containing each couple of values, its diagonal being the number of traces containing each value. Only
+        the couples of values occurring together in some trace are stored. The matrix is computed in one pass over the
+        interned encoding and cached until the log is replaced.
+
+        Args:
+            attribute_name: the name of the event attribute to index, e.g., 'concept:name'.
+
+        Returns:
+            the list of distinct attribute values (indexed by code) and the co-occurrence matrix.
+        """
+        values, offsets, codes = self.attribute_log_encoding(attribute_name)
+        if attribute_name in self._occurrence_indexes:
+            return self._occurrence_indexes[attribute_name]
+
+        pair_traces, pair_codes = self._trace_value_pairs(offsets, codes, len(values))
+        occurrences = sparse.csc_matrix((np.ones(len(pair_codes), dtype=np.int64), (pair_traces, pair_codes)),
+                                        shape=(len(offsets) - 1, len(values)))
+        co_occurrences = (occurrences.T @ occurrences).tocsr()
+
+        self._occurrence_indexes[attribute_name] = (values, co_occurrences)
+        return values, co_occurrences
+
+    @staticmethod
+    def _trace_value_pairs(offsets: np.ndarray, codes: np.ndarray, n_values: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the distinct couples (trace, code) of an interned encoding, sorted by trace and code.
+        """
+        trace_ids = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+        present = codes >= 0
+        # a trace contains a value once, no matter how many events carry it
+        pairs = np.unique(trace_ids[present] * n_values + codes[present])
+        return np.divmod(pairs, n_values) if n_values > 0 else (pairs, pairs)
+
+    def attribute_position_index(self, attribute_name: str, position: int) -> Dict[Any, np.ndarray]:
+        """
+        Indexes the traces by the value of the input attribute at a position, counted from the start of the traces
+        (0 being the first event) or from their end if negative (-1 being the last event), so that the traces having a
+        value at a position are found by a lookup instead of a scan of the log. Each position is indexed on its first
+        query, in one pass over the interned encoding, and cached until the log is replaced.
+
+        Args:
+            attribute_name: the name of the event attribute to index, e.g., 'concept:name'.
+            position: the position of the events in the traces.
+
+        Returns:
+            the sorted indices of the traces having each value at the position, by value.
+        """
+        values, offsets, codes = self.attribute_log_encoding(attribute_name)
+        if (attribute_name, position) in self._position_indexes:
+            return self._position_indexes[(attribute_name, position)]
+
+        lengths = np.diff(offsets)
+        trace_ids = np.flatnonzero(lengths > position if position >= 0 else lengths >= -position)
+        event_codes = codes[offsets[trace_ids] + position if position >= 0 else offsets[trace_ids + 1] + position]
+        trace_ids, event_codes = trace_ids[event_codes >= 0], event_codes[event_codes >= 0]
+        order = np.argsort(event_codes, kind="stable")
+        bounds = np.searchsorted(event_codes[order], np.arange(len(values) + 1))
+        index = {values[code]: trace_ids[order[bounds[code]:bounds[code + 1]]] for code in range(len(values))
+                 if bounds[code] < bounds[code + 1]}
+
+        self._position_indexes[(attribute_name, position)] = index
+        return index
+
+    def sample_trace_order(self, mode: str = "uniform", seed: Optional[int] = None) -> np.ndarray:
+        """
+        Returns a random permutation of the trace indices to be used as a sampling order: every prefix of the
+        permutation is a sample without replacement of the log.
+
+        Args:
+            mode: 'uniform' for a uniform permutation, 'variants' for a permutation stratified by the variants of the
+            log, i.e., each prefix contains the variants in proportion to their frequency. The latter is a systematic
+            sample with a random start per variant, not a simple random sample: the prefixes are not uniform samples
+            of the log.
+            seed: the seed of the random generator.
+
+        Returns:
+            the array of the trace indices in sampling order.
+        """
+        if self.log is None:
+            raise RuntimeError("You must load a log before.")
+        rng = np.random.default_rng(seed)
+        n_traces = self.get_length()
+        if mode == "uniform":
+            return rng.permutation(n_traces)
+        elif mode == "variants":
+            _, offsets, codes = self.attribute_log_encoding(self.activity_key)
+            variant_idx = {}
+            variant_ids = np.array([variant_idx.setdefault(tuple(codes[offsets[i]:offsets[i + 1]]), len(variant_idx))
+                                    for i in range(n_traces)], dtype=np.int64)
+            # the j-th sampled trace of a variant with N_h traces gets key (j + U) / N_h, U ~ Uniform[0, 1), so that
+            # sorting by key spreads each variant evenly along the permutation
+            variant_sizes = np.bincount(variant_ids)
+            shuffled = rng.permutation(n_traces)
+            by_variant = shuffled[np.argsort(variant_ids[shuffled], kind="stable")]
+            variant_starts = np.concatenate(([0], np.cumsum(variant_sizes)[:-1]))
+            rank = np.arange(n_traces) - np.repeat(variant_starts, variant_sizes)
+            sizes = np.repeat(variant_sizes, variant_sizes)
+            keys = (rank + rng.random(len(variant_sizes))[np.repeat(np.arange(len(variant_sizes)), variant_sizes)]) \
+                / sizes
+            return by_variant[np.argsort(keys, kind="stable")]
+        else:
+            raise RuntimeError(f"{mode} sampling not supported. Choose between uniform and variants")
+
+    def filter(self, sample_size: int = 32):
+        """
+        Starts a lazy chain of filters of the log, run in order of cost when executed, e.g.,
+        log.filter().start_activities(["A"]).ltl(model).to_event_log(), see FilterPlan.
+
+        Args:
+            sample_size: the number of distinct traces on which the selectivity of the LTL filters is estimated
+
+        Returns:
+            the FilterPlan of the log.
+        """
+        from Declare4Py.ProcessMiningTasks.LogFiltering.FilterPlan import FilterPlan
+        return FilterPlan(self, sample_size)
+
     def to_dataframe(self):
         if self.log is None:
             raise RuntimeError("You must load a log before.")
@@ -253,13 +437,20 @@ class D4PyEventLog:
             min_support: the minimum support of the returned item sets.
             case_id_col: the name of the log attribute containing the ids of the cases
             categorical_attributes: a list of strings containing the names of the attributes to be encoded. For example, 'concept:name' for the activity names and 'org:group' for the resources.
-            algorithm: the algorithm for extracting frequent itemsets, choose between 'fpgrowth' (default) and 'apriori'.
+            algorithm: the algorithm for extracting frequent itemsets, choose between 'fpgrowth' (default), 'apriori'
+            and 'bitset'. The latter mines the interned traces directly, without building the one-hot encoded log;
+            the former two mine the sparse one-hot encoded log built by the Aggregate encoder.
             len_itemset: the maximum length of the extracted itemsets.
         """
         if self.log is None:
             raise RuntimeError("You must load a log before.")
         if not 0 <= min_support <= 1:
             raise RuntimeError("Min. support must be in range [0, 1].")
+        if len_itemset is not None and len_itemset < 1:
+            raise RuntimeError(f"The parameter len_itemset must be greater than 0.")
+        if algorithm == 'bitset':
+            return self._bitset_frequent_itemsets(min_support, categorical_attributes, len_itemset,
+                                                  remove_column_prefix)
 
         with warnings.catch_warnings():
             warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -270,8 +461,8 @@ class D4PyEventLog:
                 raise RuntimeError(f"{attr_name} attribute does not exist. Check the log.")
 
         encoder: Aggregate = Aggregate(case_id_col=case_id_col, cat_cols=categorical_attributes,
-                                       num_cols=[], boolean=True)
-        binary_encoded_log = encoder.fit_transform(log_df)
+                                       num_cols=[], boolean=True, sparse=True)
+        binary_encoded_log = encoder.fit_transform(log_df).astype(pd.SparseDtype(bool, False))
         if remove_column_prefix:
             new_col_names = {}
             for col_name in binary_encoded_log.columns:
@@ -292,11 +483,51 @@ class D4PyEventLog:
         frequent_itemsets['length'] = frequent_itemsets['itemsets'].apply(lambda x: len(x))
         if len_itemset is None:
             return frequent_itemsets
-        elif len_itemset < 1:
-            raise RuntimeError(f"The parameter len_itemset must be greater than 0.")
         else:
             return frequent_itemsets[(frequent_itemsets['length'] <= len_itemset)]
 
+    def _bitset_frequent_itemsets(self, min_support: float, categorical_attributes: List[str],
+                                  len_itemset: Optional[int], remove_column_prefix: bool) -> DataFrame:
+        """
+        Eclat-like miner: each frequent item is mapped to a bitset whose i-th bit is set if the i-th trace contains the
+        item, and the support of an itemset is the popcount of the intersection of its bitsets. Itemsets longer than
+        'len_itemset' are never generated.
+        """
+        n_traces = self.get_length()
+        item_names = []
+        item_bitsets = []
+        for attr_name in categorical_attributes:
+            values, offsets, codes = self.attribute_log_encoding(attr_name)
+            if not values:
+                raise RuntimeError(f"{attr_name} attribute does not exist. Check the log.")
+            pair_traces, pair_codes = self._trace_value_pairs(offsets, codes, len(values))
+            item_supports = np.bincount(pair_codes, minlength=len(values)) / n_traces
+            # only the frequent items get a bitset
+            for code in np.flatnonzero(item_supports >= min_support):
+                bits = np.zeros(n_traces, dtype=bool)
+                bits[pair_traces[pair_codes == code]] = True
+                item_bitsets.append(int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little'))
+                item_names.append(str(values[code]) if remove_column_prefix else f"{attr_name}_{values[code]}")
+
+        supports, itemsets = [], []
+        # depth-first extension of each prefix with the items following its last one
+        stack = [((i,), bitset, _popcount(bitset)) for i, bitset in reversed(list(enumerate(item_bitsets)))]
+        while stack:
+            items, bitset, count = stack.pop()
+            supports.append(count / n_traces)
+            itemsets.append(frozenset(item_names[i] for i in items))
+            if len_itemset is not None and len(items) >= len_itemset:
+                continue
+            for j in range(len(item_bitsets) - 1, items[-1], -1):
+                new_bitset = bitset & item_bitsets[j]
+                new_count = _popcount(new_bitset)
+                if new_count / n_traces >= min_support:
+                    stack.append((items + (j,), new_bitset, new_count))
+
+        frequent_itemsets = DataFrame({'support': supports, 'itemsets': itemsets})
+        frequent_itemsets['length'] = frequent_itemsets['itemsets'].apply(lambda x: len(x))
+        return frequent_itemsets
+
     def save_xes(self, path: str):
         if self.log is None:
             raise RuntimeError("You must load a log before.")
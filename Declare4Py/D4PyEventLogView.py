@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+from typing import Any, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pm4py.objects.log.obj import EventLog, Trace
+
+from Declare4Py.D4PyEventLog import D4PyEventLog
+
+
+class TraceSelection(Sequence):
+    """
+    A read-only sequence of the traces of a log at the given indices, sharing the traces of the log.
+    """
+
+    def __init__(self, traces: Sequence, trace_indices: np.ndarray):
+        self.traces: Sequence = traces
+        self.trace_indices: np.ndarray = trace_indices
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Trace, TraceSelection]:
+        if isinstance(key, slice):
+            return TraceSelection(self.traces, self.trace_indices[key])
+        return self.traces[int(self.trace_indices[key])]
+
+    def __iter__(self) -> Iterator[Trace]:
+        traces = self.traces
+        for i in self.trace_indices:
+            yield traces[i]
+
+    def __len__(self) -> int:
+        return len(self.trace_indices)
+
+
+class D4PyEventLogView(D4PyEventLog):
+    """
+    A D4PyEventLog of a selection of the traces of another log, referencing the log and the indices of the selected
+    traces instead of copying them: selecting n traces costs an array of n indices. The view is accepted wherever a
+    D4PyEventLog is, e.g., by the analyzers, the miner and the encoders, its log being an EventLog of the selected
+    traces of the parent log, and its attribute encodings being derived from the ones of the parent log (see
+    attribute_log_encoding) instead of being computed again.
+
+    A view of a view references the log of the first one. If the log of the view is replaced (e.g., by to_dataframe),
+    the view behaves as a D4PyEventLog of the new log. Since pandas has no zero-copy selection of rows, the view of a
+    DataFrame log takes the rows of its traces, grouped by case.
+    """
+
+    def __init__(self, event_log: D4PyEventLog, trace_indices: Optional[np.ndarray] = None):
+        """
+        Args:
+            event_log: the parent log
+            trace_indices: the indices of the selected traces, in the order of the view / Default: all the traces
+        """
+        log = event_log.get_log()
+        n_traces = len(event_log.attribute_log_encoding(event_log.activity_key)[1]) - 1 \
+            if isinstance(log, DataFrame) else len(log)
+        if trace_indices is None:
+            trace_indices = np.arange(n_traces, dtype=np.int64)
+        trace_indices = np.asarray(trace_indices, dtype=np.int64)
+        if len(trace_indices) > 0 and (trace_indices.min() < 0 or trace_indices.max() >= n_traces):
+            raise RuntimeError("The index of the trace must be lower than the log size.")
+        if isinstance(event_log, D4PyEventLogView) and event_log.is_view():
+            trace_indices, event_log = event_log.trace_indices[trace_indices], event_log.parent
+            log = event_log.get_log()
+
+        super().__init__(case_name=event_log.case_id_key)
+        self.parent: D4PyEventLog = event_log
+        self.trace_indices: np.ndarray = trace_indices
+        self._parent_log = log
+        if isinstance(log, DataFrame):
+            # the rows of the selected traces, in the order of the events of the encoding
+            offsets = event_log.attribute_log_encoding(event_log.activity_key)[1]
+            trace_ids, _ = pd.factorize(log[event_log.case_id_key], sort=False)
+            rows = np.argsort(trace_ids, kind="stable")
+            self.log = log.iloc[rows[self._event_positions(offsets)[0]]]
+        else:
+            self.log = EventLog(attributes=log.attributes, extensions=log.extensions, omni_present=log.omni_present,
+                                classifiers=log.classifiers, properties=log.properties)
+            self.log._list = TraceSelection(log._list, trace_indices)
+        self._view_log = self.log
+        self.log_length = len(trace_indices)
+        self.activity_key = event_log.activity_key
+        self.timestamp_key = event_log.timestamp_key
+
+    def is_view(self) -> bool:
+        """
+        Returns whether the log is still the selection of the traces of the parent log, i.e., it was not replaced.
+        """
+        return self.log is self._view_log and self.parent.log is self._parent_log
+
+    def select(self, trace_indices: np.ndarray) -> D4PyEventLogView:
+        """
+        Returns the view of the traces at the given indices of this view.
+        """
+        return D4PyEventLogView(self, trace_indices)
+
+    def attribute_log_encoding(self, attribute_name: str) -> Tuple[List[Any], np.ndarray, np.ndarray]:
+        """
+        Returns the encoding of the attribute as D4PyEventLog.attribute_log_encoding does, gathering the codes of the
+        selected traces from the encoding of the parent log. The values are interned again in order of occurrence, so
+        that the encoding is the one of a log of the selected traces.
+        """
+        if not self.is_view():
+            return super().attribute_log_encoding(attribute_name)
+        if self._encoded_log is not self.log:
+            self._encoded_log = self.log
+            self._attribute_encodings = {}
+            self._occurrence_indexes = {}
+            self._position_indexes = {}
+        if attribute_name in self._attribute_encodings:
+            return self._attribute_encodings[attribute_name]
+
+        parent_values, parent_offsets, parent_codes = self.parent.attribute_log_encoding(attribute_name)
+        positions, offsets = self._event_positions(parent_offsets)
+        codes = parent_codes[positions]
+        present = codes >= 0
+        parent_codes_seen, first = np.unique(codes[present], return_index=True)
+        parent_codes_seen = parent_codes_seen[np.argsort(first, kind="stable")]
+        # the last entry recodes the missing values (-1)
+        recode = np.full(len(parent_values) + 1, -1, dtype=np.int64)
+        recode[parent_codes_seen] = np.arange(len(parent_codes_seen))
+        codes = recode[codes]
+        values = [parent_values[code] for code in parent_codes_seen]
+
+        self._attribute_encodings[attribute_name] = (values, offsets, codes)
+        return values, offsets, codes
+
+    def _event_positions(self, parent_offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the positions of the events of the selected traces in the encoding of the parent log, and their
+        offsets in the encoding of the view.
+        """
+        starts = parent_offsets[self.trace_indices]
+        lengths = parent_offsets[self.trace_indices + 1] - starts
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+        return positions, offsets
@@ -4,12 +4,16 @@ import numpy as np
 from time import time
 from typing import Union, List
 from pandas import DataFrame, Index
+from scipy import sparse
+from Declare4Py.Utils.Encodings.CaseGrouping import CaseGrouping, as_categories, dummy_matrix, dummy_vocabularies, \
+    sparse_frame
 
 
 class Aggregate(BaseEstimator, TransformerMixin):
     
     def __init__(self, case_id_col: str, cat_cols: List[str], num_cols: List[str] = [], boolean: bool = False,
-                 fillna: bool = True, aggregation_functions: List[str] = ('mean', 'max', 'min', 'sum')):
+                 fillna: bool = True, aggregation_functions: List[str] = ('mean', 'max', 'min', 'sum'),
+                 sparse: bool = False):
         """
         Parameters
         -------------------
@@ -23,6 +27,9 @@ class Aggregate(BaseEstimator, TransformerMixin):
             TRUE: Result the existence of a value as 1/0  / False: Count the frequency
         fillna        
             TRUE: replace NA to 0 value in dataframe / FALSE: keep NA           
+        sparse
+            TRUE: build the one-hot encoded values as a scipy sparse matrix and return a sparse DataFrame, which
+            scikit-learn estimators and the mlxtend miners accept as it is / FALSE: return a dense DataFrame
         """
         
         self.case_id_col = case_id_col  
@@ -31,11 +38,32 @@ class Aggregate(BaseEstimator, TransformerMixin):
         self.boolean = boolean    
         self.fillna = fillna       
         self.columns = None
+        self.vocabularies = None
         self.fit_time = 0
         self.transform_time = 0
         self.aggregation_functions = aggregation_functions
+        self.sparse = sparse
 
     def fit(self, X: Union[np.array, DataFrame], y=None):
+        """
+        Learns the values of the categorical attributes and the columns of the encoded matrix from the event log X, so
+        that transform returns the same columns for any log:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be fitted
+
+        Returns
+        ------------------
+        :rtype: Aggregate
+            The fitted encoder
+        """
+        start = time()
+
+        self._fit_vocabularies(X)
+
+        self.fit_time = time() - start
         return self
     
     def transform(self, X: Union[np.array, DataFrame], y=None) -> DataFrame:
@@ -54,14 +82,22 @@ class Aggregate(BaseEstimator, TransformerMixin):
         """
         
         start = time()
+
+        if self.columns is None:
+            self.fit(X)
         
         # transform numeric cols
         if len(self.num_cols) > 0:
             dt_numeric = X.groupby(self.case_id_col)[self.num_cols].agg(self.aggregation_functions)
             dt_numeric.columns = ['_'.join(col).strip() for col in dt_numeric.columns.values]
-            
-        # transform cat cols
-        dt_transformed = pd.get_dummies(X[self.cat_cols])
+
+        if self.sparse:
+            dt_transformed = self._sparse_transform(X, dt_numeric if len(self.num_cols) > 0 else None)
+            self.transform_time = time() - start
+            return dt_transformed
+
+        # transform cat cols, as the fitted columns
+        dt_transformed = pd.get_dummies(as_categories(X[self.cat_cols], self.vocabularies))
         dt_transformed[self.case_id_col] = X[self.case_id_col]
         del X
         if self.boolean:
@@ -77,19 +113,126 @@ class Aggregate(BaseEstimator, TransformerMixin):
         # fill missing values with 0-s
         if self.fillna:
             dt_transformed = dt_transformed.fillna(0)
-            
-        # add missing columns if necessary
-        if self.columns is None:
-            self.columns = dt_transformed.columns
-        else:
-            missing_cols = [col for col in self.columns if col not in dt_transformed.columns]
-            for col in missing_cols:
-                dt_transformed[col] = 0
-            dt_transformed = dt_transformed[self.columns]
         
         self.transform_time = time() - start
         return dt_transformed
 
+    def transform_prefixes(self, X: DataFrame, max_prefix_length: int = None) -> DataFrame:
+        """
+        Tranforms all the prefixes of lengths 1..max_prefix_length of the traces in the event log X into an aggregated
+        numeric matrix in one pass, as transform would do on each prefix. The aggregates are cumulative, i.e., the
+        ones of each prefix extend the ones of the previous prefix by its last event. Only the 'mean', 'max', 'min',
+        'sum' and 'count' aggregation functions are supported:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be transformed
+        max_prefix_length
+            maximum length of the prefixes / Default: the length of the traces
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            Transformed prefixes, indexed by (case, prefix_len)
+        """
+
+        start = time()
+
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        if self.columns is None:
+            in_prefixes = grouping.positions < (max_prefix_length if max_prefix_length is not None else np.inf)
+            self._fit_vocabularies(X.iloc[grouping.rows[in_prefixes]])
+        prefix_cases, prefix_lengths = grouping.prefix_cases(max_prefix_length)
+        last_events = grouping.nth_events(prefix_cases, prefix_lengths - 1)
+        plain_cols = self._plain_cols()
+
+        plain = [grouping.cumulative(grouping.column(X, col), 'max' if self.boolean else 'sum')[last_events]
+                 for col in plain_cols]
+        counts = self._dummy_counts(X, grouping.prefixes(max_prefix_length))
+        numeric = [grouping.cumulative(grouping.column(X, col), func)[last_events]
+                   for col in self.num_cols for func in self.aggregation_functions]
+
+        blocks = [counts]
+        if len(plain) > 0:
+            blocks.insert(0, sparse.csr_matrix(np.column_stack(plain)))
+        if len(numeric) > 0:
+            blocks.append(sparse.csr_matrix(np.column_stack(numeric)))
+        matrix = sparse.hstack(blocks, format='csr')
+        index = grouping.prefix_index(max_prefix_length)
+        if self.sparse:
+            dt_transformed = sparse_frame(matrix, index, self.columns, fillna=self.fillna)
+            self.transform_time = time() - start
+            return dt_transformed
+
+        dt_transformed = pd.DataFrame(matrix.toarray(), index=index, columns=self.columns)
+
+        # fill missing values with 0-s
+        if self.fillna:
+            dt_transformed = dt_transformed.fillna(0)
+
+        self.transform_time = time() - start
+        return dt_transformed
+
+    def _sparse_transform(self, X: DataFrame, dt_numeric: DataFrame = None) -> DataFrame:
+        """
+        Sparse counterpart of the categorical encoding of transform: the codes of the values of each categorical
+        column are the column indexes of a COO matrix whose row indexes are the codes of the cases, and its conversion
+        to CSR sums the duplicated entries, i.e., aggregates the events by case. Categorical columns that
+        pd.get_dummies would not encode (e.g., numeric ones) are aggregated as they are, as in the dense encoding.
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be transformed
+        dt_numeric: DataFrame
+            the aggregated numerical attributes, if any
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            Transformed event log as a sparse DataFrame
+        """
+
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        plain_cols = self._plain_cols()
+
+        blocks = []
+        if len(plain_cols) > 0:
+            grouped = X.groupby(self.case_id_col)[plain_cols]
+            dt_plain = grouped.max() if self.boolean else grouped.sum()
+            blocks.append(sparse.csr_matrix(dt_plain.to_numpy(dtype=float)))
+
+        blocks.append(self._dummy_counts(X, grouping))
+
+        if dt_numeric is not None:
+            blocks.append(sparse.csr_matrix(dt_numeric.to_numpy(dtype=float)))
+
+        matrix = sparse.hstack(blocks, format='csr')
+        return sparse_frame(matrix, grouping.cases, self.columns, fillna=self.fillna)
+
+    def _fit_vocabularies(self, X: DataFrame):
+        self.vocabularies = dummy_vocabularies(X, self.cat_cols)
+        dummy_names = [f"{col}_{value}" for col, values in self.vocabularies.items() for value in values]
+        numeric_names = [f"{col}_{func}" for col in self.num_cols for func in self.aggregation_functions]
+        self.columns = Index(self._plain_cols() + dummy_names + numeric_names)
+
+    def _plain_cols(self) -> List[str]:
+        """
+        Returns the categorical columns that pd.get_dummies does not encode, i.e., without a fitted vocabulary.
+        """
+        return [col for col in self.cat_cols if col not in self.vocabularies]
+
+    def _dummy_counts(self, X: DataFrame, grouping: CaseGrouping) -> sparse.csr_matrix:
+        """
+        Counts the occurrences of each fitted value of the dummy columns in each case of the grouping (1/0 if boolean).
+        """
+        counts = dummy_matrix({col: grouping.column(X, col) for col in self.vocabularies}, self.vocabularies,
+                              grouping.case_codes, grouping.n_cases)
+        if self.boolean:
+            counts.data = np.minimum(counts.data, 1)
+        return counts
+
     def get_feature_names(self) -> Index:
         """
         Print all attribute names in a Pandas DataFrame:
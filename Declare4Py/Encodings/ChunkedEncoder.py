@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import os
+import warnings
+from time import time
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pm4py
+from pandas import DataFrame, Index, MultiIndex
+from pm4py.objects.log.obj import EventLog
+from scipy import sparse
+
+from Declare4Py.D4PyEventLog import D4PyEventLog
+
+
+class ChunkedEncoder:
+    """
+    Encodes a log larger than memory with a fitted encoder, one chunk of cases at a time. The chunks must be
+    case-aligned, i.e., the events of a case are never split among chunks (see case_chunks and log_chunks to build
+    them), so that each chunk is encoded as the whole log would be, and the fitted vocabularies of the encoder give
+    the same columns to every chunk. The encoded chunks are returned as blocks (sparse if the encoder is) or written to
+    Parquet or npz files, so that only one chunk and its encoding are in memory at a time.
+
+    The encoder must be fitted before, e.g., on a sample of the cases containing the values of the categorical
+    attributes to be encoded.
+    """
+
+    def __init__(self, encoder, prefixes: bool = False, max_prefix_length: Optional[int] = None):
+        """
+        Parameters
+        -------------------
+        encoder
+            a fitted encoder of Declare4Py.Encodings, e.g., Aggregate or IndexBased
+        prefixes
+            TRUE: encode the prefixes of the traces, see transform_prefixes / FALSE: encode the traces
+        max_prefix_length
+            maximum length of the prefixes / Default: the length of the traces
+        """
+        if getattr(encoder, "columns", None) is None:
+            raise RuntimeError("The encoder must be fitted before encoding chunks, so that they have the same "
+                               "columns.")
+        self.encoder = encoder
+        self.prefixes = prefixes
+        self.max_prefix_length = max_prefix_length
+        self.transform_time = 0
+
+    def transform_chunks(self, chunks: Iterable[DataFrame]) -> Iterator[DataFrame]:
+        """
+        Encodes each case-aligned chunk of the log, lazily:
+
+        Parameters
+        -------------------
+        chunks
+            the chunks of the event log / Pandas DataFrames, e.g., from case_chunks
+
+        Returns
+        ------------------
+        :rtype: Iterator[DataFrame]
+            The encoded chunks, with the fitted columns
+        """
+        for chunk in chunks:
+            start = time()
+            if self.prefixes:
+                encoded = self.encoder.transform_prefixes(chunk, self.max_prefix_length)
+            else:
+                encoded = self.encoder.transform(chunk)
+            self.transform_time += time() - start
+            yield encoded
+
+    def write_chunks(self, chunks: Iterable[DataFrame], path: str, file_format: str = "npz") -> List[str]:
+        """
+        Encodes each case-aligned chunk of the log and writes it to a file of the directory path, named as
+        part-00000.npz, part-00001.npz, ...:
+
+        Parameters
+        -------------------
+        chunks
+            the chunks of the event log / Pandas DataFrames, e.g., from case_chunks
+        path
+            the directory of the files
+        file_format
+            'npz': a compressed sparse matrix of the (numerical) encoding, with the case identifiers and the columns,
+            see read_chunk / 'parquet': a Parquet file of the dense encoding, it requires pyarrow or fastparquet
+
+        Returns
+        ------------------
+        :rtype: List[str]
+            The paths of the written files, in order of the chunks
+        """
+        if file_format not in ("npz", "parquet"):
+            raise RuntimeError(f"{file_format} format not supported. Choose between npz and parquet")
+        os.makedirs(path, exist_ok=True)
+        paths = []
+        for i, encoded in enumerate(self.transform_chunks(chunks)):
+            file_path = os.path.join(path, f"part-{i:05d}.{file_format}")
+            if file_format == "npz":
+                self._save_npz(encoded, file_path)
+            else:
+                if hasattr(encoded, "sparse"):
+                    encoded = encoded.sparse.to_dense()
+                encoded.to_parquet(file_path)
+            paths.append(file_path)
+        return paths
+
+    @staticmethod
+    def _save_npz(encoded: DataFrame, file_path: str):
+        """
+        Saves an encoded chunk as scipy.sparse.save_npz does, so that load_npz reads its matrix, adding the case
+        identifiers (one array per level of the index) and the columns.
+        """
+        if hasattr(encoded, "sparse"):
+            matrix = encoded.sparse.to_coo().tocsr()
+        else:
+            matrix = sparse.csr_matrix(encoded.to_numpy(dtype=float))
+        index = {f"index_{i}": np.asarray(encoded.index.get_level_values(i)) for i in range(encoded.index.nlevels)}
+        index_types = [str(values.dtype) if values.dtype != object else "str" for values in index.values()]
+        index = {key: values.astype(str) if values.dtype == object else values for key, values in index.items()}
+        np.savez_compressed(file_path, format=np.array("csr"), shape=np.array(matrix.shape), data=matrix.data,
+                            indices=matrix.indices, indptr=matrix.indptr, columns=np.asarray(encoded.columns, dtype=str),
+                            index_names=np.array(["" if name is None else str(name) for name in encoded.index.names]),
+                            index_types=np.array(index_types), **index)
+
+    @staticmethod
+    def read_chunk(file_path: str) -> DataFrame:
+        """
+        Reads an encoded chunk written by write_chunks:
+
+        Parameters
+        -------------------
+        file_path
+            the path of a npz or Parquet file
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            The encoded chunk, as a sparse DataFrame if read from npz
+        """
+        if file_path.endswith(".parquet"):
+            return pd.read_parquet(file_path)
+        matrix = sparse.load_npz(file_path)
+        with np.load(file_path, allow_pickle=False) as loaded:
+            names = [name if name != "" else None for name in loaded["index_names"]]
+            types = list(loaded["index_types"])
+            levels = [loaded[f"index_{i}"].astype(object if types[i] == "str" else types[i]) for i in range(len(names))]
+            columns = Index(loaded["columns"].astype(object))
+        index = MultiIndex.from_arrays(levels, names=names) if len(levels) > 1 else Index(levels[0], name=names[0])
+        return DataFrame.sparse.from_spmatrix(matrix, index=index, columns=columns)
+
+    @staticmethod
+    def case_chunks(chunks: Iterable[DataFrame], case_id_col: str) -> Iterator[DataFrame]:
+        """
+        Aligns chunks of rows of a log to its cases, e.g., the chunks of pd.read_csv(..., chunksize=n): the events of
+        the last case of each chunk are moved to the next chunk, so that no case is split. The events of each case
+        must be contiguous in the log.
+
+        Parameters
+        -------------------
+        chunks
+            the chunks of rows of the event log / Pandas DataFrames
+        case_id_col
+            a column indicating the case identifier in an event log
+
+        Returns
+        ------------------
+        :rtype: Iterator[DataFrame]
+            The case-aligned chunks
+        """
+        carry = None
+        for chunk in chunks:
+            if carry is not None:
+                chunk = pd.concat([carry, chunk])
+            cases = chunk[case_id_col].to_numpy()
+            if len(cases) == 0:
+                carry = chunk
+                continue
+            # first row of the last case of the chunk
+            last_start = len(cases) - np.argmax(cases[::-1] != cases[-1]) if (cases != cases[-1]).any() else 0
+            carry = chunk.iloc[last_start:]
+            if last_start > 0:
+                yield chunk.iloc[:last_start]
+        if carry is not None and len(carry) > 0:
+            yield carry
+
+    @staticmethod
+    def log_chunks(event_log: D4PyEventLog, n_cases: int) -> Iterator[DataFrame]:
+        """
+        Converts an event log to DataFrames of n_cases cases at a time:
+
+        Parameters
+        -------------------
+        event_log
+            the event log
+        n_cases
+            the number of cases of each chunk
+
+        Returns
+        ------------------
+        :rtype: Iterator[DataFrame]
+            The case-aligned chunks
+        """
+        log = event_log.get_log()
+        if isinstance(log, DataFrame):
+            # events grouped by case, in order of appearance of the cases
+            case_codes = pd.factorize(log[event_log.get_case_name()], sort=False)[0]
+            rows = np.flatnonzero(case_codes >= 0)
+            rows = rows[np.argsort(case_codes[rows], kind="stable")]
+            offsets = np.concatenate(([0], np.cumsum(np.bincount(case_codes[case_codes >= 0]))))
+            for start in range(0, len(offsets) - 1, n_cases):
+                yield log.iloc[rows[offsets[start]:offsets[min(start + n_cases, len(offsets) - 1)]]]
+            return
+        for start in range(0, len(log), n_cases):
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", category=DeprecationWarning)
+                yield pm4py.convert_to_dataframe(EventLog(log[start:start + n_cases], attributes=log.attributes,
+                                                          extensions=log.extensions, omni_present=log.omni_present,
+                                                          classifiers=log.classifiers, properties=log.properties))
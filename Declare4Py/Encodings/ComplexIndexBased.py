@@ -1,22 +1,24 @@
 from sklearn.base import TransformerMixin, BaseEstimator
-import pandas as pd
 import numpy as np
 from time import time
 from typing import Union, List
 from pandas import DataFrame, Index
+from Declare4Py.Utils.Encodings.CaseGrouping import CaseGrouping, add_durations, sparse_frame
 
 
 class ComplexIndexBased(BaseEstimator, TransformerMixin):
     
     def __init__(self, case_id_col: str, time_col: str, cat_cols: List[str], num_cols: List[str],
-                 max_events: int = None, fillna: bool = True, create_dummies: bool = True):
+                 max_events: int = None, fillna: bool = True, create_dummies: bool = True, sparse: bool = False):
         """
         Parameters
         -------------------
         case_id_col
             a column indicating the case identifier in an event log
         time_col
-            a column indicating the completed timestamp in an event log
+            a column indicating the completed timestamp in an event log, from which the duration of the events is
+            encoded. Their elapsed_time since the start of the case and remaining_time until its end are computed too,
+            and can be given as num_cols
         cat_cols
             columns indicating the categorical attributes in an event log
         num_cols
@@ -27,7 +29,11 @@ class ComplexIndexBased(BaseEstimator, TransformerMixin):
             TRUE: replace NA to 0 value in dataframe / FALSE: keep NA
         create_dummies        
             TRUE: transform categorical attributes as dummy attributes         
+        sparse
+            TRUE: return a sparse DataFrame, it requires create_dummies / FALSE: return a dense DataFrame
         """
+        if sparse and not create_dummies:
+            raise RuntimeError("The sparse output requires the create_dummies parameter.")
         
         self.case_id_col = case_id_col
         self.time_col = time_col
@@ -36,11 +42,40 @@ class ComplexIndexBased(BaseEstimator, TransformerMixin):
         self.max_events = max_events   
         self.fillna = fillna            
         self.create_dummies = create_dummies
+        self.sparse = sparse
         self.columns = None
+        self.vocabularies = None
         self.fit_time = 0
         self.transform_time = 0
 
     def fit(self, X: Union[np.array, DataFrame], y=None):
+        """
+        Learns the maximum prefix length (if not given), the values of the categorical attributes at each position and
+        the columns of the encoded matrix from the event log X, so that transform returns the same columns for any
+        log:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be fitted
+
+        Returns
+        ------------------
+        :rtype: ComplexIndexBased
+            The fitted encoder
+        """
+        start = time()
+
+        X = self._add_durations(X)
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        if self.max_events is None:
+            self.max_events = int(grouping.lengths.max())
+        self.vocabularies = grouping.index_vocabularies(X, self.cat_cols, self.max_events) \
+            if self.create_dummies else None
+        self.columns = Index(grouping.index_columns(['duration'] + self.cat_cols + self.num_cols, self.cat_cols,
+                                                    self.max_events, self.create_dummies, self.vocabularies))
+
+        self.fit_time = time() - start
         return self
     
     def transform(self, X: Union[np.array, DataFrame], y=None) -> DataFrame:
@@ -60,48 +95,31 @@ class ComplexIndexBased(BaseEstimator, TransformerMixin):
         
         start = time()
 
-        # transform timestamp col
-        if len([self.time_col]) > 0:
-            X[self.time_col] = pd.to_datetime(X[self.time_col])
-            X = X.sort_values([self.case_id_col, self.time_col], ascending=[True, True])
-            X['duration'] = X.groupby([self.case_id_col])[self.time_col].diff().apply(
-                lambda x:  x.total_seconds()).fillna(0)
-            X['duration'] = X['duration'].drop(0, axis=0).append(pd.Series(0)).reset_index(drop=True)
-            
-        grouped = X.groupby(self.case_id_col, as_index=False)
-            
-        if self.max_events is None:
-            self.max_events = max(grouped.size()['size'])  # changed by Jonghyeon from: grouped.size().max()
-        
-        dt_transformed = pd.DataFrame(grouped.apply(lambda x: x.name), columns=[self.case_id_col])
+        if self.columns is None:
+            self.fit(X)
 
-        for i in range(self.max_events):
-            dt_index = grouped.nth(i)[[self.case_id_col] + ['duration'] + self.cat_cols + self.num_cols]
-            dt_index.columns = [self.case_id_col] + ['duration_' + str(i)] + \
-                               [f"{col}_{i}" for col in self.cat_cols] + \
-                               [f"{col}_{i}" for col in self.num_cols]
-            dt_transformed = pd.merge(dt_transformed, dt_index, on=self.case_id_col, how="left")
-        dt_transformed.index = dt_transformed[self.case_id_col]
+        X = self._add_durations(X)
+        dt_transformed = self._encode(X, CaseGrouping.of(X, self.case_id_col))
+
+        self.transform_time = time() - start
+        return dt_transformed
 
-        # one-hot-encode cat cols
-        if self.create_dummies:
-            all_cat_cols = [f"{col}_{i}" for col in self.cat_cols for i in range(self.max_events)]
-            dt_transformed = pd.get_dummies(dt_transformed, columns=all_cat_cols).drop(self.case_id_col, axis=1)
+    def _add_durations(self, X: DataFrame) -> DataFrame:
+        return add_durations(X, self.case_id_col, self.time_col)
+
+    def _encode(self, X: DataFrame, grouping: CaseGrouping) -> DataFrame:
+        columns = ['duration'] + self.cat_cols + self.num_cols
+        if self.sparse:
+            matrix, columns = grouping.index_encoding(X, columns, self.cat_cols, self.max_events, as_sparse=True,
+                                                      vocabularies=self.vocabularies)
+            return sparse_frame(matrix, grouping.cases, columns, fillna=self.fillna)
+
+        dt_transformed = grouping.index_encoding(X, columns, self.cat_cols, self.max_events, self.create_dummies,
+                                                 vocabularies=self.vocabularies)
 
         # fill missing values with 0-s
         if self.fillna:
             dt_transformed = dt_transformed.fillna(0)
-
-        # add missing columns if necessary
-        if self.columns is None:
-            self.columns = dt_transformed.columns
-        else:
-            missing_cols = [col for col in self.columns if col not in dt_transformed.columns]
-            for col in missing_cols:
-                dt_transformed[col] = 0
-            dt_transformed = dt_transformed[self.columns]
-
-        self.transform_time = time() - start
         return dt_transformed
 
     def get_feature_names(self) -> Index:
@@ -2,14 +2,15 @@ from sklearn.base import TransformerMixin
 import pandas as pd
 import numpy as np
 from time import time
-from itertools import chain
 from typing import Union, List, Tuple, Set
 from pandas import DataFrame, Index, array
+from scipy import sparse
+from Declare4Py.Utils.Encodings.CaseGrouping import CaseGrouping, add_durations, sparse_frame
 
 
 class ComplexIndexNgram(TransformerMixin):
     
-    def __init__(self, case_id_col: str, act_col: str, n: int, v: float, time_col: str, cat_cols: List[str], num_cols: List[str], max_events: int = None, fillna: bool = True, create_dummies: bool = True):
+    def __init__(self, case_id_col: str, act_col: str, n: int, v: float, time_col: str, cat_cols: List[str], num_cols: List[str], max_events: int = None, fillna: bool = True, create_dummies: bool = True, sparse: bool = False):
         """
         Parameters
         -------------------
@@ -22,7 +23,9 @@ class ComplexIndexNgram(TransformerMixin):
         v
             a decay factor parameter in n-gram, ranged in [0,1]    
         time_col
-            a column indicating the completed timestamp in an event log
+            a column indicating the completed timestamp in an event log, from which the duration of the events is
+            encoded. Their elapsed_time since the start of the case and remaining_time until its end are computed too,
+            and can be given as num_cols
         cat_cols
             columns indicating the categorical attributes in an event log
         num_cols
@@ -33,7 +36,11 @@ class ComplexIndexNgram(TransformerMixin):
             TRUE: replace NA to 0 value in dataframe / FALSE: keep NA
         create_dummies        
             TRUE: transform categorical attributes as dummy attributes         
+        sparse
+            TRUE: return a sparse DataFrame, it requires create_dummies / FALSE: return a dense DataFrame
         """
+        if sparse and not create_dummies:
+            raise RuntimeError("The sparse output requires the create_dummies parameter.")
         
         self.case_id_col = case_id_col
         self.act_col = act_col
@@ -48,9 +55,43 @@ class ComplexIndexNgram(TransformerMixin):
         self.max_events = max_events   
         self.fillna = fillna            
         self.create_dummies = create_dummies
+        self.sparse = sparse
+        self.ngram_vocabulary = None
+        self.vocabularies = None
     
     
     def fit(self, X: DataFrame, y=None):
+        """
+        Learns the n-grams of the activities, the maximum prefix length (if not given), the values of the categorical
+        attributes at each position and the columns of the encoded matrix from the event log X, so that transform
+        returns the same columns for any log:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be fitted
+
+        Returns
+        ------------------
+        :rtype: ComplexIndexNgram
+            The fitted encoder
+        """
+        start = time()
+
+        X = self._add_durations(X)
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        if self.max_events is None:
+            self.max_events = int(grouping.lengths.max())
+        self.ngram_vocabulary = grouping.ngram_vocabulary(X, self.act_col, self.n)
+        self.vocabularies = grouping.index_vocabularies(X, self.cat_cols, self.max_events) \
+            if self.create_dummies else None
+        activities, grams = self.ngram_vocabulary
+        ngram_list = ['|'.join(str(activities[code]) for code in gram) for gram in grams]
+        self.columns = Index(ngram_list + grouping.index_columns(['duration'] + self.cat_cols + self.num_cols,
+                                                                 self.cat_cols, self.max_events, self.create_dummies,
+                                                                 self.vocabularies))
+
+        self.fit_time = time() - start
         return self
     
     def transform(self, X: DataFrame, y=None) -> DataFrame:
@@ -70,61 +111,39 @@ class ComplexIndexNgram(TransformerMixin):
         """
         
         start = time()
-        
-        # transform timestamp col
-        if len([self.time_col]) > 0:
-            X[self.time_col] = pd.to_datetime(X[self.time_col])
-            X = X.sort_values([self.case_id_col, self.time_col], ascending=[True, True])
-            X['duration'] = X.groupby([self.case_id_col])[self.time_col].diff().apply(lambda x:  x.total_seconds()).fillna(0)
-            X['duration'] = X['duration'].drop(0, axis=0).append(pd.Series(0)).reset_index(drop = True)
-            
 
-        # transform activity col into ngram matrix
-        ngram = X.groupby([self.case_id_col], sort=False).apply(lambda x: (['|'.join( x[self.act_col][i:i+self.n]) for i in range(0,len(x[self.act_col])-self.n+1)]) )
+        if self.columns is None:
+            self.fit(X)
 
-        nested_list = list(ngram.values)
-        my_unnested_list = list(chain(*nested_list))
-        ngram_list = list(set(my_unnested_list))
-        
-        X2 = X.groupby([self.case_id_col], sort=False).apply(lambda x: np.array(x[self.act_col]) )
-        X2 = X2.apply(lambda x: self.func_ngram(x, n=self.n, v=0.7, ngram_list = ngram_list ))
-        
-        dt_transformed = pd.DataFrame(columns=  [i for i in ngram_list])
-        for i in range(len(X2)):
-            dt_transformed.loc[i] = X2[i]
+        X = self._add_durations(X)
+        dt_transformed = self._encode(X, CaseGrouping.of(X, self.case_id_col))
 
-        dt_transformed[self.case_id_col] = X2.index
-                    
-        grouped = X.groupby(self.case_id_col, as_index=False)    
-        if self.max_events is None:
-            self.max_events = max(grouped.size()['size'] ) 
+        self.transform_time = time() - start
+        return dt_transformed
 
-        for i in range(self.max_events):
-            dt_index = grouped.nth(i)[[self.case_id_col] + ['duration'] + self.cat_cols + self.num_cols]
-            dt_index.columns = [self.case_id_col] + ['duration_' + str(i)] + ["%s_%s"%(col, i) for col in self.cat_cols] + ["%s_%s"%(col, i) for col in self.num_cols]
-            dt_transformed = pd.merge(dt_transformed, dt_index, on=self.case_id_col, how="left")
-        dt_transformed.index = dt_transformed[self.case_id_col]
+    def _add_durations(self, X: DataFrame) -> DataFrame:
+        return add_durations(X, self.case_id_col, self.time_col)
+
+    def _encode(self, X: DataFrame, grouping: CaseGrouping) -> DataFrame:
+        columns = ['duration'] + self.cat_cols + self.num_cols
+
+        # transform activity col into ngram matrix
+        ngram_matrix, ngram_list = grouping.ngram_encoding(X, self.act_col, self.n, self.v, as_sparse=self.sparse,
+                                                           vocabulary=self.ngram_vocabulary)
+        if self.sparse:
+            index_matrix, index_columns = grouping.index_encoding(X, columns, self.cat_cols, self.max_events,
+                                                                  as_sparse=True, vocabularies=self.vocabularies)
+            return sparse_frame(sparse.hstack([ngram_matrix, index_matrix], format='csr'), grouping.cases,
+                                ngram_list + index_columns, fillna=self.fillna)
+
+        dt_transformed = pd.concat([pd.DataFrame(ngram_matrix, index=grouping.cases, columns=ngram_list),
+                                    grouping.index_encoding(X, columns, self.cat_cols, self.max_events,
+                                                            self.create_dummies, vocabularies=self.vocabularies)],
+                                   axis=1)
 
-        # one-hot-encode cat cols
-        if self.create_dummies:
-            
-            all_cat_cols = ["%s_%s"%(col, i) for col in self.cat_cols for i in range(self.max_events)]
-            dt_transformed = pd.get_dummies(dt_transformed, columns=all_cat_cols).drop(self.case_id_col, axis=1)
-        
         # fill missing values with 0-s
         if self.fillna:
             dt_transformed = dt_transformed.fillna(0)
-
-        # add missing columns if necessary
-        if self.columns is None:
-            self.columns = dt_transformed.columns
-        else:
-            missing_cols = [col for col in self.columns if col not in dt_transformed.columns]
-            for col in missing_cols:
-                dt_transformed[col] = 0
-            dt_transformed = dt_transformed[self.columns]
-
-        self.transform_time = time() - start
         return dt_transformed
         
      
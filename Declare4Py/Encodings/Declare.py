@@ -1,16 +1,14 @@
-import pdb
-
 from Declare4Py.D4PyEventLog import D4PyEventLog
 from sklearn.base import TransformerMixin, BaseEstimator
 import pandas as pd
 import numpy as np
 from time import time
-from typing import Union, List
+from typing import Union, List, Tuple
 from pandas import DataFrame, Index
+from pm4py.objects.log.obj import EventLog
 from Declare4Py.ProcessModels.DeclareModel import DeclareModel
 from Declare4Py.ProcessModels.DeclareModel import DeclareModelTemplate
-from Declare4Py.ProcessMiningTasks.ConformanceChecking.MPDeclareAnalyzer import MPDeclareAnalyzer
-from Declare4Py.ProcessMiningTasks.ConformanceChecking.MPDeclareResultsBrowser import MPDeclareResultsBrowser
+from Declare4Py.Utils.Declare.IncrementalChecker import IncrementalConstraintChecker, TraceCounters
 
 
 class Declare(BaseEstimator, TransformerMixin):
@@ -37,16 +35,88 @@ class Declare(BaseEstimator, TransformerMixin):
         self.transform_time = 0
         self.event_log = event_log
         self.max_declare_cardinality = max_declare_cardinality
+        self.declare_model = None
+        self.checker = None
+
+    def fit(self, X: Union[np.array, DataFrame] = None, y=None):
+        """
+        Mines the DECLARE constraints from the event log once and builds the incremental checker used to encode the
+        traces:
 
-    def fit(self, X: Union[np.array, DataFrame], y=None):
+        Returns
+        ------------------
+        :rtype: Declare
+            The fitted encoder
+        """
+        self.declare_model = self._mine_model()
+        self.checker = IncrementalConstraintChecker(self.declare_model)
+        self.columns = Index(self.declare_model.serialized_constraints)
         return self
-    
-    def transform(self, X: Union[np.array, DataFrame], y=None) -> DataFrame:
+
+    def transform(self, X: Union[D4PyEventLog, EventLog, DataFrame, None], y=None) -> DataFrame:
+        """
+        Tranforms the traces into a Declare encoded matrix, checking the constraints mined by fit on each trace one
+        event at a time:
+
+        Parameters
+        -------------------
+        X
+            the traces to encode: a D4PyEventLog, a pm4py EventLog or a DataFrame of events grouped by case in
+            order of appearance. Pass None (or the event log of the encoder) to encode the event log of the encoder,
+            e.g., Declare(log).fit().transform(None)
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            Transformed traces, indexed by their position in the log (by case for a DataFrame)
+        """
+        start = time()
+        if self.checker is None:
+            self.fit()
+        traces, cases = self._traces(X)
+        index = cases if isinstance(X, DataFrame) else pd.RangeIndex(len(traces))
+        dt_transformed = self._encode([self.checker.check_trace(trace) for trace in traces], index)
+        self.transform_time = time() - start
+        return dt_transformed
+
+    def transform_prefixes(self, X: Union[D4PyEventLog, EventLog, DataFrame, None],
+                           max_prefix_length: int = None) -> DataFrame:
+        """
+        Tranforms all the prefixes of lengths 1..max_prefix_length of the traces into a Declare encoded matrix,
+        checking the constraints mined by fit on each trace one event at a time and taking a row after each event:
+
+        Parameters
+        -------------------
+        X
+            the traces to encode, see transform. Pass None to encode the event log of the encoder
+        max_prefix_length
+            maximum length of the prefixes / Default: the length of the traces
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            Transformed prefixes, indexed by (case, prefix_len)
+        """
         start = time()
+        if self.checker is None:
+            self.fit()
+        traces, cases = self._traces(X)
+        results, prefix_cases, prefix_lengths = [], [], []
+        for case, trace in zip(cases, traces):
+            n_prefixes = len(trace) if max_prefix_length is None else min(len(trace), max_prefix_length)
+            results.append(self.checker.check_trace(trace, checkpoints=list(range(1, n_prefixes + 1))))
+            prefix_cases.extend([case] * n_prefixes)
+            prefix_lengths.extend(range(1, n_prefixes + 1))
+        index = pd.MultiIndex.from_arrays([prefix_cases, prefix_lengths], names=[self._case_id_col(), 'prefix_len'])
+        dt_transformed = self._encode(results, index)
+        self.transform_time = time() - start
+        return dt_transformed
+
+    def _mine_model(self) -> DeclareModel:
         frequent_itemsets = self.event_log.compute_frequent_itemsets(self.itemset_support,
                                                                      case_id_col=self.event_log.case_id_key,
                                                                      categorical_attributes=[self.act_col],
-                                                                     algorithm='fpgrowth', len_itemset=2,
+                                                                     algorithm='bitset', len_itemset=2,
                                                                      remove_column_prefix=True)
 
         declare_model = DeclareModel()
@@ -71,19 +141,86 @@ class Declare(BaseEstimator, TransformerMixin):
                 declare_model.constraints.append(constraint)
 
         declare_model.set_constraints()
+        return declare_model
 
-        basic_checker = MPDeclareAnalyzer(log=self.event_log, declare_model=declare_model, consider_vacuity=False)
-        conf_check_res: MPDeclareResultsBrowser = basic_checker.run()
+    def start_trace(self) -> TraceCounters:
+        """
+        Starts encoding a running trace, whose events are added one at a time with add_event:
 
-        df_activations = conf_check_res.get_metric(metric="num_activations")
-        df_state = conf_check_res.get_metric(metric="state")
-        df_transformed = df_state.combine(df_activations, self.combine_fulfillments_and_state)
-        self.columns = df_state.columns
-        self.transform_time = time() - start
+        Returns
+        ------------------
+        :rtype: TraceCounters
+            The state of the constraints on the empty trace
+        """
+        if self.checker is None:
+            self.fit()
+        return self.checker.start_trace()
+
+    def add_event(self, counters: TraceCounters, activity: str) -> None:
+        """
+        Adds an event to a running trace, updating only the constraints on its activity:
+
+        Parameters
+        -------------------
+        counters
+            the state of the constraints on the trace, see start_trace
+        activity
+            the activity of the event
+        """
+        self.checker.add_event(counters, activity)
+
+    def encode_trace(self, counters: TraceCounters) -> pd.Series:
+        """
+        Encodes a running trace as a row of the Declare encoded matrix:
+
+        Parameters
+        -------------------
+        counters
+            the state of the constraints on the trace, see start_trace
+
+        Returns
+        ------------------
+        :rtype: Series
+            Transformed trace
+        """
+        states, activations = self.checker.states(counters), self.checker.num_activations(counters)
+        return self._encode([(states[np.newaxis], activations[np.newaxis])], None).iloc[0]
+
+    def _traces(self, X: Union[D4PyEventLog, EventLog, DataFrame, None]) -> Tuple[List[List[str]], Index]:
+        """
+        Returns the activities of each trace to encode and the ids of their cases.
+        """
+        if isinstance(X, DataFrame):
+            grouped = list(X.groupby(self._case_id_col(), sort=False)[self.act_col])
+            return [list(activities) for _, activities in grouped], Index([case for case, _ in grouped],
+                                                                           name=self._case_id_col())
+        if X is None:
+            log = self.event_log.get_log()
+        else:
+            log = X.get_log() if isinstance(X, D4PyEventLog) else X
+        return [[event[self.act_col] for event in trace] for trace in log], \
+            Index([trace.attributes.get('concept:name') for trace in log], name=self._case_id_col())
+
+    def _case_id_col(self) -> str:
+        return self.event_log.case_id_key if self.event_log is not None else 'case:concept:name'
+
+    def _encode(self, results: List[Tuple[np.ndarray, np.ndarray]], index) -> DataFrame:
+        """
+        Builds the encoded matrix from the states and the numbers of activations of the constraints returned by the
+        incremental checker.
+        """
+        n_constraints = len(self.columns)
+        states = np.concatenate([result[0] for result in results]) if results \
+            else np.empty((0, n_constraints), dtype=np.int64)
+        df_state = pd.DataFrame(states, columns=self.columns, index=index)
         if self.boolean:
             return df_state
-        else:
-            return pd.DataFrame(df_transformed, columns=self.columns)
+        activations = np.concatenate([result[1] for result in results]) if results \
+            else np.empty((0, n_constraints))
+        # same values as combine_fulfillments_and_state, column-wise on the whole matrix
+        has_activations = ~np.isnan(activations).any(axis=0)
+        combined = np.where(states == 0, -1, np.where(has_activations, activations, states))
+        return pd.DataFrame(combined.astype(np.int64), columns=self.columns, index=index)
 
     def get_feature_names(self) -> Index:
         """
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import hashlib
+import inspect
+import os
+import pickle
+import warnings
+from time import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pm4py
+from pandas import DataFrame
+
+from Declare4Py.D4PyEventLog import D4PyEventLog
+from Declare4Py.Utils.Encodings.CaseGrouping import CaseGrouping, add_durations
+
+
+class EncodingPipeline:
+    """
+    Runs several encoders on the same event log, computing the intermediates they share once: the log DataFrame
+    sorted by case (keeping the order of the events of each trace), its case boundaries (see CaseGrouping.of), the
+    codes of the categorical attributes (cast to the category dtype) and the durations of the events (see
+    add_durations). Every encoder gets the same DataFrame object, so that they find the shared intermediates instead
+    of grouping and sorting the log again, and their encodings have the same (sorted) cases.
+
+    If a cache directory is given, the encodings are memoised on disk, keyed by the hash of the log and the
+    parameters of the encoder, together with the fitted state of the encoder (including the parameters learned by
+    fit, e.g., the max_events of IndexBased when not given): running an encoder with the same parameters again (e.g.,
+    in a hyperparameter sweep, or in another session) loads its encoding and fits the encoder without encoding the
+    log.
+    """
+
+    def __init__(self, event_log: D4PyEventLog, cat_cols: Optional[List[str]] = None, time_col: Optional[str] = None,
+                 cache_dir: Optional[str] = None):
+        """
+        Parameters
+        -------------------
+        event_log
+            the event log to be encoded
+        cat_cols
+            categorical attributes to be coded once as the category dtype, so that the one-hot encodings have a
+            dummy for every value of the attribute in the log, as pd.get_dummies does on category columns / Default:
+            none
+        time_col
+            a column indicating the completed timestamp, whose durations are computed once / Default: the timestamp
+            of the log
+        cache_dir
+            the directory where the encodings are memoised / Default: no memoisation
+        """
+        self.event_log = event_log
+        self.case_id_col = event_log.get_case_name()
+        self.cat_cols = cat_cols if cat_cols is not None else []
+        self.time_col = time_col if time_col is not None else event_log.get_timestamp_name()
+        self.cache_dir = cache_dir
+        self.prepare_time = 0
+        self._frame = None
+        self._log_hash = None
+
+    def get_frame(self) -> DataFrame:
+        """
+        Returns the DataFrame given to the encoders, computing the shared intermediates on the first call:
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            The log sorted by case, with the categorical attributes cast to the category dtype
+        """
+        if self._frame is None:
+            start = time()
+            log = self.event_log.get_log()
+            if isinstance(log, DataFrame):
+                frame = log.copy()
+            else:
+                with warnings.catch_warnings():
+                    warnings.filterwarnings("ignore", category=DeprecationWarning)
+                    frame = pm4py.convert_to_dataframe(log)
+            # cases sorted as by DataFrame.groupby, the events of each case keeping their order
+            case_codes = pd.factorize(frame[self.case_id_col], sort=True)[0]
+            frame = frame.iloc[np.argsort(case_codes, kind="stable")].reset_index(drop=True)
+            frame = frame.astype({col: "category" for col in self.cat_cols})
+            if self.time_col in frame.columns:
+                frame[self.time_col] = pd.to_datetime(frame[self.time_col])
+            self._log_hash = hashlib.sha1(pd.util.hash_pandas_object(frame, index=False).to_numpy()).hexdigest()
+            CaseGrouping.of(frame, self.case_id_col)
+            if self.time_col in frame.columns:
+                CaseGrouping.of(add_durations(frame, self.case_id_col, self.time_col), self.case_id_col)
+            self._frame = frame
+            self.prepare_time = time() - start
+        return self._frame
+
+    def encode(self, encoder, prefixes: bool = False, max_prefix_length: Optional[int] = None) -> DataFrame:
+        """
+        Fits the encoder on the log and encodes it, or loads the encoding memoised for the same log and parameters:
+
+        Parameters
+        -------------------
+        encoder
+            an encoder of Declare4Py.Encodings, e.g., Aggregate or Declare
+        prefixes
+            TRUE: encode the prefixes of the traces, see transform_prefixes / FALSE: encode the traces
+        max_prefix_length
+            maximum length of the prefixes / Default: the length of the traces
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            The encoded log
+        """
+        frame = self.get_frame()
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, f"{type(encoder).__name__}-"
+                                                f"{self._cache_key(encoder, prefixes, max_prefix_length)}.pkl")
+            if os.path.exists(path):
+                with open(path, "rb") as file:
+                    state, encoded = pickle.load(file)
+                vars(encoder).update(state)
+                return encoded
+
+        # the parameters before fitting, since some encoders learn the value of a parameter left to None (e.g., the
+        # max_events of IndexBased)
+        params = self._params(encoder)
+        encoder.fit(frame)
+        if prefixes:
+            encoded = encoder.transform_prefixes(frame, max_prefix_length)
+        else:
+            encoded = encoder.transform(frame)
+
+        if path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            state = {attr: value for attr, value in vars(encoder).items()
+                     if attr not in params or value is not params[attr]}
+            with open(path, "wb") as file:
+                pickle.dump((state, encoded), file)
+        return encoded
+
+    def encode_all(self, encoders: Dict[str, Any], prefixes: bool = False,
+                   max_prefix_length: Optional[int] = None) -> Dict[str, DataFrame]:
+        """
+        Encodes the log with each encoder, sharing the intermediates among them, see encode:
+
+        Parameters
+        -------------------
+        encoders
+            the encoders, by name
+        prefixes
+            TRUE: encode the prefixes of the traces / FALSE: encode the traces
+        max_prefix_length
+            maximum length of the prefixes / Default: the length of the traces
+
+        Returns
+        ------------------
+        :rtype: Dict[str, DataFrame]
+            The encoded log, by encoder name
+        """
+        return {name: self.encode(encoder, prefixes, max_prefix_length) for name, encoder in encoders.items()}
+
+    def _cache_key(self, encoder, prefixes: bool, max_prefix_length: Optional[int]) -> str:
+        """
+        Hashes the log, the encoder class and its parameters. The event logs among the parameters (e.g., the one of
+        the Declare encoder) are hashed by content, through the pipeline of the log when it is the encoded one.
+        """
+        params = []
+        for name, value in sorted(self._params(encoder).items()):
+            if isinstance(value, D4PyEventLog):
+                value = self.get_log_hash() if value is self.event_log else EncodingPipeline(value).get_log_hash()
+            params.append((name, repr(value)))
+        key = repr((self.get_log_hash(), type(encoder).__module__, type(encoder).__qualname__, params, prefixes,
+                    max_prefix_length))
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def get_log_hash(self) -> str:
+        """
+        Returns the hash of the content of the log, which keys its memoised encodings.
+        """
+        self.get_frame()
+        return self._log_hash
+
+    @staticmethod
+    def _params(encoder) -> Dict[str, Any]:
+        """
+        Returns the parameters of the encoder, i.e., the attributes named as the arguments of its constructor.
+        """
+        names = [name for name in inspect.signature(type(encoder).__init__).parameters if name != "self"]
+        return {name: getattr(encoder, name) for name in names if hasattr(encoder, name)}
@@ -1,7 +1,13 @@
+from __future__ import annotations
+
 import statistics
 from collections import defaultdict, OrderedDict
+from datetime import timedelta
+from typing import List, Tuple, Union
+import numpy as np
+import pandas as pd
 import pm4py
-from pandas import DataFrame
+from pandas import DataFrame, Series
 from pm4py.objects.log.obj import EventLog
 import pdb
 
@@ -9,9 +15,16 @@ import pdb
 # TODO capire se event_executions è utile
 # TODO capire come codificare questi dizionari
 class InterCaseFeatures():
+    """
+    Inter-case features of an event log, computed on its events as columns: the log can be a pm4py EventLog, whose
+    attributes are read once into arrays, or an event DataFrame (e.g., pm4py.convert_to_dataframe). The per-event
+    features (e.g., workload) are Series aligned with the events, i.e., with the rows of the DataFrame or with the
+    events of the EventLog in trace order. The per-date features date each event in its own timezone, except for the
+    datetime columns of a DataFrame, which are dated in the timezone of the column (UTC for pm4py.convert_to_dataframe).
+    """
 
     @staticmethod
-    def events_by_date(log: EventLog, timestamp_attr: str) -> OrderedDict:
+    def events_by_date(log: Union[EventLog, DataFrame], timestamp_attr: str) -> OrderedDict:
         """
         Creates dict of events by date ordered by date
 
@@ -22,17 +35,11 @@ class InterCaseFeatures():
         Returns:
             A dictionary with dates as keys and number of events as values, e.g., {'2010-12-30': 7, '2011-01-06': 8}
         """
-        stamp_dict = defaultdict(lambda: 0)
-        for trace in log:
-            for event in trace:
-                timestamp = event.get(timestamp_attr)
-                if timestamp is None:
-                    raise Exception(f"{timestamp_attr} attribute does not exist.")
-                stamp_dict[str(timestamp.date())] += 1
-        return OrderedDict(sorted(stamp_dict.items()))
+        days, dates = InterCaseFeatures._days(InterCaseFeatures._event_columns(log, [timestamp_attr])[timestamp_attr])
+        return InterCaseFeatures._by_date(dates, np.bincount(days, minlength=len(dates)))
 
     @staticmethod
-    def resources_by_date(log: EventLog, timestamp_attr: str, payload_attr: str) -> OrderedDict:
+    def resources_by_date(log: Union[EventLog, DataFrame], timestamp_attr: str, payload_attr: str) -> OrderedDict:
         """
         Creates dict of used unique resources ordered by date
 
@@ -44,24 +51,15 @@ class InterCaseFeatures():
         Returns:
             A dictionary with a date and the number of unique resources used on that day, e.g., {'2010-12-30': 7, '2011-01-06': 8}
         """
-        stamp_dict = defaultdict(lambda: [])
-        for trace in log:
-            for event in trace:
-                payload = event.get(payload_attr)
-                if payload is None:
-                    raise Exception(f"{payload_attr} attribute does not exist.")
-                timestamp = event.get(timestamp_attr)
-                if timestamp is None:
-                    raise Exception(f"{timestamp_attr} attribute does not exist.")
-                stamp_dict[str(timestamp.date())].append(payload)
-
-        for key, value in stamp_dict.items():
-            stamp_dict[key] = len(set(value))
-
-        return OrderedDict(sorted(stamp_dict.items()))
+        events = InterCaseFeatures._event_columns(log, [payload_attr, timestamp_attr])
+        days, dates = InterCaseFeatures._days(events[timestamp_attr])
+        resources, values = pd.factorize(events[payload_attr])
+        # distinct (day, resource) pairs
+        pairs = np.unique(days * len(values) + resources)
+        return InterCaseFeatures._by_date(dates, np.bincount(pairs // len(values), minlength=len(dates)))
 
     @staticmethod
-    def event_executions(log: EventLog, activity_attr: str) -> OrderedDict:
+    def event_executions(log: Union[EventLog, DataFrame], activity_attr: str) -> OrderedDict:
         """
         Creates dict of event execution count
 
@@ -72,35 +70,275 @@ class InterCaseFeatures():
         Returns:
             A dictionary with event names as keys and the number of their executions in the whole log as values, e.g., {'Event A': 7, 'Event B': 8}
         """
-        executions = defaultdict(lambda: 0)
-        for trace in log:
-            for event in trace:
-                activity = event.get(activity_attr)
-                if activity is None:
-                    raise Exception(f"{activity_attr} attribute does not exist.")
-                executions[activity] += 1
-        return OrderedDict(sorted(executions.items()))
+        executions = InterCaseFeatures._event_columns(log, [activity_attr])[activity_attr].value_counts()
+        return OrderedDict(sorted(zip(executions.index, executions.to_numpy().tolist())))
 
     @staticmethod
-    def new_trace_start(log: EventLog, timestamp_attr: str) -> OrderedDict:
+    def new_trace_start(log: Union[EventLog, DataFrame], timestamp_attr: str,
+                        case_attr: str = 'case:concept:name') -> OrderedDict:
         """
         Creates dict of new traces by date
 
         Args:
             log: the event log
             timestamp_attr: the name of the timestamp attribute
+            case_attr: the name of the case identifier column, for an event DataFrame
 
         Returns:
             A dictionary with dates as keys and the number of traces started in that date as values, e.g., {'2010-12-30': 1, '2011-01-06': 2}
         """
-        executions = defaultdict(lambda: 0)
-        for trace in log:
-            event = trace[0]
-            timestamp = event.get(timestamp_attr)
-            if timestamp is None:
-                raise Exception(f"{timestamp_attr} attribute does not exist.")
-            executions[str(timestamp.date())] += 1
-        return OrderedDict(sorted(executions.items()))
+        events = InterCaseFeatures._event_columns(log, [timestamp_attr], case_attr)
+        first_events = np.unique(events['case'].to_numpy(), return_index=True)[1]
+        days, dates = InterCaseFeatures._days(events[timestamp_attr].iloc[first_events])
+        return InterCaseFeatures._by_date(dates, np.bincount(days, minlength=len(dates)))
+
+    @staticmethod
+    def workload(log: Union[EventLog, DataFrame], timestamp_attr: str, window: timedelta) -> Series:
+        """
+        Computes the workload at each event, i.e., the number of events of the log in the sliding window
+        (t - window, t] ending at its timestamp t, itself included. The timestamps are sorted once and the window of
+        every event is bounded with a binary search.
+
+        Args:
+            log: the event log
+            timestamp_attr: the name of the timestamp attribute
+            window: the width of the sliding window
+
+        Returns:
+            The workload of each event.
+        """
+        times = InterCaseFeatures._nanoseconds(InterCaseFeatures._event_columns(log, [timestamp_attr])[timestamp_attr])
+        order = np.argsort(times, kind='stable')
+        counts = np.empty(len(times), dtype=np.int64)
+        counts[order] = InterCaseFeatures._window_counts(times[order], window)
+        return Series(counts, name='workload')
+
+    @staticmethod
+    def resource_workload(log: Union[EventLog, DataFrame], timestamp_attr: str, payload_attr: str,
+                          window: timedelta) -> Series:
+        """
+        Computes the workload of the resource of each event, i.e., the number of events of its resource in the
+        sliding window (t - window, t] ending at its timestamp t, itself included.
+
+        Args:
+            log: the event log
+            timestamp_attr: the name of the timestamp attribute
+            payload_attr: the name of the payload attribute, e.g., the resource
+            window: the width of the sliding window
+
+        Returns:
+            The workload of the resource of each event.
+        """
+        events = InterCaseFeatures._event_columns(log, [payload_attr, timestamp_attr])
+        times = InterCaseFeatures._nanoseconds(events[timestamp_attr])
+        resources = pd.factorize(events[payload_attr])[0]
+        # events sorted by resource and time, each resource being a block of sorted timestamps
+        order = np.argsort(times, kind='stable')
+        order = order[np.argsort(resources[order], kind='stable')]
+        bounds = np.searchsorted(resources[order], np.arange(resources.max(initial=-1) + 2))
+        counts = np.zeros(len(times), dtype=np.int64)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            block = order[start:end]
+            counts[block] = InterCaseFeatures._window_counts(times[block], window)
+        return Series(counts, name='resource_workload')
+
+    @staticmethod
+    def active_cases(log: Union[EventLog, DataFrame], timestamp_attr: str,
+                     case_attr: str = 'case:concept:name') -> Series:
+        """
+        Computes the number of active cases at each event, i.e., the cases started (first event) at or before its
+        timestamp t and ended (last event) at or after t, its own case included, see CaseIntervalIndex.
+
+        Args:
+            log: the event log
+            timestamp_attr: the name of the timestamp attribute
+            case_attr: the name of the case identifier column, for an event DataFrame
+
+        Returns:
+            The number of active cases at each event.
+        """
+        index = InterCaseFeatures.case_interval_index(log, timestamp_attr, case_attr=case_attr)
+        events = InterCaseFeatures._event_columns(log, [timestamp_attr])
+        return Series(index.count_open(InterCaseFeatures._nanoseconds(events[timestamp_attr])), name='active_cases')
+
+    @staticmethod
+    def resource_queue_length(log: Union[EventLog, DataFrame], timestamp_attr: str, payload_attr: str,
+                              case_attr: str = 'case:concept:name') -> Series:
+        """
+        Computes the queue length of the resource of each event, i.e., the number of cases the resource is working on
+        at its timestamp t: the cases with an event of the resource at or before t and another one at or after t, its
+        own case included, see CaseIntervalIndex.
+
+        Args:
+            log: the event log
+            timestamp_attr: the name of the timestamp attribute
+            payload_attr: the name of the payload attribute, e.g., the resource
+            case_attr: the name of the case identifier column, for an event DataFrame
+
+        Returns:
+            The queue length of the resource of each event.
+        """
+        events = InterCaseFeatures._event_columns(log, [payload_attr, timestamp_attr], case_attr)
+        times = InterCaseFeatures._nanoseconds(events[timestamp_attr])
+        resources = pd.factorize(events[payload_attr])[0]
+        index = CaseIntervalIndex.from_events(times, events['case'].to_numpy(), resources)
+        return Series(index.count_open(times, resources), name='resource_queue_length')
+
+    @staticmethod
+    def case_interval_index(log: Union[EventLog, DataFrame], timestamp_attr: str, payload_attr: str = None,
+                            case_attr: str = 'case:concept:name') -> CaseIntervalIndex:
+        """
+        Builds the interval index of the spans of the cases, from their first to their last event, to count the
+        cases open at any time, e.g., index.count_open(times). If payload_attr is given, the spans are the ones of
+        the events of each case with the same payload value, grouped by the codes of the values (in order of
+        appearance).
+
+        Args:
+            log: the event log
+            timestamp_attr: the name of the timestamp attribute
+            payload_attr: the name of the payload attribute grouping the spans, e.g., the resource / Default: None
+            case_attr: the name of the case identifier column, for an event DataFrame
+
+        Returns:
+            The interval index of the cases.
+        """
+        attributes = [timestamp_attr] if payload_attr is None else [payload_attr, timestamp_attr]
+        events = InterCaseFeatures._event_columns(log, attributes, case_attr)
+        groups = None if payload_attr is None else pd.factorize(events[payload_attr])[0]
+        return CaseIntervalIndex.from_events(InterCaseFeatures._nanoseconds(events[timestamp_attr]),
+                                             events['case'].to_numpy(), groups)
+
+    @staticmethod
+    def _event_columns(log: Union[EventLog, DataFrame], attributes: List[str], case_attr: str = None) -> DataFrame:
+        """
+        Returns the attributes of the events as columns, one row per event, with the code of their case in the 'case'
+        column if case_attr is given (the index of the trace for an EventLog).
+        """
+        if isinstance(log, DataFrame):
+            for attr in attributes + ([case_attr] if case_attr is not None else []):
+                if attr not in log.columns or log[attr].isna().any():
+                    raise Exception(f"{attr} attribute does not exist.")
+            events = log[attributes].reset_index(drop=True)
+            if case_attr is not None:
+                events['case'] = pd.factorize(log[case_attr])[0]
+            return events
+        columns = {attr: [event.get(attr) for trace in log for event in trace] for attr in attributes}
+        for attr, values in columns.items():
+            if any(value is None for value in values):
+                raise Exception(f"{attr} attribute does not exist.")
+        events = DataFrame(columns, columns=attributes)
+        if case_attr is not None:
+            events['case'] = np.repeat(np.arange(len(log)), [len(trace) for trace in log])
+        return events
+
+    @staticmethod
+    def _days(timestamps: Series) -> Tuple[np.ndarray, List[str]]:
+        """
+        Returns the code of the date of each timestamp, in its own timezone (the one of the column for a datetime
+        column), and the dates as 'YYYY-MM-DD' strings.
+        """
+        if not pd.api.types.is_datetime64_any_dtype(timestamps):
+            try:
+                # datetimes with different UTC offsets (e.g., across a daylight saving change) cannot be converted
+                converted = pd.to_datetime(timestamps) if timestamps.dtype != object else None
+            except (ValueError, TypeError):
+                converted = None
+            if converted is None or not pd.api.types.is_datetime64_any_dtype(converted):
+                codes, dates = pd.factorize(timestamps.map(lambda timestamp: str(pd.Timestamp(timestamp).date())))
+                return codes, list(dates)
+            timestamps = converted
+        # format the distinct dates only
+        codes, days = pd.factorize(timestamps.dt.normalize())
+        return codes, [str(day.date()) for day in days]
+
+    @staticmethod
+    def _by_date(dates: List[str], counts: np.ndarray) -> OrderedDict:
+        return OrderedDict(sorted(zip(dates, counts.tolist())))
+
+    @staticmethod
+    def _nanoseconds(timestamps: Series) -> np.ndarray:
+        """
+        Returns the timestamps as int64 nanoseconds since the epoch, in UTC.
+        """
+        return pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True)).asi8
+
+    @staticmethod
+    def _window_counts(sorted_times: np.ndarray, window: timedelta) -> np.ndarray:
+        """
+        Counts the sorted times in the window (t - window, t] of each of them.
+        """
+        width = pd.Timedelta(window).value
+        return np.searchsorted(sorted_times, sorted_times, side='right') - \
+            np.searchsorted(sorted_times, sorted_times - width, side='right')
+
+
+class CaseIntervalIndex:
+    """
+    Interval index over the spans [start, end] of the cases (or of their parts, e.g., the events of a resource), to
+    count the spans open at given times in O(log n) each. The open spans at t are the ones started at or before t
+    minus the ones ended before t, i.e., two prefix counts on the sorted start and end times (a sweep line over
+    them), found with binary searches. The spans can be grouped (e.g., by resource): the times are replaced by their
+    rank among the distinct times, so that the (group, rank) pairs are sorted as single int64 keys and all the groups
+    are searched at once.
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, groups: np.ndarray = None):
+        """
+        Args:
+            starts: the start times of the spans, as int64 (e.g., nanoseconds)
+            ends: the end times of the spans, not before the start times
+            groups: the group code (from 0) of each span / Default: a single group
+        """
+        starts, ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+        groups = np.zeros(len(starts), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+        self.times, ranks = np.unique(np.concatenate((starts, ends)), return_inverse=True)
+        self._width: int = len(self.times) + 1
+        self._start_keys: np.ndarray = np.sort(groups * self._width + ranks[:len(starts)])
+        self._end_keys: np.ndarray = np.sort(groups * self._width + ranks[len(starts):])
+
+    @classmethod
+    def from_events(cls, times: np.ndarray, cases: np.ndarray, groups: np.ndarray = None) -> CaseIntervalIndex:
+        """
+        Builds the index of the spans of the cases, from the time of their first event to the time of their last one,
+        or of the spans of the events of each case in each group.
+
+        Args:
+            times: the times of the events, as int64
+            cases: the case code of each event
+            groups: the group code (from 0) of each event / Default: a single group
+
+        Returns:
+            The interval index of the spans.
+        """
+        keys = DataFrame({'case': cases, 'group': 0 if groups is None else groups, 'time': times})
+        spans = keys.groupby(['case', 'group'], sort=False)['time'].agg(['min', 'max'])
+        span_groups = None if groups is None else spans.index.get_level_values('group').to_numpy()
+        return cls(spans['min'].to_numpy(), spans['max'].to_numpy(), span_groups)
+
+    def count_open(self, times: np.ndarray, groups: np.ndarray = None) -> np.ndarray:
+        """
+        Counts the spans open at each time, i.e., started at or before it and ended at or after it, in the group of
+        each time.
+
+        Args:
+            times: the query times, as int64
+            groups: the group code of each query time / Default: the first group
+
+        Returns:
+            The number of open spans at each time.
+        """
+        times = np.asarray(times, dtype=np.int64)
+        # the queries are sorted, for the locality of the binary searches
+        order = np.argsort(times, kind='stable')
+        after = np.searchsorted(self.times, times[order], side='right')
+        before = np.searchsorted(self.times, times[order], side='left')
+        if groups is not None:
+            base = np.asarray(groups, dtype=np.int64)[order] * self._width
+            by_group = np.argsort(base, kind='stable')
+            order, after, before = order[by_group], base[by_group] + after[by_group], base[by_group] + before[by_group]
+        counts = np.empty(len(times), dtype=np.int64)
+        counts[order] = np.searchsorted(self._start_keys, after) - np.searchsorted(self._end_keys, before)
+        return counts
 
 
 ################## COSE CHE NON SERVONO #########################
@@ -1,15 +1,15 @@
 from sklearn.base import BaseEstimator, TransformerMixin
-import pandas as pd
 import numpy as np
 from time import time
 from typing import Union, List
 from pandas import DataFrame, Index
+from Declare4Py.Utils.Encodings.CaseGrouping import CaseGrouping, sparse_frame
 
 
 class IndexBased(BaseEstimator, TransformerMixin):
     
     def __init__(self, case_id_col: str, cat_cols: List[str], num_cols: List[str] = [], max_events: int = None,
-                 fillna: bool = True, create_dummies: bool = True):
+                 fillna: bool = True, create_dummies: bool = True, sparse: bool = False):
         """
         Parameters
         -------------------
@@ -25,7 +25,11 @@ class IndexBased(BaseEstimator, TransformerMixin):
             TRUE: replace NA to 0 value in dataframe / FALSE: keep NA
         create_dummies        
             TRUE: transform categorical attributes as dummy attributes         
+        sparse
+            TRUE: return a sparse DataFrame, it requires create_dummies / FALSE: return a dense DataFrame
         """
+        if sparse and not create_dummies:
+            raise RuntimeError("The sparse output requires the create_dummies parameter.")
         
         self.case_id_col = case_id_col
         self.cat_cols = cat_cols      
@@ -33,11 +37,36 @@ class IndexBased(BaseEstimator, TransformerMixin):
         self.max_events = max_events   
         self.fillna = fillna            
         self.create_dummies = create_dummies
+        self.sparse = sparse
         self.columns = None
+        self.vocabularies = None
         self.fit_time = 0
         self.transform_time = 0
 
     def fit(self, X: Union[np.array, DataFrame], y=None):
+        """
+        Learns the maximum prefix length (if not given), the values of the categorical attributes at each position and
+        the columns of the encoded matrix from the event log X, so that transform returns the same columns for any
+        log:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be fitted
+
+        Returns
+        ------------------
+        :rtype: IndexBased
+            The fitted encoder
+        """
+        start = time()
+
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        if self.max_events is None:
+            self.max_events = int(grouping.lengths.max())
+        self._fit_vocabularies(X, grouping)
+
+        self.fit_time = time() - start
         return self
     
     def transform(self, X: Union[np.array, DataFrame], y=None) -> DataFrame:
@@ -56,43 +85,70 @@ class IndexBased(BaseEstimator, TransformerMixin):
         """
         
         start = time()
-        
-        grouped = X.groupby(self.case_id_col, as_index=False)
-        
-        if self.max_events is None:
-            self.max_events = max(grouped.size()['size'])
-        
-        dt_transformed = pd.DataFrame(grouped.apply(lambda x: x.name), columns=[self.case_id_col])
 
-        for i in range(self.max_events):
-            dt_index = grouped.nth(i)[[self.case_id_col] + self.cat_cols + self.num_cols]
-            dt_index.columns = [self.case_id_col] + [f"{col}_{i}" for col in self.cat_cols] + \
-                               [f"{col}_{i}" for col in self.num_cols]
-            dt_transformed = pd.merge(dt_transformed, dt_index, on=self.case_id_col, how="left")
-        dt_transformed.index = dt_transformed[self.case_id_col]
+        if self.columns is None:
+            self.fit(X)
 
-        # one-hot-encode cat cols
-        if self.create_dummies:
-            
-            all_cat_cols = [f"{col}_{i}" for col in self.cat_cols for i in range(self.max_events)]
-            dt_transformed = pd.get_dummies(dt_transformed, columns=all_cat_cols).drop(self.case_id_col, axis=1)
-        
-        # fill missing values with 0-s
-        if self.fillna:
-            dt_transformed = dt_transformed.fillna(0)
+        dt_transformed = self._encode(X, CaseGrouping.of(X, self.case_id_col))
+
+        self.transform_time = time() - start
+        return dt_transformed
+
+    def transform_prefixes(self, X: DataFrame, max_prefix_length: int = None) -> DataFrame:
+        """
+        Tranforms all the prefixes of lengths 1..max_prefix_length of the traces in the event log X into an index-based
+        encoded matrix in one pass, as transform would do on each prefix:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be transformed
+        max_prefix_length
+            maximum length of the prefixes / Default: max_events
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            Transformed prefixes, indexed by (case, prefix_len)
+        """
 
-        # add missing columns if necessary
+        start = time()
+
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        if self.max_events is None:
+            self.max_events = int(grouping.lengths.max())
+        if max_prefix_length is None:
+            max_prefix_length = self.max_events
+        grouping = grouping.prefixes(max_prefix_length)
         if self.columns is None:
-            self.columns = dt_transformed.columns
-        else:
-            missing_cols = [col for col in self.columns if col not in dt_transformed.columns]
-            for col in missing_cols:
-                dt_transformed[col] = 0
-            dt_transformed = dt_transformed[self.columns]
+            self._fit_vocabularies(X, grouping)
+
+        dt_transformed = self._encode(X, grouping)
 
         self.transform_time = time() - start
         return dt_transformed
 
+    def _fit_vocabularies(self, X: DataFrame, grouping: CaseGrouping):
+        self.vocabularies = grouping.index_vocabularies(X, self.cat_cols, self.max_events) \
+            if self.create_dummies else None
+        self.columns = Index(grouping.index_columns(self.cat_cols + self.num_cols, self.cat_cols, self.max_events,
+                                                    self.create_dummies, self.vocabularies))
+
+    def _encode(self, X: DataFrame, grouping: CaseGrouping) -> DataFrame:
+        columns = self.cat_cols + self.num_cols
+        if self.sparse:
+            matrix, columns = grouping.index_encoding(X, columns, self.cat_cols, self.max_events, as_sparse=True,
+                                                      vocabularies=self.vocabularies)
+            return sparse_frame(matrix, grouping.cases, columns, fillna=self.fillna)
+
+        dt_transformed = grouping.index_encoding(X, columns, self.cat_cols, self.max_events, self.create_dummies,
+                                                 vocabularies=self.vocabularies)
+
+        # fill missing values with 0-s
+        if self.fillna:
+            dt_transformed = dt_transformed.fillna(0)
+        return dt_transformed
+
     def get_feature_names(self) -> Index:
         """
         Print all attribute names in a Pandas DataFrame:
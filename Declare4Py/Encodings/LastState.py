@@ -3,12 +3,15 @@ import pandas as pd
 from time import time
 from typing import Union, List
 from pandas import DataFrame, Index
+from Declare4Py.Utils.Encodings.CaseGrouping import CaseGrouping, as_categories, dummy_vocabularies, sparse_frame, \
+    sparse_states, state_columns
 import numpy as np
 
 
 class LastState(BaseEstimator, TransformerMixin):
     
-    def __init__(self, case_id_col: str, cat_cols: List[str], num_cols: List[str] = [], fillna: bool = True):
+    def __init__(self, case_id_col: str, cat_cols: List[str], num_cols: List[str] = [], fillna: bool = True,
+                 sparse: bool = False):
         """
         Parameters
         -------------------
@@ -20,17 +23,41 @@ class LastState(BaseEstimator, TransformerMixin):
             columns indicating the numerical attributes in an event log       
         fillna
             TRUE: replace NA to 0 value in dataframe / FALSE: keep NA        
+        sparse
+            TRUE: one-hot encode the categorical attributes as a scipy sparse matrix and return a sparse DataFrame /
+            FALSE: return a dense DataFrame
         """
 
         self.case_id_col = case_id_col
         self.cat_cols = cat_cols
         self.num_cols = num_cols
         self.fillna = fillna
+        self.sparse = sparse
         self.columns = None
+        self.vocabularies = None
         self.fit_time = 0
         self.transform_time = 0
 
     def fit(self, X: Union[np.array, DataFrame], y=None):
+        """
+        Learns the values of the categorical attributes in the last states and the columns of the encoded matrix
+        from the event log X, so that transform returns the same columns for any log:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be fitted
+
+        Returns
+        ------------------
+        :rtype: LastState
+            The fitted encoder
+        """
+        start = time()
+
+        self._fit_states(self._last_states(X))
+
+        self.fit_time = time() - start
         return self
 
     def transform(self, X: Union[np.array, DataFrame], y=None) -> DataFrame:
@@ -50,30 +77,78 @@ class LastState(BaseEstimator, TransformerMixin):
         
         start = time()
         
-        dt_last = X.groupby(self.case_id_col).last()
-        
+        dt_last = self._last_states(X)
+        if self.columns is None:
+            self._fit_states(dt_last)
+        dt_transformed = self._encode(dt_last)
+
+        self.transform_time = time() - start
+        return dt_transformed
+
+    def transform_prefixes(self, X: DataFrame, max_prefix_length: int = None) -> DataFrame:
+        """
+        Tranforms all the prefixes of lengths 1..max_prefix_length of the traces in the event log X into a last-state
+        encoded matrix in one pass, as transform would do on each prefix. The last state of each prefix is carried
+        forward from the one of the previous prefix:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be transformed
+        max_prefix_length
+            maximum length of the prefixes / Default: the length of the traces
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            Transformed prefixes, indexed by (case, prefix_len)
+        """
+
+        start = time()
+
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        prefix_cases, prefix_lengths = grouping.prefix_cases(max_prefix_length)
+        last_events = grouping.nth_events(prefix_cases, prefix_lengths - 1)
+        dt_last = pd.DataFrame({col: grouping.cumulative(grouping.column(X, col), 'last')[last_events]
+                                for col in self.num_cols + self.cat_cols},
+                               index=grouping.prefix_index(max_prefix_length))
+        if self.columns is None:
+            self._fit_states(dt_last)
+        dt_transformed = self._encode(dt_last)
+
+        self.transform_time = time() - start
+        return dt_transformed
+
+    def _last_states(self, X: DataFrame) -> DataFrame:
+        """
+        Returns the last state of each case, i.e., the last non-NA value of each attribute, as groupby().last() does,
+        located on the case boundaries of the shared grouping of X.
+        """
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        return pd.DataFrame({col: grouping.take(X, col, grouping.last_events(X[col].notna().to_numpy()[grouping.rows]))
+                             for col in self.num_cols + self.cat_cols}, index=grouping.cases)
+
+    def _fit_states(self, dt_last: DataFrame):
+        self.vocabularies = dummy_vocabularies(dt_last, self.cat_cols)
+        self.columns = state_columns(self.num_cols, self.cat_cols, self.vocabularies)
+
+    def _encode(self, dt_last: DataFrame) -> DataFrame:
+        if self.sparse:
+            matrix = sparse_states(dt_last, self.num_cols, self.cat_cols, self.vocabularies,
+                                   np.arange(len(dt_last)), len(dt_last))
+            return sparse_frame(matrix, dt_last.index, self.columns, fillna=self.fillna)
+
         # transform numeric cols
         dt_transformed = dt_last[self.num_cols]
         
-        # transform cat cols
+        # transform cat cols, as the fitted columns
         if len(self.cat_cols) > 0:
-            dt_cat = pd.get_dummies(dt_last[self.cat_cols])
+            dt_cat = pd.get_dummies(as_categories(dt_last[self.cat_cols], self.vocabularies))
             dt_transformed = pd.concat([dt_transformed, dt_cat], axis=1)
         
         # fill NA with 0 if requested
         if self.fillna:
             dt_transformed = dt_transformed.fillna(0)
-            
-        # add missing columns if necessary
-        if self.columns is not None:
-            missing_cols = [col for col in self.columns if col not in dt_transformed.columns]
-            for col in missing_cols:
-                dt_transformed[col] = 0
-            dt_transformed = dt_transformed[self.columns]
-        else:
-            self.columns = dt_transformed.columns
-        
-        self.transform_time = time() - start
         return dt_transformed
 
     def get_feature_names(self) -> Index:
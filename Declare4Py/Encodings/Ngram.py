@@ -2,14 +2,14 @@ from sklearn.base import TransformerMixin, BaseEstimator
 import pandas as pd
 import numpy as np
 from time import time
-from itertools import chain
 from typing import Union, List
 from pandas import DataFrame, Index, array
+from Declare4Py.Utils.Encodings.CaseGrouping import CaseGrouping, sparse_frame
 
 
 class Ngram(BaseEstimator, TransformerMixin):
     
-    def __init__(self, case_id_col: str, act_col: str, n: int = 2, v: float = 0.7):
+    def __init__(self, case_id_col: str, act_col: str, n: int = 2, v: float = 0.7, sparse: bool = False):
         """
         Parameters
         -------------------
@@ -21,6 +21,8 @@ class Ngram(BaseEstimator, TransformerMixin):
             an int value in [2,3,4] for the size of sub-sequence in n-gram
         v
             a decay factor parameter in n-gram, ranged in [0,1]     
+        sparse
+            TRUE: return a sparse DataFrame / FALSE: return a dense DataFrame
         """
         if type(case_id_col) is not str and type(act_col) is not str:
             raise RuntimeError("The case_id_col and act_col parameters must be strings.")
@@ -32,11 +34,35 @@ class Ngram(BaseEstimator, TransformerMixin):
         self.case_id_col = case_id_col
         self.act_col = act_col
         self.columns = None
+        self.vocabulary = None
+        self.fit_time = 0
         self.transform_time = 0
         self.n = n
         self.v = v
+        self.sparse = sparse
 
     def fit(self, X: Union[DataFrame, np.ndarray], y=None):
+        """
+        Learns the n-grams of the activities in the event log X, i.e., the columns of the encoded matrix, so that
+        transform returns the same columns for any log:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be fitted
+
+        Returns
+        ------------------
+        :rtype: Ngram
+            The fitted encoder
+        """
+        start = time()
+
+        self.vocabulary = CaseGrouping.of(X, self.case_id_col, sort=False).ngram_vocabulary(X, self.act_col, self.n)
+        activities, grams = self.vocabulary
+        self.columns = Index(['|'.join(str(activities[code]) for code in gram) for gram in grams])
+
+        self.fit_time = time() - start
         return self
     
     def transform(self, X: Union[DataFrame, np.ndarray], y=None) -> DataFrame:
@@ -56,25 +82,19 @@ class Ngram(BaseEstimator, TransformerMixin):
         
         start = time()
         
-        # transform activity col into ngram matrix
-        ngram = X.groupby([self.case_id_col], sort=False).apply(
-            lambda x: (['|'.join(x[self.act_col][i:i + self.n]) for i in range(0, len(x[self.act_col]) - self.n + 1)]))
-
-        nested_list = list(ngram.values)
-        my_unnested_list = list(chain(*nested_list))
-        ngram_list = list(set(my_unnested_list))
+        if self.columns is None:
+            self.fit(X)
 
-        X = X.groupby([self.case_id_col], sort=False).apply(lambda x: np.array(x[self.act_col]))
-        X = X.apply(lambda x: self.func_ngram(x, n=self.n, v=0.7, ngram_list=ngram_list))
-        
-        dt_transformed = pd.DataFrame(columns=[i for i in ngram_list])
-        for i in range(len(X)):
-            dt_transformed.loc[i] = X[i]
-        
-        dt_transformed.index = X.index
+        # transform activity col into ngram matrix
+        grouping = CaseGrouping.of(X, self.case_id_col, sort=False)
+        matrix, ngram_list = grouping.ngram_encoding(X, self.act_col, self.n, self.v, as_sparse=self.sparse,
+                                                     vocabulary=self.vocabulary)
+        if self.sparse:
+            dt_transformed = sparse_frame(matrix, grouping.cases, ngram_list)
+        else:
+            dt_transformed = pd.DataFrame(matrix, index=grouping.cases, columns=ngram_list)
 
         self.transform_time = time() - start
-        self.columns = dt_transformed.columns
         return dt_transformed
 
     def func_ngram(self, y: Union[List, np.array], n: int, v: float, ngram_list: list) -> np.array:
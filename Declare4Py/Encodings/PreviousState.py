@@ -3,12 +3,15 @@ import pandas as pd
 from time import time
 from typing import Union, List
 from pandas import DataFrame, Index
+from Declare4Py.Utils.Encodings.CaseGrouping import CaseGrouping, as_categories, dummy_vocabularies, sparse_frame, \
+    sparse_states, state_columns
 import numpy as np
 
 
 class PreviousState(BaseEstimator, TransformerMixin):
     
-    def __init__(self, case_id_col: str, cat_cols: List[str], num_cols: List[str], fillna: bool = True):
+    def __init__(self, case_id_col: str, cat_cols: List[str], num_cols: List[str], fillna: bool = True,
+                 sparse: bool = False):
         """
         Parameters
         -------------------
@@ -20,17 +23,41 @@ class PreviousState(BaseEstimator, TransformerMixin):
             columns indicating the numerical attributes in an event log       
         fillna
             TRUE: replace NA to 0 value in dataframe / FALSE: keep NA        
+        sparse
+            TRUE: one-hot encode the categorical attributes as a scipy sparse matrix and return a sparse DataFrame /
+            FALSE: return a dense DataFrame
         """
         
         self.case_id_col = case_id_col
         self.cat_cols = cat_cols
         self.num_cols = num_cols
         self.fillna = fillna 
+        self.sparse = sparse
         self.columns = None
+        self.vocabularies = None
         self.fit_time = 0
         self.transform_time = 0
 
     def fit(self, X: Union[DataFrame, np.ndarray], y=None):
+        """
+        Learns the values of the categorical attributes in the previous states and the columns of the encoded matrix
+        from the event log X, so that transform returns the same columns for any log:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be fitted
+
+        Returns
+        ------------------
+        :rtype: PreviousState
+            The fitted encoder
+        """
+        start = time()
+
+        self._fit_states(self._previous_states(X))
+
+        self.fit_time = time() - start
         return self
 
     def transform(self, X: Union[DataFrame, np.ndarray], y=None) -> DataFrame:
@@ -50,33 +77,84 @@ class PreviousState(BaseEstimator, TransformerMixin):
 
         start = time()
         
-        dt_last = X.groupby(self.case_id_col).nth(-2)
-        
+        dt_last = self._previous_states(X)
+        if self.columns is None:
+            self._fit_states(dt_last)
+        dt_transformed = self._encode(dt_last, CaseGrouping.of(X, self.case_id_col).cases)
+
+        self.transform_time = time() - start
+        return dt_transformed
+
+    def transform_prefixes(self, X: DataFrame, max_prefix_length: int = None) -> DataFrame:
+        """
+        Tranforms all the prefixes of lengths 1..max_prefix_length of the traces in the event log X into a
+        previous-state encoded matrix in one pass, as transform would do on each prefix:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be transformed
+        max_prefix_length
+            maximum length of the prefixes / Default: the length of the traces
+
+        Returns
+        ------------------
+        :rtype: DataFrame
+            Transformed prefixes, indexed by (case, prefix_len)
+        """
+
+        start = time()
+
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        prefix_cases, prefix_lengths = grouping.prefix_cases(max_prefix_length)
+        prefix_index = grouping.prefix_index(max_prefix_length)
+        previous_events = grouping.nth_events(prefix_cases, prefix_lengths - 2)
+        has_previous = previous_events >= 0
+        dt_last = pd.DataFrame({col: grouping.column(X, col)[previous_events[has_previous]]
+                                for col in self.num_cols + self.cat_cols}, index=prefix_index[has_previous])
+        if self.columns is None:
+            self._fit_states(dt_last)
+        dt_transformed = self._encode(dt_last, prefix_index)
+
+        self.transform_time = time() - start
+        return dt_transformed
+
+    def _previous_states(self, X: DataFrame) -> DataFrame:
+        """
+        Returns the previous state of each case having one, i.e., its second-last event as groupby().nth(-2) does,
+        located on the case boundaries of the shared grouping of X.
+        """
+        grouping = CaseGrouping.of(X, self.case_id_col)
+        previous_events = grouping.nth_events(np.arange(grouping.n_cases), grouping.lengths - 2)
+        has_previous = previous_events >= 0
+        rows, cases = grouping.rows[previous_events[has_previous]], grouping.cases[has_previous]
+        return pd.DataFrame({col: X[col].iloc[rows].set_axis(cases) for col in self.num_cols + self.cat_cols},
+                            index=cases)
+
+    def _fit_states(self, dt_last: DataFrame):
+        self.vocabularies = dummy_vocabularies(dt_last, self.cat_cols)
+        self.columns = state_columns(self.num_cols, self.cat_cols, self.vocabularies)
+
+    def _encode(self, dt_last: DataFrame, index: Index) -> DataFrame:
+        if self.sparse:
+            matrix = sparse_states(dt_last, self.num_cols, self.cat_cols, self.vocabularies,
+                                   index.get_indexer(dt_last.index), len(index))
+            return sparse_frame(matrix, index, self.columns, fillna=self.fillna)
+
         # transform numeric cols
         dt_transformed = dt_last[self.num_cols]
         
-        # transform cat cols
+        # transform cat cols, as the fitted columns
         if len(self.cat_cols) > 0:
-            dt_cat = pd.get_dummies(dt_last[self.cat_cols])
+            dt_cat = pd.get_dummies(as_categories(dt_last[self.cat_cols], self.vocabularies))
             dt_transformed = pd.concat([dt_transformed, dt_cat], axis=1)
 
         # add 0 rows where previous value did not exist
-        dt_transformed = dt_transformed.reindex(X.groupby(self.case_id_col).first().index, fill_value=0)
+        dt_transformed = dt_transformed.reindex(index, fill_value=0)
             
         # fill NA with 0 if requested
         if self.fillna:
             dt_transformed = dt_transformed.fillna(0)
-            
-        # add missing columns if necessary
-        if self.columns is not None:
-            missing_cols = [col for col in self.columns if col not in dt_transformed.columns]
-            for col in missing_cols:
-                dt_transformed[col] = 0
-            dt_transformed = dt_transformed[self.columns]
-        else:
-            self.columns = dt_transformed.columns
-        
-        self.transform_time = time() - start
         return dt_transformed
 
     def get_feature_names(self) -> Index:
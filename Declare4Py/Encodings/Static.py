@@ -4,6 +4,7 @@ from time import time
 from typing import Union, List
 from pandas import DataFrame, Index
 import numpy as np
+from Declare4Py.Utils.Encodings.CaseGrouping import as_categories, dummy_vocabularies, state_columns
 
 
 class Static(BaseEstimator, TransformerMixin):
@@ -27,10 +28,30 @@ class Static(BaseEstimator, TransformerMixin):
         self.num_cols = num_cols
         self.fillna = fillna
         self.columns = None
+        self.vocabularies = None
         self.fit_time = 0
         self.transform_time = 0
     
     def fit(self, X: Union[DataFrame, np.ndarray], y=None):
+        """
+        Learns the values of the categorical attributes in the first states and the columns of the encoded matrix
+        from the event log X, so that transform returns the same columns for any log:
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be fitted
+
+        Returns
+        ------------------
+        :rtype: Static
+            The fitted encoder
+        """
+        start = time()
+
+        self._fit_states(X.groupby(self.case_id_col).first())
+
+        self.fit_time = time() - start
         return self
     
     def transform(self, X: Union[DataFrame, np.ndarray], y=None) -> DataFrame:
@@ -51,26 +72,27 @@ class Static(BaseEstimator, TransformerMixin):
         start = time()
         
         dt_first = X.groupby(self.case_id_col).first()
+        if self.columns is None:
+            self._fit_states(dt_first)
+        dt_transformed = self._encode(dt_first)
+        
+        self.transform_time = time() - start
+        return dt_transformed
+
+    def _fit_states(self, dt_first: DataFrame):
+        self.vocabularies = dummy_vocabularies(dt_first, self.cat_cols)
+        self.columns = state_columns(self.num_cols, self.cat_cols, self.vocabularies)
+
+    def _encode(self, dt_first: DataFrame) -> DataFrame:
         # transform numeric cols
         dt_transformed = dt_first[self.num_cols]
-        # transform cat cols
+        # transform cat cols, as the fitted columns
         if len(self.cat_cols) > 0:
-            dt_cat = pd.get_dummies(dt_first[self.cat_cols])
+            dt_cat = pd.get_dummies(as_categories(dt_first[self.cat_cols], self.vocabularies))
             dt_transformed = pd.concat([dt_transformed, dt_cat], axis=1)
         # fill NA with 0 if requested
         if self.fillna:
             dt_transformed = dt_transformed.fillna(0)
-            
-        # add missing columns if necessary
-        if self.columns is not None:
-            missing_cols = [col for col in self.columns if col not in dt_transformed.columns]
-            for col in missing_cols:
-                dt_transformed[col] = 0
-            dt_transformed = dt_transformed[self.columns]
-        else:
-            self.columns = dt_transformed.columns
-        
-        self.transform_time = time() - start
         return dt_transformed
 
     def get_feature_names(self) -> Index:
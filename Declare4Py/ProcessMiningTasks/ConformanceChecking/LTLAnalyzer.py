@@ -4,15 +4,19 @@ import multiprocessing
 import pdb
 import time
 
+import numpy as np
+
 from pm4py.objects.log.obj import Trace
 from pythomata.impl.symbolic import SymbolicDFA
 from pylogics.parsers import parse_ltl
 from Declare4Py.D4PyEventLog import D4PyEventLog
+from Declare4Py.D4PyEventLogView import D4PyEventLogView
 from Declare4Py.ProcessMiningTasks.AbstractConformanceChecking import AbstractConformanceChecking
 from Declare4Py.ProcessModels.LTLModel import LTLModel
 from Declare4Py.Utils.utils import Utils
 from logaut import ltl2dfa
 from functools import reduce
+from typing import Optional
 import pandas
 
 """
@@ -28,6 +32,18 @@ def is_sink(dfa: SymbolicDFA, current_state: int):
     return sink
 
 
+def encode_symbol(attribute: str, value: str, backend) -> str:
+    """
+    Returns the symbol of the automata for the value of an attribute of an event.
+    """
+    symbol = Utils.parse_parenthesis(value)
+    symbol = Utils.encode_attribute_type(attribute) + "_" + symbol
+    symbol = Utils.parse_activity(symbol)
+    if backend == 'lydia':
+        return symbol.lower()
+    return symbol.upper()
+
+
 def run_single_trace(trace: Trace, dfa: SymbolicDFA, backend, attribute_type: [str] = ['concept:name']) -> bool:
     """
     Function that is run when then 'jobs' count is set to 1. It checks if the automata can reach the accepting state or not.
@@ -44,15 +60,7 @@ def run_single_trace(trace: Trace, dfa: SymbolicDFA, backend, attribute_type: [s
     for event in trace:
         temp = dict()
         for attribute in attribute_type:
-            symbol = event[attribute]
-            symbol = Utils.parse_parenthesis(symbol)
-            symbol = Utils.encode_attribute_type(attribute) + "_" + symbol
-            symbol = Utils.parse_activity(symbol)
-            if backend == 'lydia':
-                symbol = symbol.lower()
-            else:
-                symbol = symbol.upper()
-            temp[symbol] = True
+            temp[encode_symbol(attribute, event[attribute], backend)] = True
 
         current_states = reduce(
             set.union,
@@ -109,6 +117,44 @@ def run_single_trace_par_MM(args):
     return trace.attributes['concept:name'], is_accepted
 
 
+# Templates accepting the traces whose event at a position (negative from the end) is the activity
+POSITIONAL_TEMPLATES = {'is_first_state_a': 0, 'is_second_state_a': 1, 'is_third_state_a': 2, 'is_last_state_a': -1,
+                        'is_second_last_state_a': -2, 'is_third_last_state_a': -3}
+# Templates accepting the traces of a length
+LENGTH_TEMPLATES = {'second_last': 2, 'third_last': 3}
+
+
+def check_template(log: D4PyEventLog, model: LTLModel) -> Optional[np.ndarray]:
+    """
+    Checks an LTL model filled by a positional template on each trace of the log without its automaton, by a lookup
+    of the activity-position index of the log (see D4PyEventLog.attribute_position_index), or of the lengths of the
+    traces.
+
+    Args:
+        log: the event log
+        model: the LTL model
+
+    Returns:
+        whether each trace is accepted by the model, None if the model is not a positional template.
+    """
+    template = model.get_template()
+    if template in LENGTH_TEMPLATES:
+        offsets = log.attribute_log_encoding(log.activity_key)[1]
+        return np.diff(offsets) == LENGTH_TEMPLATES[template]
+    if template not in POSITIONAL_TEMPLATES:
+        return None
+    offsets = log.attribute_log_encoding(log.activity_key)[1]
+    accepted = np.zeros(len(offsets) - 1, dtype=bool)
+    # the event satisfies the proposition of the formula if one of its attributes has the same symbol
+    proposition = encode_symbol(model.attribute_type[0], model.template_activities[0][0], model.backend)
+    for attribute in model.attribute_type:
+        index = log.attribute_position_index(attribute, POSITIONAL_TEMPLATES[template])
+        for value, trace_ids in index.items():
+            if isinstance(value, str) and encode_symbol(attribute, value, model.backend) == proposition:
+                accepted[trace_ids] = True
+    return accepted
+
+
 class LTLAnalyzer(AbstractConformanceChecking):
 
     def __init__(self, log: D4PyEventLog, *args):
@@ -149,12 +195,18 @@ class LTLAnalyzer(AbstractConformanceChecking):
         else:
             raise RuntimeError(f"{jobs} not a valid number of jobs. Allowed values goes from -1.")
 
+        g_log = self.event_log.get_log()
+        accepted = check_template(self.event_log, self.process_model)
+        if accepted is not None:
+            results = [[trace.attributes[self.event_log.activity_key], bool(is_accepted)]
+                       for trace, is_accepted in zip(g_log, accepted)]
+            return pandas.DataFrame(results, columns=[self.event_log.case_id_key, "accepted"])
+
         backend2dfa = self.process_model.backend
         dfa = ltl2dfa(self.process_model.parsed_formula, backend=backend2dfa)  # lydia
 
         if minimize_automaton:
             dfa = dfa.minimize()
-        g_log = self.event_log.get_log()
         attributes = self.process_model.attribute_type
         if sequential:
             results = []
@@ -194,32 +246,37 @@ class LTLAnalyzer(AbstractConformanceChecking):
         else:
             raise RuntimeError(f"{jobs} not a valid number of jobs. Allowed values goes from -1.")
 
-        g_log = self.log.get_log()
         results = {}
         if sequential:
+            # the traces accepted by the models so far, as a view of the log
+            view = D4PyEventLogView(self.log)
             for id_model, model in enumerate(self.list_LTLModels):
-                n = len(g_log)
+                n = view.get_length()
                 if n > 0:
-                    temp_list = []
-                    backend2dfa = model.backend
-                    dfa = ltl2dfa(model.parsed_formula, backend=model.backend)
-
-                    if minimize_automaton:
-                        dfa = dfa.minimize()
-
-                    attributes = model.attribute_type
-                    for trace in g_log:
-                        is_accepted = run_single_trace(trace, dfa, backend2dfa, attributes)
-                        if is_accepted:
-                            temp_list.append(trace)
-                        results[trace.attributes[self.log.activity_key]] = is_accepted
-                    n = len(temp_list)
-                    g_log = temp_list
+                    accepted = check_template(view, model)
+                    if accepted is not None:
+                        for trace, is_accepted in zip(view.get_log(), accepted):
+                            results[trace.attributes[self.log.activity_key]] = bool(is_accepted)
+                    else:
+                        backend2dfa = model.backend
+                        dfa = ltl2dfa(model.parsed_formula, backend=model.backend)
+
+                        if minimize_automaton:
+                            dfa = dfa.minimize()
+
+                        attributes = model.attribute_type
+                        accepted = np.zeros(n, dtype=bool)
+                        for i, trace in enumerate(view.get_log()):
+                            is_accepted = run_single_trace(trace, dfa, backend2dfa, attributes)
+                            accepted[i] = is_accepted
+                            results[trace.attributes[self.log.activity_key]] = is_accepted
+                    view = view.select(np.flatnonzero(accepted))
+                    n = view.get_length()
                 if n == 0:
                     break
             results = results.items()
         else:
-            traces = g_log._list
+            traces = self.log.get_log()._list
             with multiprocessing.Pool(processes=workers) as pool:
                 tmp_model_list = []
                 for model in self.list_LTLModels:
@@ -1,12 +1,16 @@
 from __future__ import annotations
 
 import pdb
+from typing import Optional
+
+import pandas as pd
 
 from Declare4Py.D4PyEventLog import D4PyEventLog
 from Declare4Py.ProcessMiningTasks.AbstractConformanceChecking import AbstractConformanceChecking
 from Declare4Py.ProcessMiningTasks.ConformanceChecking.MPDeclareResultsBrowser import MPDeclareResultsBrowser
 from Declare4Py.ProcessModels.DeclareModel import DeclareModel
-from Declare4Py.Utils.Declare.Checkers import ConstraintChecker
+from Declare4Py.Utils.Declare.Checkers import ConstraintChecker, EventConditionCache, SupportEstimate
+from Declare4Py.Utils.Declare.TraceStates import TraceState
 
 """
 Provides basic conformance checking functionalities
@@ -42,8 +46,95 @@ class MPDeclareAnalyzer(AbstractConformanceChecking):
             raise RuntimeError("You must load the DECLARE model before checking the model.")
 
         log_checkers_results = []
-        for trace in self.event_log.get_log():
+        condition_cache = EventConditionCache(self.event_log)
+        for trace_idx, trace in enumerate(self.event_log.get_log()):
             log_checkers_results.append(ConstraintChecker().check_trace_conformance(trace, self.process_model,
                                                                                     self.consider_vacuity,
-                                                                                    self.event_log.activity_key))
+                                                                                    self.event_log.activity_key,
+                                                                                    condition_cache, trace_idx))
         return MPDeclareResultsBrowser(log_checkers_results, self.process_model.serialized_constraints)
+
+    def run_sampled(self, min_support: float, sampling: str = "uniform", confidence: float = 0.95,
+                    batch_size: int = 100, seed: Optional[int] = None) -> pd.DataFrame:
+        """
+        Estimates the support of each constraint of the DECLARE model by checking a sample of the traces. The sample
+        grows, batch by batch, only for the constraints whose Hoeffding-Serfling confidence interval still contains
+        the minimum support. The error probability is spent across the evaluations of the intervals (see
+        SupportEstimate), so that all the decisions of a constraint against the minimum support hold together with the
+        given confidence.
+
+        Parameters
+        ----------
+        min_support : float
+            the minimum support against which the constraints are decided.
+
+        sampling : str, optional
+            'uniform' (default) or 'variants' to draw a sample stratified by the variants of the log. The latter is a
+            systematic sample, not a simple random one: the intervals assume the uniform sampling and are
+            approximate for it.
+
+        confidence : float, optional
+            the confidence level of the support intervals (default 0.95).
+
+        batch_size : int, optional
+            the number of traces checked between two evaluations of the intervals (default 100).
+
+        seed : int, optional
+            the seed of the sampling.
+
+        Returns
+        -------
+        DataFrame
+            indexed by the serialized constraints, with the estimated support, the bounds of its interval, the number
+            of checked traces and whether the constraint reaches the minimum support. Constraints with badly formatted
+            conditions are left as NaN.
+        """
+        if self.event_log is None:
+            raise RuntimeError("You must load the log before checking the model.")
+        if self.process_model is None:
+            raise RuntimeError("You must load the DECLARE model before checking the model.")
+        if not 0 <= min_support <= 1:
+            raise RuntimeError("Min. support must be in range [0, 1].")
+        if not 0 < confidence < 1:
+            raise RuntimeError("Confidence must be in range (0, 1).")
+        if batch_size <= 0:
+            raise RuntimeError("The batch size must be greater than 0.")
+
+        log = self.event_log.get_log()
+        trace_order = self.event_log.sample_trace_order(sampling, seed)
+        checker = ConstraintChecker()
+        condition_cache = EventConditionCache(self.event_log)
+        # one single-constraint model for each constraint, so that badly formatted ones do not shift the results
+        pending = {}
+        for idx, constraint in enumerate(self.process_model.constraints):
+            tmp_model = DeclareModel()
+            tmp_model.constraints.append(constraint)
+            tmp_model.set_constraints()
+            pending[idx] = tmp_model
+        estimates = {idx: SupportEstimate(len(trace_order)) for idx in pending}
+
+        for batch_start in range(0, len(trace_order), batch_size):
+            for trace_idx in trace_order[batch_start:batch_start + batch_size]:
+                for idx, tmp_model in list(pending.items()):
+                    trc_res = checker.check_trace_conformance(log[trace_idx], tmp_model, self.consider_vacuity,
+                                                              self.event_log.activity_key, condition_cache, trace_idx)
+                    if not trc_res:  # Occurring when constraint data conditions are formatted bad
+                        del pending[idx], estimates[idx]
+                        continue
+                    estimates[idx].add(trc_res[0].state == TraceState.SATISFIED)
+            for idx in list(pending.keys()):
+                if estimates[idx].is_settled(min_support, confidence):
+                    del pending[idx]
+            if not pending:
+                break
+
+        results = []
+        for idx, constraint_str in enumerate(self.process_model.serialized_constraints):
+            if idx in estimates:
+                estimate = estimates[idx]
+                results.append([estimate.support, estimate.lower_bound, estimate.upper_bound, estimate.sample_size,
+                                estimate.lower_bound >= min_support])
+            else:
+                results.append([None] * 5)
+        return pd.DataFrame(results, index=self.process_model.serialized_constraints,
+                            columns=["support", "lower_bound", "upper_bound", "sample_size", "above_min_support"])
@@ -1,10 +1,17 @@
 from __future__ import annotations
 
+import heapq
 from abc import ABC
+from itertools import count
+from time import perf_counter
+from numbers import Number
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from Declare4Py.D4PyEventLog import D4PyEventLog
 from Declare4Py.ProcessMiningTasks.AbstractDiscovery import AbstractDiscovery
-from Declare4Py.ProcessModels.DeclareModel import DeclareModel, DeclareModelTemplate
+from Declare4Py.ProcessModels.DeclareModel import DeclareModel, DeclareModelTemplate, DeclareModelTemplateMap
 from Declare4Py.Utils.Declare.Checkers import ConstraintChecker
 
 
@@ -24,18 +31,47 @@ Attributes
         inheriting from class Discovery
     output_path : str
         if specified, save the discovered constraints in a DECLARE model to the provided path.
+    sampling : str, optional
+        if specified, the support of the candidate constraints is estimated on a sample of the traces: 'uniform' or
+        'variants' (stratified by variant). The sample grows until the decision against min_support is settled with
+        the given confidence, spent across the evaluations of the intervals (see SupportEstimate). The 'variants'
+        sample is systematic, not a simple random one, and its intervals are approximate.
+    confidence : float, optional
+        the confidence level of the support intervals computed in sampling mode (default 0.95).
+    seed : int, optional
+        the seed of the sampling.
 
 """
 
+# Binary templates whose activations are fulfilled independently of each other, mapped to the window where the
+# target is looked for ("trace", "after", "next", "before", "previous") and whether the template is negative
+_DATA_AWARE_TEMPLATES = DeclareModelTemplateMap([
+    (DeclareModelTemplate.RESPONDED_EXISTENCE, ("trace", False)),
+    (DeclareModelTemplate.RESPONSE, ("after", False)),
+    (DeclareModelTemplate.CHAIN_RESPONSE, ("next", False)),
+    (DeclareModelTemplate.PRECEDENCE, ("before", False)),
+    (DeclareModelTemplate.CHAIN_PRECEDENCE, ("previous", False)),
+    (DeclareModelTemplate.NOT_RESPONDED_EXISTENCE, ("trace", True)),
+    (DeclareModelTemplate.NOT_RESPONSE, ("after", True)),
+    (DeclareModelTemplate.NOT_CHAIN_RESPONSE, ("next", True)),
+    (DeclareModelTemplate.NOT_PRECEDENCE, ("before", True)),
+    (DeclareModelTemplate.NOT_CHAIN_PRECEDENCE, ("previous", True)),
+])
+
 
 class DeclareMiner(AbstractDiscovery, ABC):
 
     def __init__(self, log: D4PyEventLog, consider_vacuity: bool, min_support: float, itemsets_support: float = 0.9,
-                 max_declare_cardinality: int = 1):
+                 max_declare_cardinality: int = 1, sampling: Optional[str] = None, confidence: float = 0.95,
+                 seed: Optional[int] = None):
         super().__init__(log, DeclareModel(), min_support)
         self.consider_vacuity: bool = consider_vacuity
         self.itemsets_support: float = itemsets_support
         self.max_declare_cardinality: int = max_declare_cardinality
+        self.sampling: Optional[str] = sampling
+        self.confidence: float = confidence
+        self.seed: Optional[int] = seed
+        self._trace_order = None
 
     def run(self) -> DeclareModel:
         """
@@ -59,17 +95,23 @@ class DeclareMiner(AbstractDiscovery, ABC):
             dictionary containing the results indexed by discovered constraints. The value is a dictionary with keys
             the tuples containing id and name of traces that satisfy the constraint. The values of this inner dictionary
             is a CheckerResult object containing the number of pendings, activations, violations, fulfilments.
+            In sampling mode, each discovered constraint stores its estimated support under the 'support' key and
+            the confidence interval under the 'support_interval' key.
         """
         print("Computing discovery ...")
         if self.event_log is None:
             raise RuntimeError("You must load a log before.")
         if self.max_declare_cardinality <= 0:
             raise RuntimeError("Cardinality must be greater than 0.")
+        if self.sampling is not None:
+            if not 0 < self.confidence < 1:
+                raise RuntimeError("Confidence must be in range (0, 1).")
+            self._trace_order = self.event_log.sample_trace_order(self.sampling, self.seed)
 
         frequent_item_sets = self.event_log.compute_frequent_itemsets(min_support=self.itemsets_support,
                                                                       case_id_col=self.event_log.get_case_name(),
                                                                       categorical_attributes=[self.event_log.get_concept_name()],
-                                                                      algorithm='fpgrowth', remove_column_prefix=True)
+                                                                      algorithm='bitset', remove_column_prefix=True)
 
         tpm_activities = self.event_log.get_event_attribute_values(self.event_log.get_concept_name())
         if not isinstance(tpm_activities, list):
@@ -82,10 +124,7 @@ class DeclareMiner(AbstractDiscovery, ABC):
                     constraint = {"template": template, "activities": list(item_set), "condition": ("", "")}
 
                     if not template.supports_cardinality:
-                        constraint_satisfaction = ConstraintChecker().constraint_checking_with_support(constraint,
-                                                                                                       self.event_log,
-                                                                                                       self.consider_vacuity,
-                                                                                                       self.min_support)
+                        constraint_satisfaction = self._is_supported(constraint)
                         # self.basic_discovery_results,= self.discover_constraint(self.event_log, constraint,
                         #                                                        self.consider_vacuity)
                         if constraint_satisfaction:
@@ -93,10 +132,7 @@ class DeclareMiner(AbstractDiscovery, ABC):
                     else:
                         for i in range(self.max_declare_cardinality):
                             constraint['n'] = i + 1
-                            constraint_satisfaction = ConstraintChecker().constraint_checking_with_support(constraint,
-                                                                                                           self.event_log,
-                                                                                                           self.consider_vacuity,
-                                                                                                           self.min_support)
+                            constraint_satisfaction = self._is_supported(constraint)
                             # self.basic_discovery_results,= self.discover_constraint(self.event_log, constraint,
                             #                                                        self.consider_vacuity)
                             if constraint_satisfaction:
@@ -108,10 +144,7 @@ class DeclareMiner(AbstractDiscovery, ABC):
                     constraint = {"template": template, "activities": list(item_set), "condition": ("", "")}
                     # self.basic_discovery_results,= self.discover_constraint(self.event_log, constraint,
                     #                                                        self.consider_vacuity)
-                    constraint_satisfaction = ConstraintChecker().constraint_checking_with_support(constraint,
-                                                                                                   self.event_log,
-                                                                                                   self.consider_vacuity,
-                                                                                                   self.min_support)
+                    constraint_satisfaction = self._is_supported(constraint)
                     if constraint_satisfaction:
                         self.process_model.constraints.append(constraint.copy())
                     # constraint['activities'] = ', '.join(reversed(list(item_set)))
@@ -119,15 +152,316 @@ class DeclareMiner(AbstractDiscovery, ABC):
                     constraint['activities'] = list(reversed(list(item_set)))
                     # self.basic_discovery_results,= self.discover_constraint(self.event_log, constraint,
                     #                                                        self.consider_vacuity)
-                    constraint_satisfaction = ConstraintChecker().constraint_checking_with_support(constraint,
-                                                                                                   self.event_log,
-                                                                                                   self.consider_vacuity,
-                                                                                                   self.min_support)
+                    constraint_satisfaction = self._is_supported(constraint)
                     if constraint_satisfaction:
                         self.process_model.constraints.append(constraint.copy())
         self.process_model.set_constraints()
         return self.process_model
 
+    def _is_supported(self, constraint: dict) -> bool:
+        """
+        Checks whether the constraint reaches the minimum support, exactly or, in sampling mode, with the given
+        confidence. In sampling mode the support estimate is stored in the constraint.
+        """
+        if self.sampling is None:
+            return ConstraintChecker().constraint_checking_with_support(constraint, self.event_log,
+                                                                        self.consider_vacuity, self.min_support)
+        estimate = ConstraintChecker().estimate_support(constraint, self.event_log, self.consider_vacuity,
+                                                        self.min_support, self._trace_order, self.confidence)
+        if estimate is None:
+            return False
+        constraint['support'] = estimate.support
+        constraint['support_interval'] = (estimate.lower_bound, estimate.upper_bound)
+        return estimate.lower_bound >= self.min_support
+
+    def discover_data_conditions(self, attributes: List[str]) -> DeclareModel:
+        """
+        Enriches the discovered model with MP-Declare activation conditions. For each binary constraint without
+        conditions, the activations are labelled as fulfilled or violated in a single vectorised pass over the
+        interned log, their payloads are gathered into columnar arrays, and all the thresholds of the conditions
+        'A.attr > x' and 'A.attr <= x' (numeric attributes) and 'A.attr is x' (categorical attributes) are swept at
+        once. The condition with the highest support is added to the model as a new constraint if it improves the
+        support of the constraint without conditions and reaches the minimum support.
+
+        Note:
+            only templates whose activations are fulfilled independently of each other are considered, i.e., all the
+            binary templates but the alternate and the choice ones. Supports are computed on non-vacuous
+            satisfactions, since vacuity would favour conditions that no event satisfies.
+
+        Parameters
+        ----------
+        attributes : list[str]
+            the event attributes the conditions are built on.
+
+        Returns
+        -------
+        DeclareModel
+            the discovered model extended with the data-aware constraints, which store their support under the
+            'support' key.
+        """
+        if self.event_log is None:
+            raise RuntimeError("You must load a log before.")
+        if not self.process_model.constraints:
+            raise RuntimeError("You must run a Discovery task before.")
+
+        log_length = self.event_log.get_length()
+        act_values, offsets, act_codes = self.event_log.attribute_log_encoding(self.event_log.get_concept_name())
+        act_idx = {act: code for code, act in enumerate(act_values)}
+        trace_ids = np.repeat(np.arange(log_length, dtype=np.int64), np.diff(offsets))
+        payloads = {attr: self._payload_columns(attr) for attr in attributes if not any(c.isspace() for c in attr)}
+
+        data_aware_constraints = []
+        for constraint in self.process_model.constraints:
+            template = constraint['template']
+            if template not in _DATA_AWARE_TEMPLATES or any(constraint['condition']):
+                continue
+            activities = constraint['activities']
+            if activities[0] not in act_idx or activities[1] not in act_idx:
+                continue
+            activations, fulfilled = self._activation_fulfilments(template, act_idx[activities[0]],
+                                                                  act_idx[activities[1]], act_codes, offsets,
+                                                                  trace_ids)
+            act_traces = trace_ids[activations]
+            has_violation = np.bincount(act_traces[~fulfilled], minlength=log_length) > 0
+            best_support = np.count_nonzero((np.bincount(act_traces, minlength=log_length) > 0) & ~has_violation)
+            best_condition = None
+            for attr, (numeric, categorical, values) in payloads.items():
+                for count, condition in (self._sweep_numeric_conditions(attr, numeric[activations], act_traces,
+                                                                        fulfilled, log_length),
+                                         self._sweep_categorical_conditions(attr, categorical[activations], values,
+                                                                            act_traces, fulfilled, log_length)):
+                    if condition is not None and count > best_support:
+                        best_support, best_condition = count, condition
+            if best_condition is not None and best_support / log_length >= self.min_support:
+                data_aware_constraints.append({"template": template, "activities": list(activities),
+                                               "condition": (best_condition, "", ""),
+                                               "support": best_support / log_length})
+
+        self.process_model.constraints += data_aware_constraints
+        self.process_model.serialized_constraints = []
+        self.process_model.set_constraints()
+        return self.process_model
+
+    def _payload_columns(self, attribute_name: str) -> Tuple[np.ndarray, np.ndarray, List]:
+        """
+        Returns the attribute as event-aligned columns: the numeric values (NaN if missing or not numeric) and the
+        codes of the string values (-1 if missing or not a string), together with the values indexed by the codes.
+        Strings that cannot be written in a condition are left out.
+        """
+        values, _, codes = self.event_log.attribute_log_encoding(attribute_name)
+        is_numeric = [isinstance(v, Number) and not isinstance(v, bool) for v in values]
+        is_string = [isinstance(v, str) and v.strip() != "" and not any(c in v for c in "|,[]") for v in values]
+        # the trailing entries are indexed by the code -1 of the events without the attribute
+        numeric_values = np.array([float(v) if num else np.nan for v, num in zip(values, is_numeric)] + [np.nan])
+        string_codes = np.array([i if string else -1 for i, string in enumerate(is_string)] + [-1], dtype=np.int64)
+        return numeric_values[codes], string_codes[codes], values
+
+    @staticmethod
+    def _activation_fulfilments(template: DeclareModelTemplate, code_a: int, code_b: int, act_codes: np.ndarray,
+                                offsets: np.ndarray, trace_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the positions of the activations of the constraint (template, a, b) in the interned log and whether
+        each of them is fulfilled.
+        """
+        window, is_negative = _DATA_AWARE_TEMPLATES[template]
+        reverse = template.reverseActivationTarget
+        code_activation, code_target = (code_b, code_a) if reverse else (code_a, code_b)
+        activations = np.flatnonzero(act_codes == code_activation)
+        targets = np.flatnonzero(act_codes == code_target)
+        n_traces = len(offsets) - 1
+        act_traces = trace_ids[activations]
+        if window == "trace":
+            has_target = (np.bincount(trace_ids[targets], minlength=n_traces) > 0)[act_traces]
+        elif window == "after":
+            last_target = np.full(n_traces, -1, dtype=np.int64)
+            np.maximum.at(last_target, trace_ids[targets], targets)
+            has_target = last_target[act_traces] > activations
+        elif window == "before":
+            first_target = np.full(n_traces, len(act_codes), dtype=np.int64)
+            np.minimum.at(first_target, trace_ids[targets], targets)
+            has_target = first_target[act_traces] < activations
+        else:
+            neighbour = activations + 1 if window == "next" else activations - 1
+            in_trace = (neighbour >= offsets[act_traces]) & (neighbour < offsets[act_traces + 1])
+            has_target = in_trace & (act_codes[np.clip(neighbour, 0, len(act_codes) - 1)] == code_target)
+        return activations, has_target != is_negative
+
+    @staticmethod
+    def _sweep_numeric_conditions(attr: str, values: np.ndarray, act_traces: np.ndarray, fulfilled: np.ndarray,
+                                  log_length: int) -> Tuple[int, Optional[str]]:
+        """
+        Sweeps all the thresholds x of the conditions 'A.attr > x' and 'A.attr <= x'. For 'A.attr > x', a trace is
+        (non-vacuously) satisfied iff the maximum value on its violated activations (V) is <= x and the maximum value
+        on its fulfilled activations (F) is > x, so the number of satisfied traces is #(V <= x) - #(max(V, F) <= x).
+        Symmetrically, with minima, for 'A.attr <= x'. Returns the best number of satisfied traces and condition.
+        """
+        defined = ~np.isnan(values)
+        if not defined.any():
+            return 0, None
+        values, act_traces, fulfilled = values[defined], act_traces[defined], fulfilled[defined]
+        thresholds = np.unique(values)
+        best_count, best_condition = 0, None
+        for operator in (">", "<="):
+            if operator == ">":
+                viol, ful = np.full(log_length, -np.inf), np.full(log_length, -np.inf)
+                np.maximum.at(viol, act_traces[~fulfilled], values[~fulfilled])
+                np.maximum.at(ful, act_traces[fulfilled], values[fulfilled])
+                first, second = viol, np.maximum(viol, ful)
+            else:
+                viol, ful = np.full(log_length, np.inf), np.full(log_length, np.inf)
+                np.minimum.at(viol, act_traces[~fulfilled], values[~fulfilled])
+                np.minimum.at(ful, act_traces[fulfilled], values[fulfilled])
+                first, second = ful, np.maximum(viol, ful)
+            counts = np.searchsorted(np.sort(first), thresholds, side="right") - \
+                np.searchsorted(np.sort(second), thresholds, side="right")
+            best = int(np.argmax(counts))
+            if counts[best] > best_count:
+                best_count, best_condition = int(counts[best]), f"A.{attr} {operator} {float(thresholds[best])!r}"
+        return best_count, best_condition
+
+    @staticmethod
+    def _sweep_categorical_conditions(attr: str, codes: np.ndarray, values: List, act_traces: np.ndarray,
+                                      fulfilled: np.ndarray, log_length: int) -> Tuple[int, Optional[str]]:
+        """
+        Evaluates all the conditions 'A.attr is x': a trace is (non-vacuously) satisfied iff it has a fulfilled
+        activation with value x and no violated one. Returns the best number of satisfied traces and condition.
+        """
+        defined = codes >= 0
+        if not defined.any():
+            return 0, None
+        keys = act_traces[defined] * len(values) + codes[defined]
+        n_keys = log_length * len(values)
+        has_fulfilled = np.bincount(keys[fulfilled[defined]], minlength=n_keys) > 0
+        has_violated = np.bincount(keys[~fulfilled[defined]], minlength=n_keys) > 0
+        satisfied_keys = np.flatnonzero(has_fulfilled & ~has_violated)
+        counts = np.bincount(satisfied_keys % len(values), minlength=len(values))
+        best = int(np.argmax(counts))
+        if counts[best] == 0:
+            return 0, None
+        return int(counts[best]), f"A.{attr} is {values[best]}"
+
+    def run_top_k(self, k: int, time_budget: Optional[float] = None,
+                  max_evaluations: Optional[int] = None) -> DeclareModel:
+        """
+        Performs a best-first discovery of the k DECLARE constraints with the highest support. Candidates are evaluated
+        in decreasing order of an upper bound of their support computed from the single-activity frequencies and the
+        template metadata, so the search stops as soon as no remaining candidate can enter the top-k. The search can
+        also be bounded by a wall-clock or an evaluation budget, in which case the best constraints found so far are
+        returned. The 'min_support' of the miner acts as a lower bound for the returned constraints.
+
+        Parameters
+        ----------
+        k : int
+            the number of constraints to discover.
+
+        time_budget : float, optional
+            the maximum number of seconds spent in evaluating candidates. The budget is checked between two
+            evaluations.
+
+        max_evaluations : int, optional
+            the maximum number of candidate constraints checked against the log.
+
+        Returns
+        -------
+        DeclareModel
+            the discovered constraints sorted by decreasing support. Each constraint stores its support under the
+            'support' key.
+        """
+        print("Computing top-k discovery ...")
+        if self.event_log is None:
+            raise RuntimeError("You must load a log before.")
+        if self.max_declare_cardinality <= 0:
+            raise RuntimeError("Cardinality must be greater than 0.")
+        if k <= 0:
+            raise RuntimeError("The number of constraints k must be greater than 0.")
+        if time_budget is not None and time_budget <= 0:
+            raise RuntimeError("The time budget must be greater than 0.")
+        if max_evaluations is not None and max_evaluations <= 0:
+            raise RuntimeError("The number of evaluations must be greater than 0.")
+
+        start_time = perf_counter()
+        log_length = self.event_log.get_length()
+        activity_counts = self.event_log.get_event_attribute_values(self.event_log.get_concept_name(),
+                                                                    count_once_per_case=True)
+        self.process_model.activities = activity_counts.keys()
+        freqs = {act: min(1.0, cnt / log_length) for act, cnt in activity_counts.items()}
+        start_freqs = {act: cnt / log_length for act, cnt in self.event_log.get_start_activities().items()}
+        end_freqs = {act: cnt / log_length for act, cnt in self.event_log.get_end_activities().items()}
+
+        # Max-heap on the support upper bound. Unary templates come first among equal bounds as they are cheaper
+        candidates = []
+        tie_breaker = count()
+        for template in DeclareModelTemplate.get_unary_templates():
+            cardinalities = range(1, self.max_declare_cardinality + 1) if template.supports_cardinality else [None]
+            for activity in freqs:
+                for n in cardinalities:
+                    constraint = {"template": template, "activities": [activity], "condition": ("", "")}
+                    if n is not None:
+                        constraint['n'] = n
+                    bound = self._support_upper_bound(constraint, freqs, start_freqs, end_freqs)
+                    if bound >= self.min_support:
+                        heapq.heappush(candidates, (-bound, False, next(tie_breaker), constraint))
+        for template in DeclareModelTemplate.get_binary_not_shortcut_templates():
+            for activation in freqs:
+                for target in freqs:
+                    if activation == target:
+                        continue
+                    constraint = {"template": template, "activities": [activation, target], "condition": ("", "")}
+                    bound = self._support_upper_bound(constraint, freqs, start_freqs, end_freqs)
+                    if bound >= self.min_support:
+                        heapq.heappush(candidates, (-bound, True, next(tie_breaker), constraint))
+
+        # Min-heap with the best k constraints found so far
+        top_k = []
+        evaluations = 0
+        checker = ConstraintChecker()
+        while candidates:
+            neg_bound, _, _, constraint = heapq.heappop(candidates)
+            threshold = top_k[0][0] if len(top_k) == k else self.min_support
+            if -neg_bound < threshold or (len(top_k) == k and -neg_bound == threshold):
+                break
+            if time_budget is not None and perf_counter() - start_time >= time_budget:
+                break
+            if max_evaluations is not None and evaluations >= max_evaluations:
+                break
+            support = checker.compute_support(constraint, self.event_log, self.consider_vacuity, threshold)
+            evaluations += 1
+            if support is not None:
+                heapq.heappush(top_k, (support, next(tie_breaker), constraint))
+                if len(top_k) > k:
+                    heapq.heappop(top_k)
+
+        for support, _, constraint in sorted(top_k, key=lambda c: (-c[0], c[1])):
+            constraint['support'] = support
+            self.process_model.constraints.append(constraint)
+        self.process_model.set_constraints()
+        return self.process_model
+
+    def _support_upper_bound(self, constraint: dict, freqs: Dict[str, float], start_freqs: Dict[str, float],
+                             end_freqs: Dict[str, float]) -> float:
+        """
+        Upper bound of the support of a constraint without data conditions given the fraction of traces containing
+        each activity (freqs) and starting/ending with it.
+        """
+        template: DeclareModelTemplate = constraint['template']
+        activities = constraint['activities']
+        if not template.is_binary:
+            if template is DeclareModelTemplate.INIT:
+                return start_freqs.get(activities[0], 0.0)
+            if template is DeclareModelTemplate.END:
+                return end_freqs.get(activities[0], 0.0)
+            if template is DeclareModelTemplate.ABSENCE:
+                return 1.0 - freqs[activities[0]] if constraint['n'] == 1 else 1.0
+            return freqs[activities[0]]  # existence and exactly need at least one occurrence
+        if template.both_activation_condition:  # choices need at least one of the activities
+            return min(1.0, freqs[activities[0]] + freqs[activities[1]])
+        activation_freq = freqs[activities[1]] if template.reverseActivationTarget else freqs[activities[0]]
+        vacuous_freq = 1.0 - activation_freq if self.consider_vacuity else 0.0
+        if template.is_negative:
+            return min(1.0, activation_freq + vacuous_freq)
+        # positive relations are (non-vacuously) satisfied only if both activities occur
+        return min(1.0, min(freqs[activities[0]], freqs[activities[1]]) + vacuous_freq)
+
     """
     def filter_discovery(self, min_support: float = 0, output_path: str = None) \
             -> Dict[str: Dict[Tuple[int, str]: CheckerResult]]:
@@ -1,8 +1,11 @@
 from Declare4Py.D4PyEventLog import D4PyEventLog
+from Declare4Py.ProcessMiningTasks.LogFiltering.LogMask import LogMask
 
+import numpy as np
+import pandas as pd
 import pm4py
 from pm4py.objects.log.obj import EventLog, Trace
-from typing import Union, Set, List, Tuple, Dict
+from typing import Union, Set, List, Tuple, Dict, Optional
 import packaging
 from packaging import version
 
@@ -156,8 +159,197 @@ class BasicFilters:
                                                                                values, level, retain)
             return filtered_event_attribute_val
 
-    def is_activity_of_i_state_A(self, activity: str, index: int):
-        log = self.event_log.get_log()
-        log_act = self.event_log.activity_key
-        traces = list(filter(lambda trace: (trace[index][log_act] == activity), log))
-        return traces
+    def is_activity_of_i_state_A(self, activity: str, index: int) -> List[Trace]:
+        """
+        Returns the traces whose event at position index (negative indexes counting from the end) is the activity.
+        """
+        return self.mask_activity_of_i_state(activity, index).get_traces()
+
+    def mask_time_range(self, start_date: str, end_date: str, mode: str = "events") -> LogMask:
+        """
+        Selects the events or the traces in a time range, as filter_time_range_contained does, without copying the
+        log. The timestamps are compared without their timezone, as pm4py does.
+
+        Args:
+            start_date: str in form year-month-day hours:minutes:seconds. E.g.: 2013-01-01 00:00:00
+            end_date: str in form year-month-day hours:minutes:seconds. E.g.: 2013-01-01 00:00:00
+            mode: 'events' selects the events in the range, 'traces_contained' the traces whose first and last events
+            are in the range, 'traces_intersecting' the traces whose interval intersects the range
+
+        Returns:
+            the event mask ('events' mode) or the trace mask of the selection.
+        """
+        dt1, dt2 = (pd.Timestamp(date).tz_localize(None).value for date in (start_date, end_date))
+        times, has_time = self._event_times(wall_clock=True)
+        if mode == "events":
+            return LogMask(self.event_log, event_mask=has_time & (dt1 <= times) & (times <= dt2))
+        first, last, has_first, has_last = self._trace_bounds(times, has_time)
+        if mode == "traces_contained":
+            return LogMask(self.event_log, trace_mask=has_first & has_last & (first >= dt1) & (last <= dt2))
+        if mode == "traces_intersecting":
+            intersecting = ((dt1 <= first) & (first <= dt2)) | ((dt1 <= last) & (last <= dt2)) | \
+                ((first <= dt1) & (dt1 <= last)) | ((first <= dt2) & (dt2 <= last))
+            return LogMask(self.event_log, trace_mask=has_first & has_last & intersecting)
+        raise RuntimeError(f"{mode} mode not supported. Choose between events, traces_contained and "
+                           f"traces_intersecting")
+
+    def mask_case_performance(self, min_performance: float, max_performance: float) -> LogMask:
+        """
+        Selects the traces whose duration, from their first to their last event, is in the performance interval, as
+        filter_case_performance does, without copying the log.
+
+        Args:
+            min_performance: minimum allowed case duration, in seconds
+            max_performance: maximum allowed case duration, in seconds
+
+        Returns:
+            the trace mask of the selection.
+        """
+        times, has_time = self._event_times(wall_clock=False)
+        first, last, has_first, has_last = self._trace_bounds(times, has_time)
+        durations = (last - first) / 1e9
+        return LogMask(self.event_log, trace_mask=has_first & has_last & (min_performance <= durations) &
+                       (durations <= max_performance))
+
+    def mask_start_activities(self, activities: Union[Set[str], List[str]], retain: bool = True,
+                              activity_key: str = "concept:name") -> LogMask:
+        """
+        Selects the (non-empty) traces starting with one of the activities, or not starting with any if not retain,
+        as filter_start_activities does, without copying the log.
+
+        Args:
+            activities: collection of start activities
+            retain: if True, we retain the traces starting with the given activities, if false, we drop them
+            activity_key: attribute to be used for the activity
+
+        Returns:
+            the trace mask of the selection.
+        """
+        return self._mask_bound_activity(activities, retain, activity_key, last=False)
+
+    def mask_end_activities(self, activities: Union[Set[str], List[str]], retain: bool = True,
+                            activity_key: str = "concept:name") -> LogMask:
+        """
+        Selects the (non-empty) traces ending with one of the activities, or not ending with any if not retain, as
+        filter_end_activities does, without copying the log.
+
+        Args:
+            activities: collection of end activities
+            retain: if True, we retain the traces ending with the given activities, if false, we drop them
+            activity_key: attribute to be used for the activity
+
+        Returns:
+            the trace mask of the selection.
+        """
+        return self._mask_bound_activity(activities, retain, activity_key, last=True)
+
+    def mask_variants_top_k(self, k: int, activity_key: str = "concept:name",
+                            trace_mask: Optional[np.ndarray] = None) -> LogMask:
+        """
+        Selects the traces of the k most frequent variants, as filter_variants_top_k does (the ties being broken by
+        the variants in descending order), without copying the log.
+
+        Args:
+            k: number of variants that should be kept
+            activity_key: attribute to be used for the activity
+            trace_mask: the traces among which the variants are counted and selected / Default: all the traces
+
+        Returns:
+            the trace mask of the selection.
+        """
+        values, offsets, codes = self.event_log.attribute_log_encoding(activity_key)
+        if trace_mask is None:
+            trace_mask = np.ones(len(offsets) - 1, dtype=bool)
+        variant_idx = {}
+        variant_ids = np.array([variant_idx.setdefault(tuple(codes[offsets[i]:offsets[i + 1]]), len(variant_idx))
+                                for i in range(len(offsets) - 1)], dtype=np.int64)
+        counts = np.bincount(variant_ids[trace_mask], minlength=len(variant_idx))
+        variants = [tuple(values[code] if code >= 0 else None for code in variant) for variant in variant_idx]
+        top_k = sorted(np.flatnonzero(counts), key=lambda i: (counts[i], variants[i]), reverse=True)[:max(k, 0)]
+        return LogMask(self.event_log, trace_mask=trace_mask & np.isin(variant_ids, top_k))
+
+    def mask_event_attribute_values(self, attribute_key: str, values: Union[Set[str], List[str]],
+                                    level: str = "case", retain: bool = True) -> LogMask:
+        """
+        Selects the traces or the events by the values of an event attribute, as filter_event_attribute_values does,
+        without copying the log.
+
+        Args:
+            attribute_key: attribute to filter
+            values: admitted (or forbidden) values
+            level: 'case' selects the traces where at least one of the values occurs, 'event' selects the events with
+            one of the values
+            retain: specifies if the values should be kept or removed
+
+        Returns:
+            the trace mask ('case' level) or the event mask ('event' level) of the selection.
+        """
+        attribute_values, offsets, codes = self.event_log.attribute_log_encoding(attribute_key)
+        value_codes = [code for code, value in enumerate(attribute_values) if value in set(values)]
+        has_value = np.isin(codes, value_codes)
+        if level == "event":
+            return LogMask(self.event_log, event_mask=has_value if retain else ~has_value)
+        if level == "case":
+            trace_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+            has_values = np.bincount(trace_ids[has_value], minlength=len(offsets) - 1) > 0
+            return LogMask(self.event_log, trace_mask=has_values if retain else ~has_values)
+        raise RuntimeError(f"{level} level not supported. Choose between case and event")
+
+    def mask_activity_of_i_state(self, activity: str, index: int) -> LogMask:
+        """
+        Selects the traces whose event at position index (negative indexes counting from the end) is the activity,
+        as is_activity_of_i_state_A does, without copying the log.
+
+        Args:
+            activity: the activity
+            index: the position of the event in the trace
+
+        Returns:
+            the trace mask of the selection.
+        """
+        offsets = self.event_log.attribute_log_encoding(self.event_log.activity_key)[1]
+        selected = np.zeros(len(offsets) - 1, dtype=bool)
+        trace_ids = self.event_log.attribute_position_index(self.event_log.activity_key, index).get(activity)
+        if trace_ids is not None:
+            selected[trace_ids] = True
+        return LogMask(self.event_log, trace_mask=selected)
+
+    def _mask_bound_activity(self, activities: Union[Set[str], List[str]], retain: bool, activity_key: str,
+                             last: bool) -> LogMask:
+        values, offsets, codes = self.event_log.attribute_log_encoding(activity_key)
+        non_empty = offsets[:-1] < offsets[1:]
+        bounds = (offsets[1:] - 1 if last else offsets[:-1])[non_empty]
+        activity_codes = [code for code, value in enumerate(values) if value in set(activities)]
+        selected = np.zeros(len(non_empty), dtype=bool)
+        in_activities = np.isin(codes[bounds], activity_codes)
+        selected[non_empty] = in_activities if retain else ~in_activities
+        return LogMask(self.event_log, trace_mask=selected)
+
+    def _event_times(self, wall_clock: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the timestamps of the events as int64 nanoseconds (the local wall-clock time if wall_clock, UTC
+        otherwise) and whether each event has a timestamp, converting each distinct timestamp once.
+        """
+        values, _, codes = self.event_log.attribute_log_encoding(self.event_log.timestamp_key)
+        timestamps = [pd.Timestamp(value) for value in values]
+        value_times = np.array([(timestamp.tz_localize(None) if wall_clock or timestamp.tzinfo is None
+                                 else timestamp.tz_convert("UTC")).value for timestamp in timestamps], dtype=np.int64)
+        has_time = codes >= 0
+        times = np.zeros(len(codes), dtype=np.int64)
+        times[has_time] = value_times[codes[has_time]]
+        return times, has_time
+
+    def _trace_bounds(self, times: np.ndarray, has_time: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                                                                               np.ndarray]:
+        """
+        Returns the timestamps of the first and last events of each trace, and whether they exist.
+        """
+        offsets = self.event_log.attribute_log_encoding(self.event_log.activity_key)[1]
+        non_empty = offsets[:-1] < offsets[1:]
+        first_events = np.where(non_empty, offsets[:-1], 0)
+        last_events = np.where(non_empty, offsets[1:] - 1, 0)
+        if len(times) == 0:
+            empty = np.zeros(len(non_empty), dtype=bool)
+            return np.zeros(len(non_empty), dtype=np.int64), np.zeros(len(non_empty), dtype=np.int64), empty, empty
+        return times[first_events], times[last_events], non_empty & has_time[first_events], \
+            non_empty & has_time[last_events]
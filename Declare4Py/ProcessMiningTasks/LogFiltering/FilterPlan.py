@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+import numpy as np
+from pandas import DataFrame
+from pm4py.objects.log.obj import EventLog
+
+from Declare4Py.D4PyEventLog import D4PyEventLog
+from Declare4Py.D4PyEventLogView import D4PyEventLogView
+from Declare4Py.ProcessMiningTasks.ConformanceChecking.LTLAnalyzer import LENGTH_TEMPLATES, POSITIONAL_TEMPLATES, \
+    check_template, run_single_trace
+from Declare4Py.ProcessMiningTasks.LogFiltering.BasicFilters import BasicFilters
+from Declare4Py.ProcessMiningTasks.LogFiltering.LogMask import LogMask
+from Declare4Py.ProcessModels.LTLModel import LTLModel
+from logaut import ltl2dfa
+
+# Costs of the filters: lookups of the first or last events of the traces, scans of the events of the log, python
+# loops on the traces and runs of automata
+INDEX, SCAN, VARIANTS, AUTOMATON = range(4)
+
+# Kinds of the filters: selections of traces, which commute, selections among the traces left by the previous filters,
+# which do not, and selections of events, which change the traces seen by the next filters
+TRACE, RANK, EVENT = "trace", "rank", "event"
+
+
+class FilterStep:
+    """
+    A filter of a FilterPlan: a function computing the trace mask (or the event mask for an event filter) of the
+    selection on a log, given the mask of the candidate traces left by the previous filters.
+    """
+    def __init__(self, description: str, kind: str, cost: int,
+                 evaluate: Callable[[BasicFilters, np.ndarray], np.ndarray]):
+        self.description: str = description
+        self.kind: str = kind
+        self.cost: int = cost
+        self.evaluate: Callable[[BasicFilters, np.ndarray], np.ndarray] = evaluate
+
+
+class AutomatonStep(FilterStep):
+    """
+    A filter on the traces accepted by the automaton of an LTL model. The automaton is built on the first evaluation,
+    and run once per distinct sequence of the attributes of the formula, whose results are kept across evaluations.
+    """
+    def __init__(self, model: LTLModel, minimize_automaton: bool):
+        super().__init__(f"ltl({model.formula})", TRACE, AUTOMATON, self._evaluate)
+        self.model: LTLModel = model
+        self.minimize_automaton: bool = minimize_automaton
+        self.accepted: Dict[Tuple, bool] = {}
+        self._dfa = None
+
+    def get_dfa(self):
+        if self._dfa is None:
+            dfa = ltl2dfa(self.model.parsed_formula, backend=self.model.backend)
+            self._dfa = dfa.minimize() if self.minimize_automaton else dfa
+        return self._dfa
+
+    def _evaluate(self, filters: BasicFilters, candidates: np.ndarray) -> np.ndarray:
+        selected = np.zeros(len(candidates), dtype=bool)
+        for i, _, is_accepted in self._run(filters, candidates):
+            selected[i] = is_accepted
+        return selected
+
+    def sample_acceptance(self, filters: BasicFilters, candidates: np.ndarray, sample_size: int) -> float:
+        """
+        Returns the rate of acceptance of the first sample_size distinct candidate traces.
+        """
+        sample = {}
+        for _, key, is_accepted in self._run(filters, candidates, sample_size):
+            sample[key] = is_accepted
+        return sum(sample.values()) / max(len(sample), 1)
+
+    def _run(self, filters: BasicFilters, candidates: np.ndarray, limit: Optional[int] = None):
+        """
+        Yields each candidate trace, the key of its sequence and whether the automaton accepts it, running the
+        automaton once per distinct sequence, on the traces of the first limit distinct sequences only if limit is
+        given.
+        """
+        log = filters.event_log.get_log()
+        if isinstance(log, DataFrame):
+            raise RuntimeError("The log must be in EventLog format to be filtered by an LTL model.")
+        attributes = self.model.attribute_type
+        encodings = [filters.event_log.attribute_log_encoding(attribute) for attribute in attributes]
+        offsets = filters.event_log.attribute_log_encoding(filters.event_log.activity_key)[1]
+        codes = np.stack([encoding[2] for encoding in encodings]) if len(encodings) > 0 \
+            else np.zeros((0, offsets[-1]), dtype=np.int64)
+        results = {}
+        for i in np.flatnonzero(candidates):
+            trace_codes = codes[:, offsets[i]:offsets[i + 1]]
+            key = (trace_codes.shape[1], trace_codes.tobytes())
+            if key not in results:
+                if limit is not None and len(results) == limit:
+                    continue
+                # the results are kept across logs, whose codes differ, by the values of the sequence
+                sequence = (trace_codes.shape[1],) + tuple(
+                    tuple(values[code] if code >= 0 else None for code in attribute_codes)
+                    for (values, _, _), attribute_codes in zip(encodings, trace_codes))
+                if sequence not in self.accepted:
+                    self.accepted[sequence] = run_single_trace(log[int(i)], self.get_dfa(), self.model.backend,
+                                                               attributes)
+                results[key] = self.accepted[sequence]
+            yield i, key, results[key]
+
+
+class FilterPlan:
+    """
+    A lazy chain of filters of a D4PyEventLog, e.g., log.filter().start_activities(["A"]).ltl(model).count(). The
+    filters are only recorded when chained, and run when the plan is executed (by mask, to_log, to_event_log, to_view
+    or count) in a single pass over the log, in order of cost instead of in order of chaining: the lookups of the
+    first and last events of the traces, then the scans of the events, the python loops on the traces and lastly the
+    automata of the LTL models, each one evaluated only on the traces left by the previous ones and skipped when no
+    trace is left. The automata are run once per distinct trace and in order of selectivity, estimated by running
+    them on a sample of the candidate traces.
+
+    The filters whose result depends on the previous ones keep their place in the chain: variants_top_k selects the
+    most frequent variants among the traces left by the filters before it, and the filters of events (time_range in
+    events mode, event_attribute_values at the event level) change the traces seen by the filters after them, which
+    are run on the filtered log.
+    """
+
+    def __init__(self, event_log: D4PyEventLog, sample_size: int = 32):
+        """
+        Args:
+            event_log: the log to be filtered
+            sample_size: the number of distinct candidate traces on which the selectivity of the automata is estimated
+        """
+        self.event_log: D4PyEventLog = event_log
+        self.sample_size: int = sample_size
+        self.steps: List[FilterStep] = []
+
+    def time_range(self, start_date: str, end_date: str, mode: str = "events") -> FilterPlan:
+        """
+        Adds the filter of the events or the traces in a time range, see BasicFilters.mask_time_range.
+        """
+        kind, cost = (EVENT, SCAN) if mode == "events" else (TRACE, SCAN)
+        return self._add(f"time_range({start_date}, {end_date}, {mode})", kind, cost,
+                         lambda filters, _: self._mask(filters.mask_time_range(start_date, end_date, mode), kind))
+
+    def case_performance(self, min_performance: float, max_performance: float) -> FilterPlan:
+        """
+        Adds the filter of the traces by duration, see BasicFilters.mask_case_performance.
+        """
+        return self._add(f"case_performance({min_performance}, {max_performance})", TRACE, SCAN,
+                         lambda filters, _: filters.mask_case_performance(min_performance,
+                                                                          max_performance).get_trace_mask())
+
+    def start_activities(self, activities: Union[Set[str], List[str]], retain: bool = True,
+                         activity_key: str = "concept:name") -> FilterPlan:
+        """
+        Adds the filter of the traces by start activity, see BasicFilters.mask_start_activities.
+        """
+        return self._add(f"start_activities({sorted(activities)}, retain={retain})", TRACE, INDEX,
+                         lambda filters, _: filters.mask_start_activities(activities, retain,
+                                                                          activity_key).get_trace_mask())
+
+    def end_activities(self, activities: Union[Set[str], List[str]], retain: bool = True,
+                       activity_key: str = "concept:name") -> FilterPlan:
+        """
+        Adds the filter of the traces by end activity, see BasicFilters.mask_end_activities.
+        """
+        return self._add(f"end_activities({sorted(activities)}, retain={retain})", TRACE, INDEX,
+                         lambda filters, _: filters.mask_end_activities(activities, retain,
+                                                                        activity_key).get_trace_mask())
+
+    def activity_of_i_state(self, activity: str, index: int) -> FilterPlan:
+        """
+        Adds the filter of the traces by the activity of their event at a position, see
+        BasicFilters.mask_activity_of_i_state.
+        """
+        return self._add(f"activity_of_i_state({activity}, {index})", TRACE, INDEX,
+                         lambda filters, _: filters.mask_activity_of_i_state(activity, index).get_trace_mask())
+
+    def variants_top_k(self, k: int, activity_key: str = "concept:name") -> FilterPlan:
+        """
+        Adds the filter of the traces of the k most frequent variants among the traces left by the previous filters,
+        see BasicFilters.mask_variants_top_k.
+        """
+        return self._add(f"variants_top_k({k})", RANK, VARIANTS,
+                         lambda filters, candidates: filters.mask_variants_top_k(
+                             k, activity_key, candidates).get_trace_mask())
+
+    def event_attribute_values(self, attribute_key: str, values: Union[Set[str], List[str]], level: str = "case",
+                               retain: bool = True) -> FilterPlan:
+        """
+        Adds the filter of the traces or the events by the values of an attribute, see
+        BasicFilters.mask_event_attribute_values.
+        """
+        kind = EVENT if level == "event" else TRACE
+        return self._add(f"event_attribute_values({attribute_key}, {sorted(values)}, {level}, retain={retain})",
+                         kind, SCAN, lambda filters, _: self._mask(
+                             filters.mask_event_attribute_values(attribute_key, values, level, retain), kind))
+
+    def ltl(self, model: LTLModel, minimize_automaton: bool = True) -> FilterPlan:
+        """
+        Adds the filter of the traces accepted by an LTL model, as LTLAnalyzer.run does. The models filled by a
+        positional template are checked as index lookups (see LTLAnalyzer.check_template), the other ones by their
+        automaton, which requires the log to be in EventLog format.
+
+        Args:
+            model: the LTL model
+            minimize_automaton: if the automaton should be minimized
+        """
+        if model.get_template() in POSITIONAL_TEMPLATES or model.get_template() in LENGTH_TEMPLATES:
+            return self._add(f"ltl({model.formula})", TRACE, INDEX,
+                             lambda filters, _: check_template(filters.event_log, model))
+        self.steps.append(AutomatonStep(model, minimize_automaton))
+        return self
+
+    def mask(self) -> LogMask:
+        """
+        Executes the plan.
+
+        Returns:
+            the trace mask of the selection, or its event mask if the plan has filters of events.
+        """
+        return self._execute(self.event_log, self.steps)
+
+    def to_log(self) -> Union[EventLog, DataFrame]:
+        """
+        Executes the plan and materialises the filtered log, see LogMask.to_log.
+        """
+        return self.mask().to_log()
+
+    def to_event_log(self) -> D4PyEventLog:
+        """
+        Executes the plan and materialises the filtered log as a D4PyEventLog, see LogMask.to_event_log.
+        """
+        return self.mask().to_event_log()
+
+    def to_view(self) -> D4PyEventLogView:
+        """
+        Executes the plan and returns the selected traces as a view of the log, see LogMask.to_view. The plan must not
+        have filters of events.
+        """
+        return self.mask().to_view()
+
+    def count(self) -> int:
+        """
+        Executes the plan and returns the number of selected traces.
+        """
+        return self.mask().count()
+
+    def explain(self) -> List[str]:
+        """
+        Returns the filters in order of execution, the automata of each group being sorted at run time by their
+        estimated selectivity.
+        """
+        return [step.description for stage in self._stages(self.steps) for step in stage]
+
+    def _add(self, description: str, kind: str, cost: int,
+             evaluate: Callable[[BasicFilters, np.ndarray], np.ndarray]) -> FilterPlan:
+        self.steps.append(FilterStep(description, kind, cost, evaluate))
+        return self
+
+    @staticmethod
+    def _mask(mask: LogMask, kind: str) -> np.ndarray:
+        return mask.get_event_mask() if kind == EVENT else mask.get_trace_mask()
+
+    @staticmethod
+    def _stages(steps: List[FilterStep]) -> List[List[FilterStep]]:
+        """
+        Splits the filters at the ones that do not commute with the previous filters, sorting the trace filters
+        between them by cost.
+        """
+        stages, stage = [], []
+        for step in steps:
+            if step.kind != TRACE:
+                stages.append(sorted(stage, key=lambda s: s.cost))
+                stages.append([step])
+                stage = []
+            else:
+                stage.append(step)
+        stages.append(sorted(stage, key=lambda s: s.cost))
+        return [stage for stage in stages if len(stage) > 0]
+
+    def _execute(self, event_log: D4PyEventLog, steps: List[FilterStep]) -> LogMask:
+        filters = BasicFilters(event_log)
+        offsets = event_log.attribute_log_encoding(event_log.activity_key)[1]
+        candidates = np.ones(len(offsets) - 1, dtype=bool)
+        stages = self._stages(steps)
+        for stage_idx, stage in enumerate(stages):
+            if not candidates.any():
+                break
+            if stage[0].kind == EVENT:
+                event_mask = np.repeat(candidates, np.diff(offsets)) & stage[0].evaluate(filters, candidates)
+                trimmed = LogMask(event_log, event_mask=event_mask)
+                remaining = [step for next_stage in stages[stage_idx + 1:] for step in next_stage]
+                if len(remaining) == 0 or not event_mask.any():
+                    return trimmed
+                # the next filters run on the filtered log, whose events are the selected ones in the same order
+                selected = self._execute(trimmed.to_event_log(keep_row_order=False), remaining).get_event_mask()
+                event_mask[np.flatnonzero(event_mask)] = selected
+                return LogMask(event_log, event_mask=event_mask)
+            automata = [step for step in stage if step.cost == AUTOMATON]
+            for step in stage:
+                if not candidates.any():
+                    break
+                if step.cost != AUTOMATON:
+                    candidates = candidates & step.evaluate(filters, candidates)
+            if len(automata) > 1 and candidates.any():
+                # the most selective automata first, by their acceptance rate on a sample of the candidates
+                automata = sorted(automata, key=lambda step: step.sample_acceptance(filters, candidates,
+                                                                                    self.sample_size))
+            for step in automata:
+                if not candidates.any():
+                    break
+                candidates = candidates & step.evaluate(filters, candidates)
+        return LogMask(event_log, trace_mask=candidates)
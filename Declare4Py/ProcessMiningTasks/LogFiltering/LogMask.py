@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pm4py.objects.log.obj import EventLog, Trace
+
+from Declare4Py.D4PyEventLog import D4PyEventLog
+from Declare4Py.D4PyEventLogView import D4PyEventLogView
+
+
+class LogMask:
+    """
+    A lazy selection of the traces or of the events of a D4PyEventLog, as a boolean mask over its columnar encoding
+    (see D4PyEventLog.attribute_log_encoding): a trace mask has an entry for each trace, an event mask an entry for each
+    event, the events of the i-th trace being the ones between positions offsets[i] and offsets[i + 1]. Masks of the
+    same log are composed with & (intersection), | (union) and ~ (complement), a trace mask being combined with an
+    event mask as the mask of all the events of its traces. The filtered log is built only when materialised by
+    to_log or get_traces, sharing the traces and events of the log instead of copying them, or viewed by to_view.
+    """
+
+    def __init__(self, event_log: D4PyEventLog, trace_mask: Optional[np.ndarray] = None,
+                 event_mask: Optional[np.ndarray] = None):
+        """
+        Args:
+            event_log: the masked log
+            trace_mask: the boolean mask of the traces, for a trace-level selection
+            event_mask: the boolean mask of the events, for an event-level selection
+        """
+        if (trace_mask is None) == (event_mask is None):
+            raise RuntimeError("A log mask is either a trace mask or an event mask.")
+        self.event_log: D4PyEventLog = event_log
+        self.trace_mask: Optional[np.ndarray] = trace_mask
+        self.event_mask: Optional[np.ndarray] = event_mask
+
+    @property
+    def is_event_mask(self) -> bool:
+        return self.event_mask is not None
+
+    def get_offsets(self) -> np.ndarray:
+        """
+        Returns the offsets of the events of each trace, see D4PyEventLog.attribute_log_encoding.
+        """
+        return self.event_log.attribute_log_encoding(self.event_log.activity_key)[1]
+
+    def get_event_mask(self) -> np.ndarray:
+        """
+        Returns the mask of the selected events, all the events of the selected traces for a trace mask.
+        """
+        if self.event_mask is not None:
+            return self.event_mask
+        return np.repeat(self.trace_mask, np.diff(self.get_offsets()))
+
+    def get_trace_mask(self) -> np.ndarray:
+        """
+        Returns the mask of the selected traces, the ones with at least a selected event for an event mask.
+        """
+        if self.trace_mask is not None:
+            return self.trace_mask
+        offsets = self.get_offsets()
+        trace_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        return np.bincount(trace_ids[self.event_mask], minlength=len(offsets) - 1) > 0
+
+    def get_trace_indices(self) -> np.ndarray:
+        """
+        Returns the indices of the selected traces.
+        """
+        return np.flatnonzero(self.get_trace_mask())
+
+    def count(self) -> int:
+        """
+        Returns the number of selected traces.
+        """
+        return int(np.count_nonzero(self.get_trace_mask()))
+
+    def _combine(self, other: LogMask, combine) -> LogMask:
+        if other.event_log is not self.event_log:
+            raise RuntimeError("Only masks of the same log can be combined.")
+        if not self.is_event_mask and not other.is_event_mask:
+            return LogMask(self.event_log, trace_mask=combine(self.trace_mask, other.trace_mask))
+        return LogMask(self.event_log, event_mask=combine(self.get_event_mask(), other.get_event_mask()))
+
+    def __and__(self, other: LogMask) -> LogMask:
+        return self._combine(other, np.logical_and)
+
+    def __or__(self, other: LogMask) -> LogMask:
+        return self._combine(other, np.logical_or)
+
+    def __invert__(self) -> LogMask:
+        if self.is_event_mask:
+            return LogMask(self.event_log, event_mask=~self.event_mask)
+        return LogMask(self.event_log, trace_mask=~self.trace_mask)
+
+    def get_traces(self) -> List[Trace]:
+        """
+        Returns the selected traces of the log (the very Trace objects of the log for a trace mask, new traces of its
+        selected events for an event mask, dropping the traces without selected events).
+        """
+        log = self.event_log.get_log()
+        if isinstance(log, DataFrame):
+            raise RuntimeError("The log must be in EventLog format to get its traces.")
+        if not self.is_event_mask:
+            return [log[i] for i in self.get_trace_indices()]
+        offsets = self.get_offsets()
+        traces = []
+        for i in self.get_trace_indices():
+            kept = np.flatnonzero(self.event_mask[offsets[i]:offsets[i + 1]])
+            traces.append(Trace([log[i][j] for j in kept], attributes=log[i].attributes))
+        return traces
+
+    def to_log(self, keep_row_order: bool = True) -> Union[EventLog, DataFrame]:
+        """
+        Materialises the filtered log, in the format of the masked log.
+
+        Args:
+            keep_row_order: for a DataFrame log, if True the rows keep their order, otherwise they are grouped by
+            case as the events of the encoding
+
+        Returns:
+            the filtered EventLog or the filtered rows of the DataFrame log.
+        """
+        log = self.event_log.get_log()
+        if isinstance(log, DataFrame):
+            # the events of the encoding are the rows grouped by case, see D4PyEventLog.attribute_log_encoding
+            trace_ids, _ = pd.factorize(log[self.event_log.case_id_key], sort=False)
+            rows = np.argsort(trace_ids, kind="stable")[self.get_event_mask()]
+            return log.iloc[np.sort(rows) if keep_row_order else rows]
+        return EventLog(self.get_traces(), attributes=log.attributes, extensions=log.extensions,
+                        omni_present=log.omni_present, classifiers=log.classifiers, properties=log.properties)
+
+    def to_event_log(self, keep_row_order: bool = True) -> D4PyEventLog:
+        """
+        Materialises the filtered log as a D4PyEventLog, with the keys of the masked log, see to_log.
+        """
+        filtered = D4PyEventLog(case_name=self.event_log.case_id_key)
+        filtered.log = self.to_log(keep_row_order)
+        filtered.log_length = self.count()
+        filtered.activity_key = self.event_log.activity_key
+        filtered.timestamp_key = self.event_log.timestamp_key
+        return filtered
+
+    def to_view(self) -> D4PyEventLogView:
+        """
+        Returns the selected traces as a view of the masked log, without copying them, see D4PyEventLogView. Only
+        trace masks select whole traces.
+        """
+        if self.is_event_mask:
+            raise RuntimeError("Only a trace mask can be viewed, an event mask changes the traces.")
+        return D4PyEventLogView(self.event_log, self.get_trace_indices())
@@ -1,14 +1,21 @@
 from __future__ import annotations
 
+import multiprocessing
+import os
 import pdb
 import re
 from abc import ABC
-from typing import Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
 from Declare4Py.D4PyEventLog import D4PyEventLog
 from Declare4Py.ProcessMiningTasks.AbstractQueryChecking import AbstractQueryChecking
 from Declare4Py.ProcessMiningTasks.QueryChecking.DeclareResultsBrowser import DeclareResultsBrowser
 from Declare4Py.ProcessModels.DeclareModel import DeclareModel, DeclareModelTemplate
-from Declare4Py.Utils.Declare.Checkers import ConstraintChecker
+from Declare4Py.Utils.Declare.BatchChecker import BatchConstraintChecker
+from Declare4Py.Utils.Declare.Checkers import ConstraintChecker, EventConditionCache
 
 """
 Initializes class QueryCheckingResults
@@ -60,8 +67,10 @@ class DeclareQueryChecker(AbstractQueryChecking, ABC):
         self.target_condition: Optional[str] = target_condition if target_condition is not None else ""
         self.time_condition: Optional[str] = time_condition if time_condition is not None else ""
         self.max_declare_cardinality: int = max_declare_cardinality
+        self._condition_cache: Optional[EventConditionCache] = None
+        self._batch_checker: Optional[BatchConstraintChecker] = None
 
-    def run(self) -> DeclareResultsBrowser:
+    def run(self, n_jobs: Optional[int] = 1) -> DeclareResultsBrowser:
         """
         Performs query checking for a (list of) template, activation activity and target activity. Optional
         activation, target and time conditions can be specified.
@@ -98,6 +107,9 @@ class DeclareQueryChecker(AbstractQueryChecking, ABC):
         min_support : float, optional
             the minimum support that a constraint needs to have to be included in the result (default 1).
 
+        n_jobs : int, optional
+            the number of processes checking the templates in parallel (default 1). None uses all the CPUs.
+
         Returns
         -------
         basic_query_checking_results
@@ -105,6 +117,45 @@ class DeclareQueryChecker(AbstractQueryChecking, ABC):
             representations of these constraints.
         """
 
+        results_browser = DeclareResultsBrowser([])
+        query_checker_results = self._run_iter(cheapest_first=False, n_jobs=n_jobs, ordered=True)
+        for query_checker_result in query_checker_results:
+            results_browser.add_result(query_checker_result)
+            if self.return_first:
+                break
+        query_checker_results.close()  # stops the workers, if any
+        return results_browser
+
+    def run_iter(self, cheapest_first: bool = True, n_jobs: Optional[int] = 1) -> Iterator[List[Optional[str]]]:
+        """
+        Performs query checking as run, but yields each satisfying assignment as soon as its support reaches the
+        minimum support, so that the results can be shown progressively and the query checking can be stopped at any
+        time by closing the generator. The results can be collected incrementally in a DeclareResultsBrowser with
+        add_result.
+
+        Parameters
+        ----------
+        cheapest_first : bool, optional
+            True (default) to check first the templates that are cheaper to evaluate, i.e., the ones whose conditions
+            can be checked in batch before the ones requiring the per-trace checkers and, within each group, the unary
+            templates before the binary ones. False to check the templates in the order of run.
+
+        n_jobs : int, optional
+            the number of processes checking the templates in parallel (default 1). None uses all the CPUs. The
+            query is split in work units (a unary template or a binary template with one activation activity) that
+            the processes check against the log shared with the parent process, and the results are yielded in the
+            order in which the work units complete.
+
+        Returns
+        -------
+        query_checker_results
+            generator of the satisfying assignments, each one as a list [template, activation, target,
+            activation_condition, target_condition, time_condition]. Target and target condition are None for unary
+            templates.
+        """
+        return self._run_iter(cheapest_first, n_jobs, ordered=False)
+
+    def _run_iter(self, cheapest_first: bool, n_jobs: Optional[int], ordered: bool) -> Iterator[List[Optional[str]]]:
         is_template_given = bool(self.template)
         is_activation_given = bool(self.activation)
         is_target_given = bool(self.target)
@@ -123,7 +174,53 @@ class DeclareQueryChecker(AbstractQueryChecking, ABC):
             raise RuntimeError("Cardinality must be greater than 0.")
         if self.event_log is None:
             raise RuntimeError("You must load a log before.")
+        if n_jobs is not None and n_jobs <= 0:
+            raise RuntimeError("The number of jobs must be greater than 0.")
+
+        return self._iter_results(cheapest_first, n_jobs if n_jobs is not None else os.cpu_count(), ordered)
 
+    def _iter_results(self, cheapest_first: bool, n_jobs: int = 1,
+                      ordered: bool = True) -> Iterator[List[Optional[str]]]:
+        """
+        Generates the satisfying assignments of the (validated) query, see run_iter. With more than one job, the work
+        units are checked by a pool of processes sharing the indexed log, and their results are yielded as they come
+        (in the order of the work units if ordered is True).
+        """
+        work_units = self._work_units(cheapest_first)
+        if n_jobs == 1 or len(work_units) <= 1:
+            for work_unit in work_units:
+                yield from self._check_work_unit(*work_unit)
+            return
+
+        # forked workers share the log and its index with the parent process (copy-on-write)
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        with context.Pool(min(n_jobs, len(work_units)), initializer=_init_worker, initargs=(self,)) as pool:
+            results = pool.imap(_check_work_unit, work_units) if ordered \
+                else pool.imap_unordered(_check_work_unit, work_units)
+            for query_checker_results in results:
+                yield from query_checker_results
+
+    def _work_units(self, cheapest_first: bool) -> List[Tuple[str, Optional[int], bool, List[Tuple[str, ...]]]]:
+        """
+        Splits the query in independent work units, one for each unary template and one for each binary template and
+        activation activity, and indexes the log for the batch checker.
+
+        Parameters
+        ----------
+        cheapest_first : bool
+            True to put first the templates that are cheaper to evaluate, see run_iter.
+
+        Returns
+        -------
+        work_units
+            list of tuples (template, cardinality, is_batchable, activities), where activities is the list of the
+            activity couples (or of the 1-tuples of activities for unary templates) to check.
+        """
+        is_template_given = bool(self.template)
+        is_target_given = bool(self.target)
         templates_to_check = list()
         if is_template_given:
             templates_to_check.append(self.template)
@@ -147,7 +244,7 @@ class DeclareQueryChecker(AbstractQueryChecking, ABC):
         targets_to_check = self.event_log.get_event_attribute_values(self.event_log.activity_key) \
             if self.target is None else [self.target]
         if not isinstance(targets_to_check, list):
-            activations_to_check = targets_to_check.keys()
+            targets_to_check = targets_to_check.keys()
 
         activity_combos = []
         for activation in activations_to_check:
@@ -155,63 +252,202 @@ class DeclareQueryChecker(AbstractQueryChecking, ABC):
                 if activation != target:
                     activity_combos.append((activation, target))
 
-        # activity_combos = tuple(filter(lambda c: c[0] != c[1], product(activations_to_check, targets_to_check)))
-        query_checker_results = []
+        # the conditions of the query are the same for all the assignments, so they are evaluated once per event
+        self._condition_cache = EventConditionCache(self.event_log)
+        self._batch_checker = BatchConstraintChecker(self.event_log, self.consider_vacuity, self._condition_cache)
+        query_conditions = (self.activation_condition, self.target_condition, self.time_condition)
+
+        templates = []
         for template_str in templates_to_check:
             template_str, cardinality = re.search(r'(^.+?)(\d*$)', template_str).groups()
             template = DeclareModelTemplate.get_template_from_string(template_str)
+            templates.append((template_str, template, int(cardinality) if cardinality else None,
+                              self._batch_checker.is_batchable(template, *query_conditions)))
+        if cheapest_first:
+            templates.sort(key=lambda t: (not t[3], t[1].is_binary))
+
+        # assignments whose support cannot reach the minimum support, given the traces containing their activities,
+        # are dropped before any check
+        log_length = self.event_log.get_length()
+        activities, co_occurrences = self.event_log.attribute_occurrence_index(self.event_log.activity_key)
+        activity_idx = {activity: code for code, activity in enumerate(activities)}
+
+        def is_feasible(template: DeclareModelTemplate, constraint_activities: Tuple[str, ...]) -> bool:
+            upper_bound = self._support_upper_bound(template, constraint_activities, activity_idx, co_occurrences)
+            return log_length > 0 and upper_bound / log_length >= self.min_support
+
+        work_units = []
+        for template_str, template, cardinality, is_batchable in templates:
+            if not template.is_binary:
+                feasible_activities = [(activity,) for activity in activations_to_check
+                                       if is_feasible(template, (activity,))]
+                if feasible_activities:
+                    work_units.append((template_str, cardinality, is_batchable, feasible_activities))
+                continue
+            # the activation of the templates with reversed activation and target is the second activity
+            couples_by_activation = {}
+            for couple in activity_combos:
+                if is_feasible(template, couple):
+                    couples_by_activation.setdefault(couple[template.reverseActivationTarget], []).append(couple)
+            work_units += [(template_str, cardinality, is_batchable, couples)
+                           for couples in couples_by_activation.values()]
+        return work_units
+
+    def _support_upper_bound(self, template: DeclareModelTemplate, activities: Tuple[str, ...],
+                             activity_idx: Dict[str, int], co_occurrences: sparse.csr_matrix) -> int:
+        """
+        Upper bound of the number of traces satisfying an assignment, derived from the number of traces containing
+        its activities. The bounds hold whatever the conditions of the query, since conditions only discard events.
+
+        Parameters
+        ----------
+        template : DeclareModelTemplate
+            the template of the assignment.
 
-            constraint = {"template": template}
-            if cardinality:
-                constraint['n'] = int(cardinality)
+        activities : tuple[str, ...]
+            the activities of the assignment.
 
+        activity_idx : dict[str, int]
+            the code of each activity in the co-occurrence matrix.
+
+        co_occurrences : scipy.sparse.csr_matrix
+            the number of traces containing each couple of activities, see D4PyEventLog.attribute_occurrence_index.
+
+        Returns
+        -------
+        upper_bound
+            the maximum number of traces that can satisfy the assignment.
+        """
+        log_length = self.event_log.get_length()
+
+        def occurrences(*acts: str) -> int:
+            if any(act not in activity_idx for act in acts):
+                return 0
+            return int(co_occurrences[activity_idx[acts[0]], activity_idx[acts[-1]]])
+
+        if not template.is_binary:
+            # all the unary templates but Absence require the activity to occur (cardinalities start from 1)
+            return log_length if template is DeclareModelTemplate.ABSENCE else occurrences(activities[0])
+        if template.both_activation_condition:
+            union = occurrences(activities[0]) + occurrences(activities[1]) - occurrences(*activities)
+            if template is DeclareModelTemplate.EXCLUSIVE_CHOICE and not self.activation_condition.strip() \
+                    and not self.time_condition.strip():
+                return union - occurrences(*activities)
+            return union
+
+        activation, target = reversed(activities) if template.reverseActivationTarget else activities
+        # non-vacuous satisfactions need the activation and, for positive templates, the target
+        non_vacuous = occurrences(activation) if template.is_negative else occurrences(activation, target)
+        if not self.consider_vacuity:
+            return non_vacuous
+        if self.activation_condition.strip():
+            # the traces whose activations all fail the condition are vacuously satisfied
+            return log_length
+        return non_vacuous + log_length - occurrences(activation)
+
+    def _check_work_unit(self, template_str: str, cardinality: Optional[int], is_batchable: bool,
+                         activities: List[Tuple[str, ...]]) -> Iterator[List[Optional[str]]]:
+        """
+        Checks the assignments of a work unit (see _work_units) and yields the satisfying ones.
+        """
+        template = DeclareModelTemplate.get_template_from_string(template_str)
+        constraint = {"template": template}
+        if cardinality is not None:
+            constraint['n'] = cardinality
+
+        if is_batchable:
             if template.is_binary:
-                constraint['condition'] = (self.activation_condition, self.target_condition, self.time_condition)
-                for couple in activity_combos:
-                    # constraint['activities'] = ', '.join(couple)
-                    constraint['activities'] = couple
-
-                    # constraint_str = self.constraint_checking_with_support(constraint)
-                    constraint_satisfaction = ConstraintChecker().constraint_checking_with_support(constraint,
-                                                                                                   self.event_log,
-                                                                                                   self.consider_vacuity,
-                                                                                                   self.min_support)
-                    if constraint_satisfaction:
-                        # res_value = {
-                        #    "template": template_str, "activation": couple[0], "target": couple[1],
-                        #    "activation_condition": self.activation_condition, "target_condition": self.target_condition,
-                        #    "time_condition": self.time_condition
-                        # }
-                        # self.basic_query_checking_results[constraint_str] = res_value
-                        query_checker_results.append([template_str, couple[0], couple[1], self.activation_condition,
-                                                         self.target_condition, self.time_condition])
-                        if self.return_first:
-                            return DeclareResultsBrowser(query_checker_results)
-
-            else:  # unary template
-                constraint['condition'] = (self.activation_condition, self.time_condition)
-                for activity in activations_to_check:
-                    constraint['activities'] = activity
-
-                    # constraint_str = self.constraint_checking_with_support(constraint)
-                    constraint_satisfaction = ConstraintChecker().constraint_checking_with_support(constraint,
-                                                                                                   self.event_log,
-                                                                                                   self.consider_vacuity,
-                                                                                                   self. min_support)
-
-                    if constraint_satisfaction:
-                        query_checker_results.append([template_str, activity, None, self.activation_condition, None,
-                                                      self.time_condition])
-                        if self.return_first:
-                            return DeclareResultsBrowser(query_checker_results)
-                        # res_value = {
-                        #    "template": template_str, "activation": activity,
-                        #    "activation_condition": self.activation_condition, "time_condition": self.time_condition
-                        # }
-                        # self.basic_query_checking_results[constraint_str] = res_value
-
-        return DeclareResultsBrowser(query_checker_results)
+                satisfied = self._iter_batch_satisfied(self._batch_checker, template, constraint.get('n', 1),
+                                                       activities, [])
+            else:
+                satisfied = self._iter_batch_satisfied(self._batch_checker, template, constraint.get('n', 1), [],
+                                                       [activity for activity, in activities])
+            for satisfied_activities in satisfied:
+                yield self._query_result(template_str, template, satisfied_activities)
+            return
+
+        if template.is_binary:
+            constraint['condition'] = (self.activation_condition, self.target_condition, self.time_condition)
+        else:  # unary template
+            constraint['condition'] = (self.activation_condition, self.time_condition)
+        for constraint_activities in activities:
+            constraint['activities'] = list(constraint_activities)
+            if ConstraintChecker().constraint_checking_with_support(constraint, self.event_log, self.consider_vacuity,
+                                                                    self.min_support, self._condition_cache):
+                yield self._query_result(template_str, template, constraint_activities)
+
+    def _query_result(self, template_str: str, template: DeclareModelTemplate,
+                      activities: Tuple[str, ...]) -> List[Optional[str]]:
+        if template.is_binary:
+            return [template_str, activities[0], activities[1], self.activation_condition, self.target_condition,
+                    self.time_condition]
+        return [template_str, activities[0], None, self.activation_condition, None, self.time_condition]
+
+    def _iter_batch_satisfied(self, batch_checker: BatchConstraintChecker, template: DeclareModelTemplate, n: int,
+                              activity_combos: List[Tuple[str, str]],
+                              activities: List[str]) -> Iterator[Tuple[str, ...]]:
+        """
+        Checks all the assignments of a template together with the batch checker: the activations of each activity
+        are located once and the support of every (activation, target) couple is derived from the same windows. The
+        satisfying assignments of each activation activity are yielded as soon as they are computed.
+
+        Parameters
+        ----------
+        batch_checker : BatchConstraintChecker
+            the batch checker indexing the event log.
+
+        template : DeclareModelTemplate
+            the template to check, whose query conditions must be batchable.
+
+        n : int
+            the cardinality of the unary templates supporting it.
+
+        activity_combos : list[tuple[str, str]]
+            the (activation, target) couples to check for binary templates.
+
+        activities : list[str]
+            the activities to check for unary templates.
+
+        Returns
+        -------
+        satisfied
+            generator of the activity couples (or of the 1-tuples of activities for unary templates) reaching the
+            minimum support.
+        """
+        log_length = batch_checker.log_length
+        if log_length == 0:
+            return
+
+        if not template.is_binary:
+            for activity in activities:
+                count = batch_checker.count_unary(template, activity, self.activation_condition, self.time_condition, n)
+                if count / log_length >= self.min_support:
+                    yield (activity,)
+            return
+
+        # the activation of the templates with reversed activation and target is the second activity of the couple
+        couples_by_activation = {}
+        for couple in activity_combos:
+            activation, target = reversed(couple) if template.reverseActivationTarget else couple
+            couples_by_activation.setdefault(activation, []).append((target, couple))
+
+        for activation, targets in couples_by_activation.items():
+            counts = batch_checker.count_binary(template, activation, [target for target, _ in targets],
+                                                self.activation_condition, self.target_condition,
+                                                self.time_condition)
+            for (_, couple), count in zip(targets, counts):
+                if count / log_length >= self.min_support:
+                    yield couple
+
+
+# query checker inherited (or unpickled) by the workers of the process pool, see DeclareQueryChecker._iter_results
+_worker_query_checker: Optional[DeclareQueryChecker] = None
 
 
+def _init_worker(query_checker: DeclareQueryChecker) -> None:
+    global _worker_query_checker
+    _worker_query_checker = query_checker
 
 
+def _check_work_unit(work_unit: Tuple[str, Optional[int], bool, List[Tuple[str, ...]]]) -> List[List[Optional[str]]]:
+    return list(_worker_query_checker._check_work_unit(*work_unit))
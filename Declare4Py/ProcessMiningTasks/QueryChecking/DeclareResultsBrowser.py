@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List
+from typing import Iterable, List, Optional
 import pandas as pd
 
 """
@@ -16,10 +16,42 @@ Attributes
 class DeclareResultsBrowser:
 
     def __init__(self, query_checker_results: List[List[str]]):
-        self.df_results: pd.DataFrame = pd.DataFrame(query_checker_results, columns=["template", "activation", "target",
-                                                                                     "activation_condition",
-                                                                                     "target_condition",
-                                                                                     "time_condition"])
+        self.query_checker_results: List[List[str]] = list(query_checker_results)
+        self._df_results: Optional[pd.DataFrame] = None
+
+    @property
+    def df_results(self) -> pd.DataFrame:
+        # built lazily, so that adding results one by one does not copy the DataFrame each time
+        if self._df_results is None:
+            self._df_results = pd.DataFrame(self.query_checker_results, columns=["template", "activation", "target",
+                                                                                 "activation_condition",
+                                                                                 "target_condition", "time_condition"])
+        return self._df_results
+
+    def add_result(self, query_checker_result: List[str]) -> None:
+        """
+        Adds a satisfying assignment to the results, e.g., while consuming DeclareQueryChecker.run_iter.
+
+        Parameters
+        ----------
+        query_checker_result : list[str]
+            the assignment as a list [template, activation, target, activation_condition, target_condition,
+            time_condition].
+        """
+        self.query_checker_results.append(query_checker_result)
+        self._df_results = None
+
+    def add_results(self, query_checker_results: Iterable[List[str]]) -> None:
+        """
+        Adds the satisfying assignments of an iterable (e.g., DeclareQueryChecker.run_iter) to the results.
+
+        Parameters
+        ----------
+        query_checker_results : iterable of list[str]
+            the assignments, see add_result.
+        """
+        self.query_checker_results.extend(query_checker_results)
+        self._df_results = None
 
     def filter_query_checking(self, queries: List[str]) -> pd.DataFrame:
         """
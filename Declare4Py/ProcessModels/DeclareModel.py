@@ -3,6 +3,7 @@ from __future__ import annotations
 import re
 import typing
 from abc import ABC
+from collections.abc import Mapping
 from enum import Enum
 
 from Declare4Py.ProcessModels.LTLModel import LTLModel
@@ -211,6 +212,50 @@ class DeclareModelTemplate(str, Enum):
         return "\"" + str(self.__str__()) + "\""
 
 
+class DeclareModelTemplateMap(Mapping):
+    """
+    Read-only mapping keyed by DeclareModelTemplate members. The members cannot be the keys of a dict or a set, since
+    they all compare equal as strings, hence the entries are stored by template name.
+
+    """
+
+    def __init__(self, entries: typing.Iterable[typing.Tuple[DeclareModelTemplate, typing.Any]] = ()):
+        """
+        Parameters
+        ----------
+        entries: iterable of (DeclareModelTemplate, value)
+            The entries of the mapping.
+        """
+        self._entries: typing.Dict[str, typing.Tuple[DeclareModelTemplate, typing.Any]] = \
+            {template.templ_str: (template, value) for template, value in entries}
+
+    @classmethod
+    def of(cls, *templates: DeclareModelTemplate) -> DeclareModelTemplateMap:
+        """
+        Builds the set of the given templates, i.e., a mapping of each template to True.
+        """
+        return cls((template, True) for template in templates)
+
+    @property
+    def names(self) -> typing.List[str]:
+        """
+        The names of the templates of the mapping.
+        """
+        return list(self._entries)
+
+    def __getitem__(self, template: DeclareModelTemplate) -> typing.Any:
+        return self._entries[template.templ_str][1]
+
+    def __contains__(self, template: object) -> bool:
+        return isinstance(template, DeclareModelTemplate) and template.templ_str in self._entries
+
+    def __iter__(self) -> typing.Iterator[DeclareModelTemplate]:
+        return (template for template, _ in self._entries.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
 class DeclareModelConditionParserUtility:
     """
     Class to support backward-compatibility to some older code. It contains two methods which parse and evaluate
@@ -5,7 +5,7 @@ from logaut import ltl2dfa
 from Declare4Py.ProcessModels.AbstractModel import ProcessModel
 from pylogics.parsers import parse_ltl
 from Declare4Py.Utils.utils import Utils
-from typing import List
+from typing import List, Optional
 
 
 class LTLModel(ProcessModel, ABC):
@@ -17,6 +17,10 @@ class LTLModel(ProcessModel, ABC):
         self.parameters = []
         self.backend = backend
         self.attribute_type = []
+        # the template filling the formula and its activities, see LTLTemplate.fill_template
+        self.template: Optional[str] = None
+        self.template_activities: List[List[str]] = []
+        self._template_formula: Optional[str] = None
 
     def get_backend(self) -> str:
         """
@@ -28,6 +32,16 @@ class LTLModel(ProcessModel, ABC):
         """
         return self.backend
 
+    def get_template(self) -> Optional[str]:
+        """
+        Returns the name of the template filling the formula, if the formula was not changed since.
+
+        Returns:
+            str: the template, None if the formula is not a filled template
+
+        """
+        return self.template if self.formula == self._template_formula else None
+
     def to_lydia_backend(self) -> None:
         """
         Switch to lydia backend
@@ -1046,6 +1060,9 @@ class LTLTemplate:
             filled_model.parse_from_string(formula)
             filled_model.parameters = self.parameters
             filled_model.attribute_type = attr_type
+            filled_model.template = self.template_str
+            filled_model.template_activities = list(attributes)
+            filled_model._template_formula = filled_model.formula
         except (TypeError, RuntimeError):
             raise TypeError("Mismatched number of parameters or type")
         return filled_model
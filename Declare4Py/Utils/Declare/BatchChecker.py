@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from Declare4Py.D4PyEventLog import D4PyEventLog
+from Declare4Py.ProcessModels.DeclareModel import DeclareModelConditionParserUtility, DeclareModelTemplate, \
+    DeclareModelTemplateMap
+from Declare4Py.Utils.Declare.Checkers import EventConditionCache
+glob = {'__builtins__': None}
+
+# Window where the targets of an activation at position p are looked for, by template, and whether the template is
+# negative (a target in the window violates the activation)
+_WINDOWS = DeclareModelTemplateMap([
+    (DeclareModelTemplate.RESPONDED_EXISTENCE, ("trace", False)),
+    (DeclareModelTemplate.RESPONSE, ("after", False)),
+    (DeclareModelTemplate.ALTERNATE_RESPONSE, ("until_next_activation", False)),
+    (DeclareModelTemplate.CHAIN_RESPONSE, ("next", False)),
+    (DeclareModelTemplate.PRECEDENCE, ("before", False)),
+    (DeclareModelTemplate.ALTERNATE_PRECEDENCE, ("since_previous_activation", False)),
+    (DeclareModelTemplate.CHAIN_PRECEDENCE, ("previous", False)),
+    (DeclareModelTemplate.NOT_RESPONDED_EXISTENCE, ("trace", True)),
+    (DeclareModelTemplate.NOT_RESPONSE, ("after", True)),
+    (DeclareModelTemplate.NOT_CHAIN_RESPONSE, ("next", True)),
+    (DeclareModelTemplate.NOT_PRECEDENCE, ("before", True)),
+    (DeclareModelTemplate.NOT_CHAIN_PRECEDENCE, ("previous", True)),
+])
+
+# Templates whose checkers evaluate the time condition on single events, with T bound to the first event of the trace
+_EVENT_TIME_TEMPLATES = DeclareModelTemplateMap.of(
+    DeclareModelTemplate.CHOICE, DeclareModelTemplate.EXCLUSIVE_CHOICE, DeclareModelTemplate.EXISTENCE,
+    DeclareModelTemplate.ABSENCE, DeclareModelTemplate.EXACTLY)
+
+
+class BatchConstraintChecker:
+    """
+    Checks many constraints against the same (completed) log at once, giving the same states as the
+    TemplateConstraintChecker checkers. The log is indexed once: the activities are interned (see
+    D4PyEventLog.attribute_log_encoding) and the sorted positions of the events of each activity are kept, so that the
+    activations of a constraint and the windows where their targets are looked for are position arrays, and the
+    targets in every window are counted with a binary search. The activation and target conditions are evaluated once
+    per event through an EventConditionCache, so that they are shared among all the constraints using them.
+
+    Only conditions that can be evaluated on single events are supported, i.e., activation conditions on A, target
+    conditions on T and no time conditions for the binary templates, see is_batchable.
+    """
+
+    def __init__(self, event_log: D4PyEventLog, consider_vacuity: bool,
+                 condition_cache: Optional[EventConditionCache] = None):
+        self.event_log: D4PyEventLog = event_log
+        self.consider_vacuity: bool = consider_vacuity
+        self.condition_cache: EventConditionCache = condition_cache if condition_cache is not None \
+            else EventConditionCache(event_log)
+        self.declare_parser_utility = DeclareModelConditionParserUtility()
+        values, self.offsets, self.activity_codes = event_log.attribute_log_encoding(event_log.activity_key)
+        self.activity_idx: Dict[str, int] = {activity: code for code, activity in enumerate(values)}
+        self.log_length: int = len(self.offsets) - 1
+        self.trace_ids: np.ndarray = np.repeat(np.arange(self.log_length, dtype=np.int64), np.diff(self.offsets))
+        order = np.argsort(self.activity_codes, kind="stable")
+        bounds = np.searchsorted(self.activity_codes[order], np.arange(len(values) + 1))
+        self._activity_positions: List[np.ndarray] = [order[bounds[i]:bounds[i + 1]] for i in range(len(values))]
+        self._position_cache: Dict[Tuple, np.ndarray] = {}
+
+    def is_batchable(self, template: DeclareModelTemplate, activation_condition: str = "",
+                     target_condition: str = "", time_condition: str = "") -> bool:
+        """
+        Tells whether a constraint can be checked by the batch checker, i.e., whether its conditions can be evaluated
+        on single events.
+        Args:
+            template: the template of the constraint
+            activation_condition: the activation condition
+            target_condition: the target condition
+            time_condition: the time condition
+
+        Returns:
+            False if the conditions relate activation and target events or if they are formatted bad.
+        """
+        try:
+            if not self._names(self.declare_parser_utility.parse_data_cond(activation_condition)) <= {'A'}:
+                return False
+            if template.is_binary and template in _WINDOWS:
+                if not self._names(self.declare_parser_utility.parse_data_cond(target_condition)) <= {'T'}:
+                    return False
+                return self.declare_parser_utility.parse_time_cond(time_condition) == "True"
+            if template in _EVENT_TIME_TEMPLATES:
+                self._names(self.declare_parser_utility.parse_time_cond(time_condition))
+            return template in _WINDOWS or template in _EVENT_TIME_TEMPLATES \
+                or template is DeclareModelTemplate.INIT or template is DeclareModelTemplate.END
+        except SyntaxError:
+            return False
+
+    def count_unary(self, template: DeclareModelTemplate, activity: str, activation_condition: str = "",
+                    time_condition: str = "", n: int = 1) -> int:
+        """
+        Counts the traces satisfying a unary constraint.
+        Args:
+            template: the unary template
+            activity: the activity of the constraint
+            activation_condition: the activation condition
+            time_condition: the time condition
+            n: the cardinality of the templates supporting it
+
+        Returns:
+            the number of satisfied traces.
+        """
+        if template is DeclareModelTemplate.INIT or template is DeclareModelTemplate.END:
+            positions = self._positions(activity, activation_condition)
+            non_empty = self.offsets[:-1] < self.offsets[1:]
+            bounds = self.offsets[:-1] if template is DeclareModelTemplate.INIT else self.offsets[1:] - 1
+            return int(np.count_nonzero(np.isin(bounds[non_empty], positions)))
+        positions = self._positions(activity, activation_condition, time_condition=time_condition)
+        num_activations = np.bincount(self.trace_ids[positions], minlength=self.log_length)
+        if template is DeclareModelTemplate.EXISTENCE:
+            return int(np.count_nonzero(num_activations >= n))
+        if template is DeclareModelTemplate.ABSENCE:
+            return int(np.count_nonzero(num_activations < n))
+        if template is DeclareModelTemplate.EXACTLY:
+            return int(np.count_nonzero(num_activations == n))
+        raise RuntimeError(f"The template {template.templ_str} is not a supported unary template.")
+
+    def count_binary(self, template: DeclareModelTemplate, activation: str, targets: List[str],
+                     activation_condition: str = "", target_condition: str = "",
+                     time_condition: str = "") -> np.ndarray:
+        """
+        Counts the traces satisfying the binary constraints with the same template and activation activity and each
+        of the target activities. The windows of the activations are computed once and shared among the targets.
+        Args:
+            template: the binary template
+            activation: the activation activity, i.e., the second activity of the constraint for the templates with
+                reversed activation and target (e.g., Precedence)
+            targets: the target activities
+            activation_condition: the activation condition
+            target_condition: the target condition
+            time_condition: the time condition
+
+        Returns:
+            the number of satisfied traces for each target activity.
+        """
+        counts = np.zeros(len(targets), dtype=np.int64)
+        if template.both_activation_condition:
+            has_activation = self._traces_with(activation, activation_condition, time_condition)
+            for i, target in enumerate(targets):
+                has_target = self._traces_with(target, activation_condition, time_condition)
+                if template is DeclareModelTemplate.CHOICE:
+                    counts[i] = np.count_nonzero(has_activation | has_target)
+                else:
+                    counts[i] = np.count_nonzero(has_activation ^ has_target)
+            return counts
+
+        window, is_negative = _WINDOWS[template]
+        activations = self._positions(activation, activation_condition)
+        act_traces = self.trace_ids[activations]
+        lower, upper = self._windows(window, activations, act_traces)
+        has_activations = np.bincount(act_traces, minlength=self.log_length) > 0
+        if self.consider_vacuity:
+            has_activations[:] = True
+        for i, target in enumerate(targets):
+            target_positions = self._positions(target, target_condition, variable='T')
+            found = np.searchsorted(target_positions, upper) > np.searchsorted(target_positions, lower)
+            violations = found if is_negative else ~found
+            has_violations = np.bincount(act_traces[violations], minlength=self.log_length) > 0
+            counts[i] = np.count_nonzero(has_activations & ~has_violations)
+        return counts
+
+    def _windows(self, window: str, activations: np.ndarray, act_traces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the bounds [lower, upper) of the positions where the targets of each activation are looked for.
+        """
+        starts, ends = self.offsets[act_traces], self.offsets[act_traces + 1]
+        same_trace = act_traces[1:] == act_traces[:-1]
+        if window == "trace":
+            return starts, ends
+        if window == "after":
+            return activations + 1, ends
+        if window == "next":
+            return activations + 1, np.minimum(activations + 2, ends)
+        if window == "before":
+            return starts, activations
+        if window == "previous":
+            return np.maximum(activations - 1, starts), activations
+        if window == "until_next_activation":
+            next_activations = np.append(activations[1:], 0)
+            return activations + 1, np.where(np.append(same_trace, False), next_activations, ends)
+        previous_activations = np.insert(activations[:-1], 0, 0)
+        return np.where(np.insert(same_trace, 0, False), previous_activations + 1, starts), activations
+
+    def _traces_with(self, activity: str, activation_condition: str, time_condition: str) -> np.ndarray:
+        """
+        Returns whether each trace has an event of the activity satisfying the activation and time conditions.
+        """
+        positions = self._positions(activity, activation_condition, time_condition=time_condition)
+        return np.bincount(self.trace_ids[positions], minlength=self.log_length) > 0
+
+    def _positions(self, activity: str, condition: str, variable: str = 'A', time_condition: str = "") -> np.ndarray:
+        """
+        Returns the sorted positions of the events of the activity satisfying the data condition (bound to the given
+        variable) and the time condition (with T bound to the first event of the trace). The data condition is read
+        from the condition cache and the resulting positions are cached.
+        """
+        key = (activity, condition, variable, time_condition)
+        if key in self._position_cache:
+            return self._position_cache[key]
+        if activity not in self.activity_idx:
+            positions = np.empty(0, dtype=np.int64)
+        else:
+            positions = self._activity_positions[self.activity_idx[activity]]
+            data_rule = self.declare_parser_utility.parse_data_cond(condition)
+            time_rule = self.declare_parser_utility.parse_time_cond(time_condition)
+            positions = positions[self.condition_cache.evaluate(data_rule, positions, variable)]
+            if time_rule != "True":
+                time_code = compile(time_rule, "<condition>", "eval")
+                events = self.condition_cache.get_events()
+                mask = [bool(eval(time_code, glob, {'A': events[pos], 'T': events[self.offsets[self.trace_ids[pos]]],
+                                                   'timedelta': timedelta, 'abs': abs, 'float': float}))
+                        for pos in positions]
+                positions = positions[np.array(mask, dtype=bool)]
+        self._position_cache[key] = positions
+        return positions
+
+    @staticmethod
+    def _names(rule: str) -> set:
+        return set(compile(rule, "<condition>", "eval").co_names)
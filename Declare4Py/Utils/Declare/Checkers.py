@@ -3,8 +3,11 @@ from __future__ import annotations
 import pdb
 from abc import ABC
 from datetime import timedelta
-from math import ceil
-from typing import List, Optional
+from math import ceil, log, sqrt
+from types import CodeType
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
 
 from Declare4Py.D4PyEventLog import D4PyEventLog
 from Declare4Py.ProcessModels.DeclareModel import DeclareModel
@@ -16,7 +19,9 @@ glob = {'__builtins__': None}
 class ConstraintChecker:
 
     def check_trace_conformance(self, trace: dict, decl_model: DeclareModel, consider_vacuity: bool = False,
-                                concept_name: str = "concept:name") -> List[CheckerResult]:
+                                concept_name: str = "concept:name",
+                                condition_cache: Optional[EventConditionCache] = None,
+                                trace_idx: Optional[int] = None) -> List[CheckerResult]:
         """
         Checks whether the constraints are fulfillment, violation, pendings, activations etc
 
@@ -25,6 +30,9 @@ class ConstraintChecker:
         :param bool consider_vacuity: True means that vacuously satisfied traces are considered as satisfied, violated otherwise
         :param d4pyEventLog trace: log
         :param DeclareModel decl_model: Process mining model
+        :param EventConditionCache condition_cache: cache of the activation conditions evaluated on the events of the
+            log the trace belongs to
+        :param int trace_idx: position of the trace in the log, required with condition_cache
         Args:
             concept_name:
             concept_name:
@@ -45,7 +53,8 @@ class ConstraintChecker:
             rules["time"] = constraint['condition'][-1]  # time condition is always at last position
             try:
                 trace_results.append(TemplateConstraintChecker(trace, True, constraint['activities'], rules,
-                                                               concept_name).get_template(constraint['template'])())
+                                                               concept_name, condition_cache,
+                                                               trace_idx).get_template(constraint['template'])())
             except SyntaxError:
                 # TODO: use python logger
                 if constraint_str not in error_constraint_set:
@@ -54,7 +63,8 @@ class ConstraintChecker:
         return trace_results
 
     def constraint_checking_with_support(self, constraint: dict, event_log: D4PyEventLog, consider_vacuity: bool,
-                                         min_support: float) -> bool:
+                                         min_support: float,
+                                         condition_cache: Optional[EventConditionCache] = None) -> bool:
         """
         Check wheter a constraint is satisfied in a log up to a given minimum support
         Args:
@@ -62,6 +72,7 @@ class ConstraintChecker:
             event_log:
             min_support:
             constraint:
+            condition_cache: cache of the activation conditions shared among the constraints checked on the log
 
         Returns:
 
@@ -73,7 +84,8 @@ class ConstraintChecker:
         sat_ctr = 0
 
         for i, trace in enumerate(event_log.get_log()):
-            trc_res = self.check_trace_conformance(trace, tmp_model, consider_vacuity, event_log.activity_key)
+            trc_res = self.check_trace_conformance(trace, tmp_model, consider_vacuity, event_log.activity_key,
+                                                   condition_cache, i)
             if not trc_res:  # Occurring when constraint data conditions are formatted bad
                 break
             # constraint_str, checker_res = next(iter(trc_res.items()))  # trc_res will always have only one element inside
@@ -88,16 +100,98 @@ class ConstraintChecker:
                 return False # None
         return False # None
 
+    def compute_support(self, constraint: dict, event_log: D4PyEventLog, consider_vacuity: bool,
+                        min_support: float = 0.0,
+                        condition_cache: Optional[EventConditionCache] = None) -> Optional[float]:
+        """
+        Computes the support of a constraint in a log, i.e., the fraction of traces satisfying it. Differently from
+        constraint_checking_with_support, the whole log is scanned when the constraint reaches the minimum support, so
+        that the exact support is returned. The scan stops as soon as the minimum support cannot be reached anymore.
+        Args:
+            constraint: the constraint to check
+            event_log: the event log
+            consider_vacuity: True means that vacuously satisfied traces are considered as satisfied
+            min_support: the minimum support the constraint must reach
+            condition_cache: cache of the activation conditions shared among the constraints checked on the log
+
+        Returns:
+            the support of the constraint or None if it is lower than min_support.
+        """
+        tmp_model = DeclareModel()
+        tmp_model.constraints.append(constraint)
+        tmp_model.set_constraints()
+        log_length = event_log.get_length()
+        min_sat_ctr = ceil(log_length * min_support)
+        sat_ctr = 0
+
+        for i, trace in enumerate(event_log.get_log()):
+            trc_res = self.check_trace_conformance(trace, tmp_model, consider_vacuity, event_log.activity_key,
+                                                   condition_cache, i)
+            if not trc_res:  # Occurring when constraint data conditions are formatted bad
+                return None
+            if trc_res[0].state == TraceState.SATISFIED:
+                sat_ctr += 1
+            elif log_length - (i + 1) < min_sat_ctr - sat_ctr:
+                return None
+        support = sat_ctr / log_length if log_length > 0 else 0.0
+        return support if support >= min_support else None
+
+    def estimate_support(self, constraint: dict, event_log: D4PyEventLog, consider_vacuity: bool, min_support: float,
+                         trace_order: Sequence[int], confidence: float = 0.95, batch_size: int = 100,
+                         condition_cache: Optional[EventConditionCache] = None) -> Optional[SupportEstimate]:
+        """
+        Estimates the support of a constraint by checking the traces in the given (sampling) order until the decision
+        against the minimum support is statistically settled. Every 'batch_size' traces, a Hoeffding-Serfling
+        confidence interval is computed for the support and intersected with the deterministic bounds given by the
+        traces not yet checked, as in constraint_checking_with_support. The sampling stops when the interval lies
+        entirely above or below the minimum support. The error probability is spent across the evaluations (see
+        SupportEstimate), so that the decision holds with the given confidence although the interval is evaluated many
+        times. The guarantee assumes a uniform sampling order; the order stratified by variants is systematic and only
+        approximates it.
+        Args:
+            constraint: the constraint to check
+            event_log: the event log
+            consider_vacuity: True means that vacuously satisfied traces are considered as satisfied
+            min_support: the minimum support against which the constraint is decided
+            trace_order: permutation of the trace indices giving the sampling order, see D4PyEventLog.sample_trace_order
+            confidence: the confidence level of the interval
+            batch_size: the number of traces checked between two evaluations of the interval
+            condition_cache: cache of the activation conditions shared among the constraints checked on the log
+
+        Returns:
+            the support estimate or None if the constraint data conditions are formatted bad.
+        """
+        tmp_model = DeclareModel()
+        tmp_model.constraints.append(constraint)
+        tmp_model.set_constraints()
+        log_traces = event_log.get_log()
+        estimate = SupportEstimate(len(trace_order))
+
+        for trace_idx in trace_order:
+            trc_res = self.check_trace_conformance(log_traces[trace_idx], tmp_model, consider_vacuity,
+                                                   event_log.activity_key, condition_cache, trace_idx)
+            if not trc_res:  # Occurring when constraint data conditions are formatted bad
+                return None
+            estimate.add(trc_res[0].state == TraceState.SATISFIED)
+            if estimate.sample_size % batch_size == 0 or estimate.sample_size == estimate.population_size:
+                if estimate.is_settled(min_support, confidence):
+                    break
+        return estimate
+
+
 class TemplateConstraintChecker(ABC):
 
     def __init__(self, traces: dict, completed: bool, activities: List[str], rules: dict,
-                 concept_name: str = "concept:name"):
+                 concept_name: str = "concept:name", condition_cache: Optional[EventConditionCache] = None,
+                 trace_idx: Optional[int] = None):
         self.declare_parser_utility = DeclareModelConditionParserUtility()
         self.traces: dict = traces
         self.completed: bool = completed
         self.activities: List[str] = activities
         self.rules: dict = rules
         self.concept_name: str = concept_name
+        self.condition_cache: Optional[EventConditionCache] = condition_cache
+        self.trace_idx: Optional[int] = trace_idx
 
     def get_template(self, template: DeclareModelTemplate):
         """
@@ -122,14 +216,23 @@ class TemplateConstraintChecker(ABC):
         except AttributeError:
             print(f"The checker function for template {template.templ_str} has not been implemented yet.")
 
+    def _activation_holds(self, activation_rules: str, index: int, locl: dict) -> bool:
+        """
+        Evaluates the activation condition on the event at the given index of the trace, reading the result from the
+        condition cache when available.
+        """
+        if self.condition_cache is None or self.trace_idx is None:
+            return eval(activation_rules, glob, locl)
+        return self.condition_cache.holds(activation_rules, self.trace_idx, index, locl)
+
     def mpChoice(self) -> CheckerResult:
         activation_rules = self.declare_parser_utility.parse_data_cond(self.rules["activation"])
         time_rule = self.declare_parser_utility.parse_time_cond(self.rules["time"])
         a_or_b_occurs = False
-        for A in self.traces:
+        for index, A in enumerate(self.traces):
             if A[self.concept_name] == self.activities[0] or A[self.concept_name] == self.activities[1]:
                 locl = {'A': A, 'T': self.traces[0], 'timedelta': timedelta, 'abs': abs, 'float': float}
-                if eval(activation_rules, glob, locl) and eval(time_rule, glob, locl):
+                if self._activation_holds(activation_rules, index, locl) and eval(time_rule, glob, locl):
                     a_or_b_occurs = True
                     break
         state = None
@@ -148,13 +251,13 @@ class TemplateConstraintChecker(ABC):
         time_rule = self.declare_parser_utility.parse_time_cond(self.rules["time"])
         a_occurs = False
         b_occurs = False
-        for A in self.traces:
+        for index, A in enumerate(self.traces):
             locl = {'A': A, 'T': self.traces[0], 'timedelta': timedelta, 'abs': abs, 'float': float}
             if not a_occurs and A[self.concept_name] == self.activities[0]:
-                if eval(activation_rules, glob, locl) and eval(time_rule, glob, locl):
+                if self._activation_holds(activation_rules, index, locl) and eval(time_rule, glob, locl):
                     a_occurs = True
             if not b_occurs and A[self.concept_name] == self.activities[1]:
-                if eval(activation_rules, glob, locl) and eval(time_rule, glob, locl):
+                if self._activation_holds(activation_rules, index, locl) and eval(time_rule, glob, locl):
                     b_occurs = True
             if a_occurs and b_occurs:
                 break
@@ -180,10 +283,10 @@ class TemplateConstraintChecker(ABC):
         activation_rules = self.declare_parser_utility.parse_data_cond(self.rules["activation"])
         time_rule = self.declare_parser_utility.parse_time_cond(self.rules["time"])
         num_activations = 0
-        for A in self.traces:
+        for index, A in enumerate(self.traces):
             if A[self.concept_name] == self.activities[0]:
                 locl = {'A': A, 'T': self.traces[0], 'timedelta': timedelta, 'abs': abs, 'float': float}
-                if eval(activation_rules, glob, locl) and eval(time_rule, glob, locl):
+                if self._activation_holds(activation_rules, index, locl) and eval(time_rule, glob, locl):
                     num_activations += 1
         n = self.rules["n"]
         state = None
@@ -206,10 +309,10 @@ class TemplateConstraintChecker(ABC):
         time_rule = self.declare_parser_utility.parse_time_cond(self.rules["time"])
 
         num_activations = 0
-        for A in self.traces:
+        for index, A in enumerate(self.traces):
             if A[self.concept_name] == self.activities[0]:
                 locl = {'A': A, 'T': self.traces[0], 'timedelta': timedelta, 'abs': abs, 'float': float}
-                if eval(activation_rules, glob, locl) and eval(time_rule, glob, locl):
+                if self._activation_holds(activation_rules, index, locl) and eval(time_rule, glob, locl):
                     num_activations += 1
 
         n = self.rules["n"]
@@ -235,7 +338,7 @@ class TemplateConstraintChecker(ABC):
         state = TraceState.VIOLATED
         if self.traces[0][self.concept_name] == self.activities[0]:
             locl = {'A': self.traces[0]}
-            if eval(activation_rules, glob, locl):
+            if self._activation_holds(activation_rules, 0, locl):
                 state = TraceState.SATISFIED
 
         return CheckerResult(num_fulfillments=None, num_violations=None, num_pendings=None, num_activations=None,
@@ -252,7 +355,7 @@ class TemplateConstraintChecker(ABC):
         state = TraceState.VIOLATED
         if self.traces[-1][self.concept_name] == self.activities[0]:
             locl = {'A': self.traces[-1]}
-            if eval(activation_rules, glob, locl):
+            if self._activation_holds(activation_rules, len(self.traces) - 1, locl):
                 state = TraceState.SATISFIED
 
         return CheckerResult(num_fulfillments=None, num_violations=None, num_pendings=None, num_activations=None,
@@ -265,10 +368,10 @@ class TemplateConstraintChecker(ABC):
         activation_rules = self.declare_parser_utility.parse_data_cond(self.rules["activation"])
         time_rule = self.declare_parser_utility.parse_time_cond(self.rules["time"])
         num_activations = 0
-        for A in self.traces:
+        for index, A in enumerate(self.traces):
             if A[self.concept_name] == self.activities[0]:
                 locl = {'A': A, 'T': self.traces[0], 'timedelta': timedelta, 'abs': abs, 'float': float}
-                if eval(activation_rules, glob, locl) and eval(time_rule, glob, locl):
+                if self._activation_holds(activation_rules, index, locl) and eval(time_rule, glob, locl):
                     num_activations += 1
         n = self.rules["n"]
         state = None
@@ -300,10 +403,10 @@ class TemplateConstraintChecker(ABC):
         num_violations = 0
         num_pendings = 0
 
-        for event in self.traces:
+        for index, event in enumerate(self.traces):
             if event[self.concept_name] == self.activities[0]:
                 locl = {'A': event}
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     pendings.append(event)
 
         for event in self.traces:
@@ -353,10 +456,10 @@ class TemplateConstraintChecker(ABC):
         num_violations = 0
         num_pendings = 0
 
-        for event in self.traces:
+        for index, event in enumerate(self.traces):
             if event[self.concept_name] == self.activities[0]:
                 locl = {'A': event}
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     pendings.append(event)
 
             if pendings and event[self.concept_name] == self.activities[1]:
@@ -408,10 +511,10 @@ class TemplateConstraintChecker(ABC):
         num_fulfillments = 0
         num_pendings = 0
 
-        for event in self.traces:
+        for index, event in enumerate(self.traces):
             if event[self.concept_name] == self.activities[0]:
                 locl = {'A': event}
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     pending = event
                     num_activations += 1
 
@@ -465,7 +568,7 @@ class TemplateConstraintChecker(ABC):
             if event[self.concept_name] == self.activities[0]:
                 locl = {'A': event}
 
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     num_activations += 1
 
                     if index < len(self.traces) - 1:
@@ -514,14 +617,14 @@ class TemplateConstraintChecker(ABC):
         num_fulfillments = 0
         Ts = []
 
-        for event in self.traces:
+        for index, event in enumerate(self.traces):
             if event[self.concept_name] == self.activities[0]:
                 Ts.append(event)
 
             if event[self.concept_name] == self.activities[1]:
                 locl = {'A': event}
 
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     num_activations += 1
 
                     for T in Ts:
@@ -564,13 +667,13 @@ class TemplateConstraintChecker(ABC):
         num_fulfillments = 0
         Ts = []
 
-        for event in self.traces:
+        for index, event in enumerate(self.traces):
             if event[self.concept_name] == self.activities[0]:
                 Ts.append(event)
 
             if event[self.concept_name] == self.activities[1]:
                 locl = {'A': event}
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     num_activations += 1
                     for T in Ts:
                         locl = {'A': event, 'T': T, 'timedelta': timedelta, 'abs': abs, 'float': float}
@@ -613,7 +716,7 @@ class TemplateConstraintChecker(ABC):
             if event[self.concept_name] == self.activities[1]:
                 locl = {'A': event}
 
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     num_activations += 1
 
                     if index != 0 and self.traces[index - 1][self.concept_name] == self.activities[0]:
@@ -651,10 +754,10 @@ class TemplateConstraintChecker(ABC):
         num_violations = 0
         num_pendings = 0
 
-        for event in self.traces:
+        for index, event in enumerate(self.traces):
             if event[self.concept_name] == self.activities[0]:
                 locl = {'A': event}
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     pendings.append(event)
 
         for event in self.traces:
@@ -702,10 +805,10 @@ class TemplateConstraintChecker(ABC):
         num_violations = 0
         num_pendings = 0
 
-        for event in self.traces:
+        for index, event in enumerate(self.traces):
             if event[self.concept_name] == self.activities[0]:
                 locl = {'A': event}
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     pendings.append(event)
 
             if pendings and event[self.concept_name] == self.activities[1]:
@@ -748,14 +851,14 @@ class TemplateConstraintChecker(ABC):
         num_violations = 0
         Ts = []
 
-        for event in self.traces:
+        for index, event in enumerate(self.traces):
             if event[self.concept_name] == self.activities[0]:
                 Ts.append(event)
 
             if event[self.concept_name] == self.activities[1]:
                 locl = {'A': event}
 
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     num_activations += 1
 
                     for T in Ts:
@@ -795,7 +898,7 @@ class TemplateConstraintChecker(ABC):
             if event[self.concept_name] == self.activities[1]:
                 locl = {'A': event}
 
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     num_activations += 1
 
                     if index != 0 and self.traces[index - 1][self.concept_name] == self.activities[0]:
@@ -836,7 +939,7 @@ class TemplateConstraintChecker(ABC):
             if event[self.concept_name] == self.activities[0]:
                 locl = {'A': event}
 
-                if eval(activation_rules, glob, locl):
+                if self._activation_holds(activation_rules, index, locl):
                     num_activations += 1
 
                     if index < len(self.traces) - 1:
@@ -877,3 +980,117 @@ class CheckerResult:
         self.num_pendings = num_pendings
         self.num_activations = num_activations
         self.state = state
+
+
+class SupportEstimate:
+    """
+    Support of a constraint estimated on a sample, drawn without replacement, of the traces of a log. Since the
+    interval is tested again as the sample grows, the error probability is spent across the tests: the k-th test uses
+    (1 - confidence) / (k (k + 1)), so that the intervals of all the tests hold together with the given confidence.
+    """
+    def __init__(self, population_size: int):
+        self.population_size: int = population_size
+        self.sample_size: int = 0
+        self.num_satisfied: int = 0
+        self.num_looks: int = 0
+        self.lower_bound: float = 0.0
+        self.upper_bound: float = 1.0
+
+    @property
+    def support(self) -> float:
+        return self.num_satisfied / self.sample_size if self.sample_size > 0 else 0.0
+
+    def add(self, satisfied: bool) -> None:
+        self.sample_size += 1
+        self.num_satisfied += int(satisfied)
+
+    def is_settled(self, min_support: float, confidence: float) -> bool:
+        """
+        Updates the confidence interval of the support, with the share of the error probability of this test, and
+        returns True if it lies entirely above or below the minimum support.
+        """
+        self.num_looks += 1
+        look_confidence = 1 - (1 - confidence) / (self.num_looks * (self.num_looks + 1))
+        radius = self.confidence_radius(self.sample_size, self.population_size, look_confidence)
+        unseen = self.population_size - self.sample_size
+        self.lower_bound = max(self.support - radius, self.num_satisfied / self.population_size)
+        self.upper_bound = min(self.support + radius, (self.num_satisfied + unseen) / self.population_size)
+        return self.lower_bound >= min_support or self.upper_bound < min_support
+
+    @staticmethod
+    def confidence_radius(sample_size: int, population_size: int, confidence: float) -> float:
+        """
+        Radius of the two-sided Hoeffding interval with the Serfling correction for sampling without replacement.
+        """
+        if sample_size >= population_size:
+            return 0.0
+        if sample_size == 0:
+            return 1.0
+        correction = 1 - (sample_size - 1) / population_size
+        return sqrt(correction * log(2 / (1 - confidence)) / (2 * sample_size))
+
+
+class EventConditionCache:
+    """
+    Caches the evaluations of data conditions on the events of a log, so that a condition shared by many constraints
+    (e.g., the activation condition of a query) is evaluated once per event, whatever the number of constraints. The
+    results of each condition are stored in a mask over all the events of the log, in the order of
+    D4PyEventLog.attribute_log_encoding, which is filled lazily as the events are checked. Conditions that do not
+    depend on the single event (e.g., activation conditions referring to T) are always evaluated.
+    """
+    def __init__(self, event_log: D4PyEventLog):
+        self.event_log: D4PyEventLog = event_log
+        _, self.offsets, _ = event_log.attribute_log_encoding(event_log.activity_key)
+        self._events: Optional[list] = None
+        self._codes: Dict[Tuple[str, str], Optional[CodeType]] = {}
+        self._masks: Dict[Tuple[str, str], np.ndarray] = {}
+
+    def holds(self, rule: str, trace_idx: int, event_idx: int, locl: dict, variable: str = 'A') -> bool:
+        """
+        Evaluates a parsed data condition on the event at position event_idx of the trace trace_idx, bound in locl to
+        the given variable.
+        """
+        if rule == "True":
+            return True
+        code = self._compile(rule, variable)
+        if code is None:
+            return eval(rule, glob, locl)
+        mask = self._masks[(rule, variable)]
+        position = self.offsets[trace_idx] + event_idx
+        if mask[position] < 0:
+            mask[position] = bool(eval(code, glob, {variable: locl[variable]}))
+        return bool(mask[position])
+
+    def evaluate(self, rule: str, positions: np.ndarray, variable: str = 'A') -> np.ndarray:
+        """
+        Evaluates a parsed data condition, bound to the given variable, on the events at the given positions of the
+        log and returns the boolean mask of the results.
+        """
+        if rule == "True":
+            return np.ones(len(positions), dtype=bool)
+        code = self._compile(rule, variable)
+        if code is None:
+            raise RuntimeError(f"The condition {rule} cannot be evaluated on single events.")
+        mask = self._masks[(rule, variable)]
+        unknown = positions[mask[positions] < 0]
+        if len(unknown) > 0:
+            events = self.get_events()
+            mask[unknown] = [bool(eval(code, glob, {variable: events[pos]})) for pos in unknown]
+        return mask[positions] == 1
+
+    def get_events(self) -> list:
+        """
+        Returns the events of the log in the order of the interned encoding.
+        """
+        if self._events is None:
+            self._events = [event for trace in self.event_log.get_log() for event in trace]
+        return self._events
+
+    def _compile(self, rule: str, variable: str) -> Optional[CodeType]:
+        key = (rule, variable)
+        if key not in self._codes:
+            code = compile(rule, "<condition>", "eval")
+            self._codes[key] = code if set(code.co_names) <= {variable} else None
+            if self._codes[key] is not None:
+                self._masks[key] = np.full(self.offsets[-1], -1, dtype=np.int8)
+        return self._codes[key]
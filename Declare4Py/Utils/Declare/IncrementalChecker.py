@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from Declare4Py.ProcessModels.DeclareModel import DeclareModel, DeclareModelConditionParserUtility, \
+    DeclareModelTemplate, DeclareModelTemplateMap
+
+# Groups of templates sharing the same counter updates
+_RESPONSE = DeclareModelTemplateMap.of(DeclareModelTemplate.RESPONSE)
+_NOT_RESPONSE = DeclareModelTemplateMap.of(DeclareModelTemplate.NOT_RESPONSE)
+_ALTERNATE_RESPONSE = DeclareModelTemplateMap.of(DeclareModelTemplate.ALTERNATE_RESPONSE)
+_PRECEDENCE = DeclareModelTemplateMap.of(DeclareModelTemplate.PRECEDENCE, DeclareModelTemplate.NOT_PRECEDENCE)
+_ALTERNATE_PRECEDENCE = DeclareModelTemplateMap.of(DeclareModelTemplate.ALTERNATE_PRECEDENCE)
+_CHAIN = DeclareModelTemplateMap.of(DeclareModelTemplate.CHAIN_RESPONSE, DeclareModelTemplate.NOT_CHAIN_RESPONSE,
+                                    DeclareModelTemplate.CHAIN_PRECEDENCE, DeclareModelTemplate.NOT_CHAIN_PRECEDENCE)
+# templates activated by their second activity
+_ACTIVATED_BY_TARGET = DeclareModelTemplateMap.of(
+    DeclareModelTemplate.PRECEDENCE, DeclareModelTemplate.ALTERNATE_PRECEDENCE, DeclareModelTemplate.CHAIN_PRECEDENCE,
+    DeclareModelTemplate.NOT_PRECEDENCE, DeclareModelTemplate.NOT_CHAIN_PRECEDENCE)
+_SUPPORTED = DeclareModelTemplateMap.of(*DeclareModelTemplate.get_unary_templates(),
+                                        *DeclareModelTemplate.get_binary_not_shortcut_templates())
+
+# rows of the counters of a trace
+_COUNT_A, _COUNT_B, _PENDINGS, _FLAG, _HITS = range(5)
+
+
+class TraceCounters:
+    """
+    The counters of the constraints of an IncrementalConstraintChecker on a (partial) trace.
+    """
+    def __init__(self, n_constraints: int):
+        self.counts: np.ndarray = np.zeros((5, n_constraints), dtype=np.int64)
+        self.first: int = -1
+        self.last: int = -1
+        self.length: int = 0
+
+
+class IncrementalConstraintChecker:
+    """
+    Checks the constraints of a DECLARE model on traces that grow one event at a time, giving the same states and
+    numbers of activations as the TemplateConstraintChecker checkers on the (completed) trace seen so far. Each
+    constraint is reduced to a few counters: the occurrences of its two activities, its pending activations, a flag
+    (the pending activation of Alternate Response, the occurrence of the first activity for the Precedence templates)
+    and its hits (the fulfillments or violations counted when the target occurs). Adding an event only updates the
+    counters of the constraints whose activities are the activity of the event, through per-activity indexes built
+    once.
+
+    Only constraints without conditions of the unary and binary not shortcut templates are supported.
+    """
+
+    def __init__(self, declare_model: DeclareModel):
+        parser = DeclareModelConditionParserUtility()
+        self.declare_model: DeclareModel = declare_model
+        self.n_constraints: int = len(declare_model.constraints)
+        self.activity_idx: Dict[str, int] = {}
+        templates, first, second = [], [], []
+        for constraint in declare_model.constraints:
+            template = constraint['template']
+            if template not in _SUPPORTED:
+                raise RuntimeError(f"The template {template.templ_str} is not supported by the incremental checker.")
+            if any(parser.parse_data_cond(condition) != "True" for condition in constraint['condition']):
+                raise RuntimeError("The incremental checker supports constraints without conditions only.")
+            activities = constraint['activities']
+            templates.append(template)
+            first.append(self.activity_idx.setdefault(activities[0], len(self.activity_idx)))
+            second.append(self.activity_idx.setdefault(activities[-1], len(self.activity_idx)))
+        self.templates: List[DeclareModelTemplate] = templates
+        self._first: np.ndarray = np.array(first, dtype=np.int64)
+        self._second: np.ndarray = np.array(second, dtype=np.int64)
+        self._n: np.ndarray = np.array([constraint.get('n', 1) for constraint in declare_model.constraints],
+                                       dtype=np.int64)
+
+        names = np.array([template.templ_str for template in templates], dtype=object)
+        self._masks: DeclareModelTemplateMap = DeclareModelTemplateMap((template, names == template.templ_str)
+                                                                       for template in DeclareModelTemplate)
+        is_binary = np.array([template.is_binary for template in templates], dtype=bool)
+        in_group = {key: np.isin(names, group.names) if len(names) > 0 else np.zeros(0, dtype=bool)
+                    for key, group in (("response", _RESPONSE), ("not_response", _NOT_RESPONSE),
+                                       ("alternate_response", _ALTERNATE_RESPONSE), ("precedence", _PRECEDENCE),
+                                       ("alternate_precedence", _ALTERNATE_PRECEDENCE), ("chain", _CHAIN))}
+        self._has_activations: np.ndarray = is_binary & ~self._masks[DeclareModelTemplate.CHOICE] & \
+            ~self._masks[DeclareModelTemplate.EXCLUSIVE_CHOICE]
+        self._activated_by_target: np.ndarray = np.isin(names, _ACTIVATED_BY_TARGET.names) if len(names) > 0 \
+            else np.zeros(0, dtype=bool)
+
+        # per-activity indexes of the constraints to update
+        self._updates: List[Dict[str, np.ndarray]] = []
+        for code in range(len(self.activity_idx)):
+            is_first, is_second = self._first == code, (self._second == code) & is_binary
+            self._updates.append({
+                "first": np.flatnonzero(is_first),
+                "second": np.flatnonzero(is_second),
+                "pend": np.flatnonzero(is_first & (in_group["response"] | in_group["not_response"])),
+                "flag": np.flatnonzero(is_first & (in_group["alternate_response"] | in_group["precedence"] |
+                                                   in_group["alternate_precedence"])),
+                "resolve": np.flatnonzero(is_second & in_group["response"]),
+                "violate": np.flatnonzero(is_second & in_group["not_response"]),
+                "check_flag": np.flatnonzero(is_second & (in_group["alternate_response"] |
+                                                          in_group["precedence"] |
+                                                          in_group["alternate_precedence"])),
+                "reset_flag": np.flatnonzero(is_second & (in_group["alternate_response"] |
+                                                          in_group["alternate_precedence"])),
+            })
+        self._chains: Dict[Tuple[int, int], np.ndarray] = {}
+        for constraint_idx in np.flatnonzero(in_group["chain"]):
+            key = (int(self._first[constraint_idx]), int(self._second[constraint_idx]))
+            self._chains[key] = np.append(self._chains.get(key, np.empty(0, dtype=np.int64)), constraint_idx)
+
+    def start_trace(self) -> TraceCounters:
+        """
+        Returns the counters of an empty trace.
+        """
+        return TraceCounters(self.n_constraints)
+
+    def add_event(self, counters: TraceCounters, activity: str) -> None:
+        """
+        Updates the counters of a trace with its next event, touching only the constraints on its activity.
+
+        Args:
+            counters: the counters of the trace, see start_trace
+            activity: the activity of the event
+        """
+        code = self.activity_idx.get(activity, -1)
+        previous = counters.last
+        if counters.length == 0:
+            counters.first = code
+        counters.last = code
+        counters.length += 1
+        if code < 0:
+            return
+        counts = counters.counts
+        updates = self._updates[code]
+        # the event as the first activity of the constraints
+        counts[_COUNT_A, updates["first"]] += 1
+        counts[_PENDINGS, updates["pend"]] += 1
+        counts[_FLAG, updates["flag"]] = 1
+        # the event as the second activity of the constraints
+        counts[_COUNT_B, updates["second"]] += 1
+        counts[_PENDINGS, updates["resolve"]] = 0
+        violate = updates["violate"]
+        counts[_HITS, violate] += counts[_PENDINGS, violate]
+        counts[_PENDINGS, violate] = 0
+        check_flag = updates["check_flag"]
+        counts[_HITS, check_flag] += counts[_FLAG, check_flag]
+        counts[_FLAG, updates["reset_flag"]] = 0
+        chains = self._chains.get((previous, code))
+        if chains is not None:
+            counts[_HITS, chains] += 1
+
+    def num_activations(self, counters: TraceCounters) -> np.ndarray:
+        """
+        Returns the number of activations of each constraint on the trace, NaN for the templates without activations.
+        """
+        activations = np.where(self._activated_by_target, counters.counts[_COUNT_B], counters.counts[_COUNT_A])
+        return np.where(self._has_activations, activations, np.nan)
+
+    def states(self, counters: TraceCounters) -> np.ndarray:
+        """
+        Returns whether each constraint is satisfied by the trace seen so far, considered as completed and without
+        vacuous satisfaction.
+        """
+        count_a, count_b, pendings, flag, hits = counters.counts
+        activations = np.where(self._activated_by_target, count_b, count_a)
+        masks = self._masks
+        states = np.zeros(self.n_constraints, dtype=bool)
+
+        def set_states(template: DeclareModelTemplate, values: np.ndarray):
+            mask = masks[template]
+            states[mask] = values[mask]
+
+        set_states(DeclareModelTemplate.EXISTENCE, count_a >= self._n)
+        set_states(DeclareModelTemplate.ABSENCE, count_a < self._n)
+        set_states(DeclareModelTemplate.EXACTLY, count_a == self._n)
+        set_states(DeclareModelTemplate.INIT, self._first == counters.first)
+        set_states(DeclareModelTemplate.END, self._first == counters.last)
+        set_states(DeclareModelTemplate.CHOICE, (count_a > 0) | (count_b > 0))
+        set_states(DeclareModelTemplate.EXCLUSIVE_CHOICE, (count_a > 0) ^ (count_b > 0))
+        set_states(DeclareModelTemplate.RESPONDED_EXISTENCE, (count_a > 0) & (count_b > 0))
+        set_states(DeclareModelTemplate.NOT_RESPONDED_EXISTENCE, (count_a > 0) & (count_b == 0))
+        set_states(DeclareModelTemplate.RESPONSE, (activations > 0) & (pendings == 0))
+        for template in (DeclareModelTemplate.ALTERNATE_RESPONSE, DeclareModelTemplate.CHAIN_RESPONSE,
+                         DeclareModelTemplate.PRECEDENCE, DeclareModelTemplate.ALTERNATE_PRECEDENCE,
+                         DeclareModelTemplate.CHAIN_PRECEDENCE):
+            # the hits are the fulfillments
+            set_states(template, (activations > 0) & (hits == activations))
+        for template in (DeclareModelTemplate.NOT_RESPONSE, DeclareModelTemplate.NOT_CHAIN_RESPONSE,
+                         DeclareModelTemplate.NOT_PRECEDENCE, DeclareModelTemplate.NOT_CHAIN_PRECEDENCE):
+            # the hits are the violations
+            set_states(template, (activations > 0) & (hits == 0))
+        return states.astype(np.int64)
+
+    def check_trace(self, activities: List[str], checkpoints: Optional[List[int]] = None) -> Tuple[np.ndarray,
+                                                                                                  np.ndarray]:
+        """
+        Checks the constraints on a trace, one event at a time.
+
+        Args:
+            activities: the activities of the events of the trace
+            checkpoints: the lengths of the prefixes to check / Default: the whole trace
+
+        Returns:
+            the states and the numbers of activations of the constraints for each checkpoint, as rows.
+        """
+        if checkpoints is None:
+            checkpoints = [len(activities)]
+        states, activations = [], []
+        counters = self.start_trace()
+        checkpoint_idx = 0
+        for prefix_length in range(len(activities) + 1):
+            while checkpoint_idx < len(checkpoints) and checkpoints[checkpoint_idx] == prefix_length:
+                states.append(self.states(counters))
+                activations.append(self.num_activations(counters))
+                checkpoint_idx += 1
+            if prefix_length < len(activities):
+                self.add_event(counters, activities[prefix_length])
+        return np.array(states).reshape(-1, self.n_constraints), \
+            np.array(activations, dtype=float).reshape(-1, self.n_constraints)
@@ -0,0 +1,607 @@
+from __future__ import annotations
+
+import weakref
+from copy import copy
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Index, MultiIndex
+from scipy import sparse
+from scipy.signal import lfilter
+
+# intermediates shared by the encoders (groupings, durations), by DataFrame object, see _shared
+_SHARED = {}
+
+
+def _shared(X: DataFrame, key: Tuple, build):
+    """
+    Returns the intermediate of X with the given key, built once and shared by all the calls on the same DataFrame
+    object. It is cached as long as X is alive and has the same number of rows, so the columns it is computed from
+    must not be changed in place.
+    """
+    key = (id(X),) + key
+    cached = _SHARED.get(key)
+    if cached is not None and cached[0]() is X and cached[1] == len(X):
+        return cached[2]
+    value = build()
+    _SHARED[key] = (weakref.ref(X, lambda _, key=key: _SHARED.pop(key, None)), len(X), value)
+    return value
+
+
+class CaseGrouping:
+    """
+    Groups the events of a log DataFrame by case once, so that the encoders can lay out the events as arrays instead
+    of grouping and merging the DataFrame many times. The cases are sorted as by DataFrame.groupby (or in order of
+    appearance if not sort), and every event (i.e., every row with a case identifier) gets the code of its case and
+    its position in the case, in the order of the rows. Any per-event column can then be pivoted to a (case, position)
+    array in a single assignment.
+
+    The prefixes of the cases can be grouped the same way (see prefixes), so that every encoding computed on the cases
+    can be computed on all their prefixes at once.
+    """
+
+    @classmethod
+    def of(cls, X: DataFrame, case_id_col: str, sort: bool = True) -> CaseGrouping:
+        """
+        Returns the grouping of X, shared by all the calls on the same DataFrame object, e.g., by the encoders of a
+        FeatureUnion transforming the same log, so that the cases are grouped once. The grouping is cached as long
+        as X is alive and has the same number of rows, so the case identifiers of X must not be changed in place.
+        """
+        return _shared(X, ("grouping", case_id_col, sort), lambda: cls(X, case_id_col, sort))
+
+    def __init__(self, X: DataFrame, case_id_col: str, sort: bool = True):
+        case_codes, cases = pd.factorize(X[case_id_col], sort=sort)
+        # rows of X with a case identifier, groupby drops the other ones
+        rows = np.flatnonzero(case_codes >= 0)
+        self._group(rows, case_codes[rows], Index(cases, name=case_id_col))
+
+    def _group(self, rows: np.ndarray, case_codes: np.ndarray, cases: Index):
+        self.cases: Index = cases
+        self.n_cases: int = len(cases)
+        self.rows: np.ndarray = rows
+        self.case_codes: np.ndarray = case_codes
+        self.lengths: np.ndarray = np.bincount(self.case_codes, minlength=self.n_cases)
+        self.offsets: np.ndarray = np.concatenate(([0], np.cumsum(self.lengths)))
+        # events sorted by case, keeping the order of the rows within each case
+        self.order: np.ndarray = np.argsort(self.case_codes, kind="stable")
+        self.positions: np.ndarray = np.empty(len(self.rows), dtype=np.int64)
+        self.positions[self.order] = np.arange(len(self.rows)) - self.offsets[self.case_codes[self.order]]
+
+    def prefix_cases(self, max_prefix_length: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the case code and the length of the prefixes of lengths 1..max_prefix_length of every case, sorted by
+        case and length. The prefixes of a case are as long as the case at most.
+        """
+        counts = self.lengths if max_prefix_length is None else np.minimum(self.lengths, max_prefix_length)
+        prefix_cases = np.repeat(np.arange(self.n_cases), counts)
+        prefix_lengths = np.arange(len(prefix_cases)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        return prefix_cases, prefix_lengths
+
+    def prefix_index(self, max_prefix_length: Optional[int] = None) -> MultiIndex:
+        """
+        Returns the (case, prefix_len) index of the prefixes of lengths 1..max_prefix_length of every case.
+        """
+        prefix_cases, prefix_lengths = self.prefix_cases(max_prefix_length)
+        return MultiIndex.from_arrays([self.cases[prefix_cases], prefix_lengths], names=[self.cases.name, 'prefix_len'])
+
+    def prefixes(self, max_prefix_length: Optional[int] = None) -> CaseGrouping:
+        """
+        Groups the prefixes of lengths 1..max_prefix_length of every case as if they were the cases of the log: the
+        cases of the returned grouping are the (case, prefix_len) pairs, and its events are the events of each prefix.
+        """
+        prefix_cases, prefix_lengths = self.prefix_cases(max_prefix_length)
+        prefix_codes = np.repeat(np.arange(len(prefix_cases)), prefix_lengths)
+        positions = np.arange(len(prefix_codes)) - np.repeat(np.cumsum(prefix_lengths) - prefix_lengths, prefix_lengths)
+        events = self.order[self.offsets[prefix_cases[prefix_codes]] + positions]
+        grouping = copy(self)
+        grouping._group(self.rows[events], prefix_codes, self.prefix_index(max_prefix_length))
+        return grouping
+
+    def nth_events(self, case_codes: np.ndarray, nths: np.ndarray) -> np.ndarray:
+        """
+        Returns the index of the nth event of each case, -1 if the case has no such event.
+        """
+        exists = (nths >= 0) & (nths < self.lengths[case_codes])
+        events = np.full(len(case_codes), -1, dtype=np.int64)
+        events[exists] = self.order[self.offsets[case_codes[exists]] + nths[exists]]
+        return events
+
+    def last_events(self, valid: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Returns the index of the last event of each case, or of the last one among the valid events (a mask over the
+        events with a case identifier), -1 if the case has no such event. The last events are found on the sorted
+        case boundaries: the last valid event of a case is the one before the first valid event of the next case.
+        """
+        if valid is None:
+            return self.nth_events(np.arange(self.n_cases), self.lengths - 1)
+        valid_positions = np.flatnonzero(valid[self.order])
+        last = np.searchsorted(valid_positions, self.offsets[1:]) - 1
+        exists = last >= 0
+        exists[exists] = valid_positions[last[exists]] >= self.offsets[:-1][exists]
+        events = np.full(self.n_cases, -1, dtype=np.int64)
+        events[exists] = self.order[valid_positions[last[exists]]]
+        return events
+
+    def take(self, X: DataFrame, col: str, events: np.ndarray) -> pd.Series:
+        """
+        Returns the values of a column of X at the given events (one per case, -1 for none) as a Series indexed by
+        the cases, keeping the dtype of the column where every case has an event.
+        """
+        exists = events >= 0
+        values = X[col].iloc[self.rows[events[exists]]]
+        if exists.all():
+            return values.set_axis(self.cases)
+        return values.set_axis(self.cases[exists]).reindex(self.cases)
+
+    def cumulative(self, values: np.ndarray, func: str) -> np.ndarray:
+        """
+        Aggregates the per-event values over the events of the case up to each event, skipping NA values as the pandas
+        aggregations do, e.g., the cumulative 'mean' of an event is the mean of the values of its case up to it.
+
+        Parameters
+        -------------------
+        values
+            the values of the events with a case identifier, see column
+        func
+            the aggregation function, among 'sum', 'count', 'mean', 'max', 'min' and 'last' (the last non-NA value)
+
+        Returns
+        ------------------
+        :rtype: ndarray
+            the cumulative values of the events
+        """
+        grouped = pd.Series(values).groupby(self.case_codes)
+        if func == 'last':
+            return grouped.ffill().to_numpy()
+        values = pd.Series(values, dtype=float)
+        counts = values.notna().groupby(self.case_codes).cumsum().to_numpy()
+        if func == 'count':
+            return counts
+        if func in ('sum', 'mean'):
+            sums = values.fillna(0).groupby(self.case_codes).cumsum().to_numpy()
+            return sums if func == 'sum' else np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+        if func == 'max':
+            extremes = values.fillna(-np.inf).groupby(self.case_codes).cummax().to_numpy()
+        elif func == 'min':
+            extremes = values.fillna(np.inf).groupby(self.case_codes).cummin().to_numpy()
+        else:
+            raise RuntimeError(f"The aggregation function {func} cannot be computed cumulatively.")
+        return np.where(counts > 0, extremes, np.nan)
+
+    def column(self, X: DataFrame, col: str) -> np.ndarray:
+        """
+        Returns the values of a column of X for the events with a case identifier.
+        """
+        return X[col].to_numpy()[self.rows]
+
+    def pivot(self, values: np.ndarray, max_events: int) -> np.ndarray:
+        """
+        Lays out the per-event values as a (case, position) array of max_events columns. Positions without an event
+        are NaN, as when merging the n-th events of the cases.
+
+        Parameters
+        -------------------
+        values
+            the values of the events with a case identifier, see column
+        max_events
+            the number of positions
+
+        Returns
+        ------------------
+        :rtype: ndarray
+            a float array for numerical values, an object array otherwise
+        """
+        dtype = float if np.issubdtype(values.dtype, np.number) else object
+        array = np.full((self.n_cases, max_events), np.nan, dtype=dtype)
+        keep = self.positions < max_events
+        array[self.case_codes[keep], self.positions[keep]] = values[keep]
+        return array
+
+    def one_hot_vocabulary(self, values: np.ndarray, max_events: int) -> Tuple[Index, np.ndarray]:
+        """
+        Learns the vocabulary of the one-hot encoding of the per-event values by position (see one_hot): the sorted
+        values and the keys position * len(values) + value code of the (position, value) pairs occurring in the log,
+        sorted.
+        """
+        value_codes, uniques = pd.factorize(values, sort=True)
+        keep = (self.positions < max_events) & (value_codes >= 0)
+        return Index(uniques), np.unique(self.positions[keep] * len(uniques) + value_codes[keep])
+
+    def one_hot(self, values: np.ndarray, max_events: int, prefix: str,
+                vocabulary: Optional[Tuple[Index, np.ndarray]] = None) -> Tuple[sparse.csr_matrix, List[str]]:
+        """
+        One-hot encodes the per-event values by position, as pd.get_dummies does on the pivoted columns: there is a
+        column '{prefix}_{position}_{value}' for each value occurring at each position, the positions in ascending
+        order and the values sorted within each position.
+
+        Parameters
+        -------------------
+        values
+            the values of the events with a case identifier, see column
+        max_events
+            the number of positions
+        prefix
+            the prefix of the column names
+        vocabulary
+            the vocabulary learned on the fitting log, see one_hot_vocabulary: the columns are the fitted ones and the
+            (position, value) pairs out of it are dropped / Default: the vocabulary of the values
+
+        Returns
+        ------------------
+        :rtype: Tuple[csr_matrix, List[str]]
+            the (case, column) indicator matrix and the column names
+        """
+        if vocabulary is None:
+            vocabulary = self.one_hot_vocabulary(values, max_events)
+        uniques, column_keys = vocabulary
+        value_codes = uniques.get_indexer(values)
+        keep = (self.positions < max_events) & (value_codes >= 0)
+        keys = self.positions[keep] * len(uniques) + value_codes[keep]
+        cols = np.minimum(np.searchsorted(column_keys, keys), max(len(column_keys) - 1, 0))
+        fitted = column_keys[cols] == keys if len(column_keys) > 0 else np.zeros(len(keys), dtype=bool)
+        matrix = sparse.csr_matrix((np.ones(np.count_nonzero(fitted), dtype=np.uint8),
+                                    (self.case_codes[keep][fitted], cols[fitted])),
+                                   shape=(self.n_cases, len(column_keys)))
+        return matrix, self._one_hot_names(prefix, vocabulary)
+
+    @staticmethod
+    def _one_hot_names(prefix: str, vocabulary: Tuple[Index, np.ndarray]) -> List[str]:
+        uniques, column_keys = vocabulary
+        return [f"{prefix}_{key // len(uniques)}_{uniques[key % len(uniques)]}" for key in column_keys]
+
+    def index_vocabularies(self, X: DataFrame, cat_cols: List[str], max_events: int) -> Dict[str, Tuple[Index,
+                                                                                                     np.ndarray]]:
+        """
+        Learns the vocabularies of the one-hot encoded categorical attributes of index_encoding.
+        """
+        return {col: self.one_hot_vocabulary(self.column(X, col), max_events) for col in cat_cols}
+
+    def index_columns(self, columns: List[str], cat_cols: List[str], max_events: int, create_dummies: bool = True,
+                      vocabularies: Optional[Dict[str, Tuple[Index, np.ndarray]]] = None) -> List[str]:
+        """
+        Returns the column names of index_encoding with the given vocabularies of the categorical attributes, see
+        index_vocabularies.
+        """
+        if not create_dummies:
+            return [self.cases.names[0]] + [f"{col}_{i}" for i in range(max_events) for col in columns]
+        num_cols = [col for col in columns if col not in cat_cols]
+        return [f"{col}_{i}" for i in range(max_events) for col in num_cols] + \
+            [name for col in columns if col in cat_cols for name in self._one_hot_names(col, vocabularies[col])]
+
+    def index_encoding(self, X: DataFrame, columns: List[str], cat_cols: List[str], max_events: int,
+                       create_dummies: bool = True, as_sparse: bool = False,
+                       vocabularies: Optional[Dict[str, Tuple[Index, np.ndarray]]] = None):
+        """
+        Index-based encoding of the events: the attributes of the i-th event of each case are the columns
+        '{col}_{i}', laid out as merging the n-th events of the cases one after the other and, if create_dummies,
+        one-hot encoding the categorical ones with pd.get_dummies. Missing values are kept as NaN.
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be transformed
+        columns
+            the attributes of each event, in the order of the output columns
+        cat_cols
+            the categorical attributes among columns
+        max_events
+            maximum prefix length to be transformed
+        create_dummies
+            TRUE: transform categorical attributes as dummy attributes
+        as_sparse
+            TRUE: return the (case, column) sparse matrix and the column names instead of a DataFrame, it requires
+            create_dummies
+        vocabularies
+            the vocabularies of the categorical attributes learned on the fitting log, see index_vocabularies
+
+        Returns
+        ------------------
+        :rtype: Union[DataFrame, Tuple[csr_matrix, List[str]]]
+            the encoded cases, indexed by the case identifier
+        """
+        if as_sparse and not create_dummies:
+            raise RuntimeError("The sparse encoding requires the categorical attributes to be transformed as dummies.")
+
+        if not create_dummies:
+            pivots = [self.pivot(self.column(X, col), max_events) for col in columns]
+            data = {self.cases.names[0]: self.cases.get_level_values(0).to_numpy()}
+            for i in range(max_events):
+                for col, array in zip(columns, pivots):
+                    data[f"{col}_{i}"] = array[:, i]
+            return DataFrame(data, index=self.cases)
+
+        num_cols = [col for col in columns if col not in cat_cols]
+        num_names = [f"{col}_{i}" for i in range(max_events) for col in num_cols]
+        if len(num_cols) > 0:
+            num_block = np.stack([self.pivot(self.column(X, col), max_events) for col in num_cols], axis=2)
+            num_block = num_block.reshape(self.n_cases, len(num_names))
+        else:
+            num_block = np.empty((self.n_cases, 0))
+        vocabularies = {} if vocabularies is None else vocabularies
+        dummies = [self.one_hot(self.column(X, col), max_events, col, vocabularies.get(col))
+                   for col in columns if col in cat_cols]
+        dummy_names = [name for _, names in dummies for name in names]
+        dummy_block = sparse.hstack([matrix for matrix, _ in dummies], format="csr") if len(dummies) > 0 \
+            else sparse.csr_matrix((self.n_cases, 0), dtype=np.uint8)
+        if as_sparse:
+            return sparse.hstack([sparse.csr_matrix(num_block), dummy_block], format="csr"), num_names + dummy_names
+        return pd.concat([DataFrame(num_block, index=self.cases, columns=num_names),
+                          DataFrame(dummy_block.toarray(), index=self.cases, columns=dummy_names)], axis=1)
+
+    def ngram_vocabulary(self, X: DataFrame, act_col: str, n: int) -> Tuple[Index, np.ndarray]:
+        """
+        Learns the vocabulary of the n-gram encoding: the sorted activities and the sequences of n consecutive
+        activities in the log, as rows of activity codes sorted by activities.
+        """
+        codes, activities = pd.factorize(self.column(X, act_col), sort=True)
+        codes = codes[self.order]
+        case_codes = self.case_codes[self.order]
+        gram_starts = np.flatnonzero(np.arange(len(codes)) - self.offsets[case_codes] + n <= self.lengths[case_codes])
+        grams = np.stack([codes[gram_starts + k] for k in range(n)], axis=1)
+        return Index(activities), np.unique(grams[(grams >= 0).all(axis=1)], axis=0).reshape(-1, n)
+
+    def ngram_encoding(self, X: DataFrame, act_col: str, n: int, v: float, as_sparse: bool = False,
+                       vocabulary: Optional[Tuple[Index, np.ndarray]] = None):
+        """
+        Decayed n-gram encoding of the activities of the cases. The n-grams are the sequences of n consecutive
+        activities in the log, and the score of the n-gram (a_1, ..., a_n) in a case is the sum of
+        v ** (i_n - i_1 - (n - 2)) over the positions i_1 <= ... <= i_n of the case where a_1, ..., a_n occur. For every
+        distinct sequence of activities, the sums over the chains of positions are computed for all the n-grams whose
+        activities occur in it at once, with a decayed cumulative sum of the chains ending at each position, i.e.,
+        c[i] = v * c[i - 1] + x[i], as a linear filter along the positions.
+
+        Parameters
+        -------------------
+        X: DataFrame
+            Event log / Pandas DataFrame to be transformed
+        act_col
+            a column indicating the activities in an event log
+        n
+            the size of sub-sequence in n-gram
+        v
+            a decay factor parameter in n-gram, ranged in [0,1]
+        as_sparse
+            TRUE: return a sparse matrix / FALSE: return a dense array
+        vocabulary
+            the vocabulary learned on the fitting log, see ngram_vocabulary: only its n-grams are scored, and the
+            activities out of it match none of them / Default: the vocabulary of X
+
+        Returns
+        ------------------
+        :rtype: Tuple[Union[ndarray, csr_matrix], List[str]]
+            the (case, n-gram) scores and the n-grams, as the activities joined by '|'
+        """
+        if vocabulary is None:
+            vocabulary = self.ngram_vocabulary(X, act_col, n)
+        activities, vocabulary = vocabulary
+        codes = activities.get_indexer(self.column(X, act_col))[self.order]
+        names = ['|'.join(str(activities[code]) for code in gram) for gram in vocabulary]
+
+        # cases with the same sequence of activities have the same scores
+        variants = {}
+        for case, trace in enumerate(np.split(codes, self.offsets[1:-1])):
+            variants.setdefault(trace.tobytes(), (trace, []))[1].append(case)
+
+        rows, cols, scores = [], [], []
+        present = np.zeros(len(activities) + 1, dtype=bool)
+        for trace, cases in variants.values():
+            present[:] = False
+            present[trace] = True
+            candidates = np.flatnonzero(present[vocabulary].all(axis=1))
+            if len(candidates) == 0:
+                continue
+            chains = (trace[:, None] == vocabulary[candidates, 0]).astype(float)
+            for k in range(1, n):
+                chains = lfilter([1.0], [1.0, -v], chains, axis=0) * (trace[:, None] == vocabulary[candidates, k])
+            variant_scores = chains.sum(axis=0) * np.power(v, 2.0 - n)
+            rows.append(np.repeat(cases, len(candidates)))
+            cols.append(np.tile(candidates, len(cases)))
+            scores.append(np.tile(variant_scores, len(cases)))
+
+        rows = np.concatenate(rows) if len(rows) > 0 else np.empty(0, dtype=np.int64)
+        cols = np.concatenate(cols) if len(cols) > 0 else np.empty(0, dtype=np.int64)
+        scores = np.concatenate(scores) if len(scores) > 0 else np.empty(0)
+        if as_sparse:
+            return sparse.csr_matrix((scores, (rows, cols)), shape=(self.n_cases, len(names))), names
+        matrix = np.zeros((self.n_cases, len(names)))
+        matrix[rows, cols] = scores
+        return matrix, names
+
+
+def add_durations(X: DataFrame, case_id_col: str, time_col: str) -> DataFrame:
+    """
+    Sorts the events of X by case and timestamp and adds their time features, in seconds: the 'duration' until the
+    next event of the case (0 for the last one), the 'elapsed_time' since the start of the case and the
+    'remaining_time' until its end (NaN for the events without timestamp). The features are differences of the int64
+    nanosecond timestamps, masked on the case boundaries of the sorted events. The result is shared by all the calls
+    on the same DataFrame object, e.g., by the complex index encoders fitting and transforming the same log, so that
+    the log is sorted once.
+    """
+    def build() -> DataFrame:
+        # transform timestamp col
+        X[time_col] = pd.to_datetime(X[time_col])
+        case_codes, cases = pd.factorize(X[case_id_col], sort=True)
+        times = pd.DatetimeIndex(X[time_col]).asi8
+        valid_times = times != np.iinfo(np.int64).min
+        # sorted as by sort_values([case_id_col, time_col]), missing cases and timestamps last, unless the events are
+        # already sorted
+        sort_times = np.where(valid_times, times, np.iinfo(np.int64).max)
+        sort_cases = np.where(case_codes >= 0, case_codes, len(cases))
+        if np.all((sort_cases[1:] > sort_cases[:-1]) |
+                  ((sort_cases[1:] == sort_cases[:-1]) & (sort_times[1:] >= sort_times[:-1]))):
+            order = np.arange(len(X))
+        else:
+            order = np.lexsort((sort_times, sort_cases))
+        sorted_X = X.take(order)
+        case_codes, times = case_codes[order], times[order]
+        valid = valid_times[order] & (case_codes >= 0)
+
+        durations, elapsed, remaining = np.zeros(len(times)), np.full(len(times), np.nan), np.full(len(times), np.nan)
+        if len(times) > 0:
+            same_case = case_codes[1:] == case_codes[:-1]
+            has_next = np.append(same_case & valid[1:] & valid[:-1], False)
+            durations[has_next] = (times[1:] - times[:-1])[has_next[:-1]] / 1e9
+            # first event of each case and its number of events
+            starts = np.flatnonzero(np.insert(~same_case, 0, True))
+            lengths = np.diff(np.append(starts, len(times)))
+            has_start = valid & np.repeat(valid[starts], lengths)
+            elapsed[has_start] = (times - np.repeat(times[starts], lengths))[has_start] / 1e9
+            case_ends = np.maximum.reduceat(np.where(valid, times, np.iinfo(np.int64).min), starts)
+            remaining[valid] = (np.repeat(case_ends, lengths) - times)[valid] / 1e9
+
+        sorted_X['duration'] = durations
+        sorted_X['elapsed_time'] = elapsed
+        sorted_X['remaining_time'] = remaining
+        return sorted_X
+
+    return _shared(X, ("durations", case_id_col, time_col), build)
+
+
+def sparse_frame(matrix: sparse.spmatrix, index: Index, columns: List[str], fitted_columns: Optional[Index] = None,
+                 fillna: bool = True) -> DataFrame:
+    """
+    Wraps an encoded sparse matrix in a sparse DataFrame, which scikit-learn estimators accept as a sparse matrix.
+
+    Parameters
+    -------------------
+    matrix
+        the encoded (case, column) matrix
+    index
+        the case identifiers
+    columns
+        the column names of matrix
+    fitted_columns
+        the columns of the output, if already fitted: missing columns are added with 0 values and the other ones are
+        dropped
+    fillna
+        TRUE: replace NA to 0 value / FALSE: keep NA
+
+    Returns
+    ------------------
+    :rtype: DataFrame
+        the sparse DataFrame
+    """
+    matrix = sparse.csr_matrix(matrix)
+    if fillna and np.issubdtype(matrix.dtype, np.floating):
+        matrix.data = np.nan_to_num(matrix.data, nan=0)
+        matrix.eliminate_zeros()
+    if fitted_columns is None:
+        fitted_columns = Index(columns)
+    else:
+        column_idx = {col: i for i, col in enumerate(columns)}
+        matrix = sparse.hstack([matrix, sparse.csr_matrix((matrix.shape[0], 1), dtype=matrix.dtype)], format="csr")
+        matrix = matrix[:, [column_idx.get(col, len(columns)) for col in fitted_columns]]
+    return DataFrame.sparse.from_spmatrix(matrix, index=index, columns=fitted_columns)
+
+
+def dummy_matrix(values: Dict[str, np.ndarray], vocabularies: Dict[str, Index], rows: np.ndarray,
+                 n_rows: int) -> sparse.csr_matrix:
+    """
+    Counts the occurrences of the fitted values of the one-hot encoded columns in each row, as a sparse matrix with
+    the columns of pd.get_dummies on the columns cast by as_categories.
+
+    Parameters
+    -------------------
+    values
+        the values of each one-hot encoded column
+    vocabularies
+        the values learned by dummy_vocabularies
+    rows
+        the row of each value, e.g., the code of its case
+    n_rows
+        the number of rows
+
+    Returns
+    ------------------
+    :rtype: csr_matrix
+        the (row, dummy column) counts
+    """
+    row_codes, col_codes, n_dummies = [], [], 0
+    for col, categories in vocabularies.items():
+        value_codes = categories.get_indexer(values[col])
+        present = value_codes >= 0
+        row_codes.append(rows[present])
+        col_codes.append(value_codes[present] + n_dummies)
+        n_dummies += len(categories)
+    row_codes = np.concatenate(row_codes) if len(row_codes) > 0 else np.empty(0, dtype=np.int64)
+    col_codes = np.concatenate(col_codes) if len(col_codes) > 0 else np.empty(0, dtype=np.int64)
+    return sparse.coo_matrix((np.ones(len(row_codes), dtype=np.int64), (row_codes, col_codes)),
+                             shape=(n_rows, n_dummies)).tocsr()
+
+
+def state_columns(num_cols: List[str], cat_cols: List[str], vocabularies: Dict[str, Index]) -> Index:
+    """
+    Returns the columns of the encoded states of the cases: the numerical columns, the categorical columns that are
+    not one-hot encoded and the dummies of the fitted values, as pd.get_dummies lays them out.
+    """
+    return Index(num_cols + [col for col in cat_cols if col not in vocabularies] +
+                 [f"{col}_{value}" for col, values in vocabularies.items() for value in values])
+
+
+def sparse_states(dt_states: DataFrame, num_cols: List[str], cat_cols: List[str], vocabularies: Dict[str, Index],
+                  rows: np.ndarray, n_rows: int) -> sparse.csr_matrix:
+    """
+    Encodes the states of the cases (e.g., their last events) as a sparse matrix, with the columns of the dense
+    encoding: the numerical columns, the categorical columns that are not one-hot encoded and the fitted dummies.
+
+    Parameters
+    -------------------
+    dt_states
+        the state of each case, one per row
+    num_cols
+        the numerical columns
+    cat_cols
+        the categorical columns
+    vocabularies
+        the values of the one-hot encoded columns, see dummy_vocabularies
+    rows
+        the row of the output of each state
+    n_rows
+        the number of rows of the output, the missing ones being 0
+
+    Returns
+    ------------------
+    :rtype: csr_matrix
+        the encoded states
+    """
+    plain_cols = num_cols + [col for col in cat_cols if col not in vocabularies]
+    plain = sparse.coo_matrix(dt_states[plain_cols].to_numpy(dtype=float).reshape(len(dt_states), len(plain_cols)))
+    plain = sparse.csr_matrix((plain.data, (rows[plain.row], plain.col)), shape=(n_rows, len(plain_cols)))
+    dummies = dummy_matrix({col: dt_states[col].to_numpy() for col in vocabularies}, vocabularies, rows, n_rows)
+    return sparse.hstack([plain, dummies], format='csr')
+
+
+def dummy_vocabularies(X: DataFrame, cat_cols: List[str]) -> Dict[str, Index]:
+    """
+    Learns the values of the categorical columns that pd.get_dummies one-hot encodes (object, string and category
+    columns), i.e., the categories of a category column and the sorted values of the other ones.
+
+    Parameters
+    -------------------
+    X: DataFrame
+        the values to be one-hot encoded
+    cat_cols
+        the categorical columns
+
+    Returns
+    ------------------
+    :rtype: Dict[str, Index]
+        the values of each one-hot encoded column
+    """
+    vocabularies = {}
+    for col in cat_cols:
+        if pd.api.types.is_categorical_dtype(X[col]):
+            vocabularies[col] = Index(X[col].cat.categories)
+        elif pd.api.types.is_object_dtype(X[col]) or pd.api.types.is_string_dtype(X[col]):
+            vocabularies[col] = Index(pd.factorize(X[col], sort=True)[1])
+    return vocabularies
+
+
+def as_categories(X: DataFrame, vocabularies: Dict[str, Index]) -> DataFrame:
+    """
+    Casts the one-hot encoded columns to the categories learned by dummy_vocabularies, so that pd.get_dummies returns
+    exactly the fitted columns, whatever values X has: the missing values get 0 columns and the unseen ones are
+    dropped.
+    """
+    return X.astype({col: pd.CategoricalDtype(categories) for col, categories in vocabularies.items()})
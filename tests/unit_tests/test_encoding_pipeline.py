@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+import warnings
+
+from Declare4Py.D4PyEventLog import D4PyEventLog
+from Declare4Py.Encodings.ComplexIndexBased import ComplexIndexBased
+from Declare4Py.Encodings.EncodingPipeline import EncodingPipeline
+from Declare4Py.Encodings.IndexBased import IndexBased
+
+LOG_PATH = os.path.join(os.path.dirname(__file__), "..", "test_logs", "Sepsis Cases.xes.gz")
+
+
+class EncodingPipelineCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            cls.event_log = D4PyEventLog()
+            cls.event_log.parse_xes_log(LOG_PATH)
+
+    def _encoders(self):
+        case_id_col = self.event_log.get_case_name()
+        time_col = self.event_log.get_timestamp_name()
+        return [IndexBased(case_id_col, cat_cols=["concept:name"]),
+                ComplexIndexBased(case_id_col, time_col, cat_cols=["concept:name"], num_cols=["duration"])]
+
+    def test_restored_encoder_transforms_new_data(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for fitted, restored in zip(self._encoders(), self._encoders()):
+                encoded = EncodingPipeline(self.event_log, cache_dir=cache_dir).encode(fitted)
+                pipeline = EncodingPipeline(self.event_log, cache_dir=cache_dir)
+                self.assertTrue(pipeline.encode(restored).equals(encoded))
+                # the parameters learned by fit are restored too
+                self.assertEqual(restored.max_events, fitted.max_events)
+                frame = pipeline.get_frame()
+                cases = frame[fitted.case_id_col]
+                new_data = frame[cases.isin(cases.unique()[:50])].copy()
+                self.assertTrue(restored.transform(new_data).equals(fitted.transform(new_data)))
+
+
+if __name__ == "__main__":
+    unittest.main()
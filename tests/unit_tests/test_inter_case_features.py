@@ -0,0 +1,57 @@
+import os
+import unittest
+import warnings
+from collections import defaultdict, OrderedDict
+
+import pm4py
+from pm4py.objects.log.importer.xes import importer as xes_importer
+
+from Declare4Py.Encodings.FeatureEngineering.inter_case_features import InterCaseFeatures
+
+LOG_PATH = os.path.join(os.path.dirname(__file__), "..", "test_logs", "Sepsis Cases.xes.gz")
+
+
+def _loop_by_date(events, value=None):
+    """
+    The per-event loop of the features, over (date, payload) couples.
+    """
+    by_date = defaultdict(set if value else int)
+    for timestamp, payload in events:
+        if value:
+            by_date[str(timestamp.date())].add(payload)
+        else:
+            by_date[str(timestamp.date())] += 1
+    return OrderedDict(sorted((date, len(v) if value else v) for date, v in by_date.items()))
+
+
+class InterCaseFeaturesDateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            # the events of the log have different UTC offsets (+01:00 and +02:00)
+            cls.event_log = xes_importer.apply(LOG_PATH)
+            cls.event_frame = pm4py.convert_to_dataframe(cls.event_log)
+
+    def _check(self, log, events, first_events):
+        self.assertEqual(InterCaseFeatures.events_by_date(log, "time:timestamp"), _loop_by_date(events))
+        self.assertEqual(InterCaseFeatures.resources_by_date(log, "time:timestamp", "org:group"),
+                         _loop_by_date(events, value=True))
+        self.assertEqual(InterCaseFeatures.new_trace_start(log, "time:timestamp"), _loop_by_date(first_events))
+
+    def test_event_log_dates(self):
+        events = [(event["time:timestamp"], event["org:group"]) for trace in self.event_log for event in trace]
+        first_events = [(trace[0]["time:timestamp"], None) for trace in self.event_log]
+        self._check(self.event_log, events, first_events)
+
+    def test_dataframe_dates(self):
+        frame = self.event_frame
+        events = list(zip(frame["time:timestamp"], frame["org:group"]))
+        first_events = [(timestamp, None) for timestamp in
+                        frame.groupby("case:concept:name", sort=False)["time:timestamp"].first()]
+        self._check(frame, events, first_events)
+
+
+if __name__ == "__main__":
+    unittest.main()